@@ -0,0 +1,4 @@
+"""
+benchmarks
+Performance benchmarks for the rock package, run against a synthetic database.
+"""
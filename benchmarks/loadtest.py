@@ -0,0 +1,128 @@
+"""
+benchmarks/loadtest.py
+End-to-end load test of `rock.data_service.run` against the local stand-in server.
+
+Every run uses a fresh ROCK_HOME, so the user's database and caches are untouched.
+Runs are repeated for each fetch thread count and parse process count to measure
+concurrency tuning.
+
+Usage:
+    python -m benchmarks.loadtest --securities 500 --years 5 --threads 4,8,16 --parse-processes 0,4 --latency 0.05
+"""
+
+import argparse
+import json
+import os
+import sqlite3
+import subprocess
+import sys
+import tempfile
+import time
+import urllib.request
+from pathlib import Path
+from typing import Any
+from benchmarks import standin
+
+
+def _stats(server: standin.StandInServer) -> dict[str, int]:
+    with urllib.request.urlopen(f'{server.url}/stats') as response:
+        return json.load(response)
+
+
+def run_once(server: standin.StandInServer, threads: int, timeout: float,
+             parse_processes: int = 0) -> dict[str, Any]:
+    """Run the data service once against `server` and return its measurements."""
+    with tempfile.TemporaryDirectory(prefix='rock-load-') as home:
+        Path(home, 'config.json').write_text(json.dumps({
+            'USERNAME': '', 'PASSWORD': '', 'PROXY': '', 'PORT': '',
+        }), encoding='utf-8')
+        env = dict(os.environ,
+                   ROCK_HOME=home,
+                   ROCK_EASTMONEY_SEARCH_URL=server.url,
+                   ROCK_EASTMONEY_HISTORY_URL=server.url,
+                   ROCK_EASTMONEY_QUOTE_URL=server.url,
+                   ROCK_SSE_QUERY_URL=server.url,
+                   ROCK_FETCH_THREADS=str(threads),
+                   ROCK_PARSE_PROCESSES=str(parse_processes))
+
+        before = _stats(server)
+        begin = time.perf_counter()
+        process = subprocess.run(
+            [sys.executable, '-c', 'from rock import data_service; data_service.run()'],
+            env=env, capture_output=True, text=True, timeout=timeout, check=False)
+        elapsed = time.perf_counter() - begin
+        after = _stats(server)
+
+        rows = securities = 0
+        db_path = Path(home, 'rock.db')
+        if db_path.exists():
+            connection = sqlite3.connect(db_path)
+            try:
+                rows = connection.execute('SELECT COUNT(*) FROM history').fetchone()[0]
+                securities = connection.execute('SELECT COUNT(*) FROM security').fetchone()[0]
+            finally:
+                connection.close()
+
+    requests = after['requests'] - before['requests'] - 1
+    return {
+        'threads': threads,
+        'parse_processes': parse_processes,
+        'returncode': process.returncode,
+        'seconds': elapsed,
+        'securities': securities,
+        'rows': rows,
+        'rows_per_sec': rows / elapsed if elapsed > 0 else None,
+        'requests': requests,
+        'requests_per_sec': requests / elapsed if elapsed > 0 else None,
+        'server_errors': after['errors'] - before['errors'],
+        'throttled': after['throttled'] - before['throttled'],
+        'bytes': after['bytes'] - before['bytes'],
+        'stderr_tail': process.stderr.splitlines()[-5:] if process.returncode else [],
+    }
+
+
+def main(argv: list[str] | None = None) -> int:
+    """Command line entry point."""
+    parser = argparse.ArgumentParser(prog='python -m benchmarks.loadtest', description=__doc__,
+                                     formatter_class=argparse.RawDescriptionHelpFormatter)
+    parser.add_argument('--securities', type=int, default=200)
+    parser.add_argument('--years', type=int, default=5)
+    parser.add_argument('--threads', default='8', help='comma separated fetch thread counts')
+    parser.add_argument('--parse-processes', default='0',
+                        help='comma separated parse process counts')
+    parser.add_argument('--latency', type=float, default=0.0)
+    parser.add_argument('--jitter', type=float, default=0.0)
+    parser.add_argument('--error-rate', type=float, default=0.0)
+    parser.add_argument('--rate-limit', type=float, default=0.0)
+    parser.add_argument('--sse-fixture')
+    parser.add_argument('--timeout', type=float, default=3600)
+    parser.add_argument('--output', help='write JSON results to this file')
+    args = parser.parse_args(argv)
+
+    server = standin.serve_in_thread(securities=args.securities, years=args.years,
+                                     latency=args.latency, jitter=args.jitter,
+                                     error_rate=args.error_rate, rate_limit=args.rate_limit,
+                                     sse_fixture=args.sse_fixture)
+    try:
+        runs = []
+        for processes in (int(p) for p in args.parse_processes.split(',')):
+            for threads in (int(t) for t in args.threads.split(',')):
+                result = run_once(server, threads, args.timeout, processes)
+                print(f"threads={threads} parse_processes={processes}: {result['seconds']:.1f}s, "
+                      f"{result['rows']} rows, {result['requests']} requests", file=sys.stderr)
+                runs.append(result)
+    finally:
+        server.shutdown()
+        server.server_close()
+
+    document = {'params': vars(args), 'runs': runs}
+    text = json.dumps(document, indent=2)
+    if args.output:
+        Path(args.output).write_text(text, encoding='utf-8')
+    else:
+        print(text)
+    return 0 if all(r['returncode'] == 0 for r in runs) else 1
+
+
+if __name__ == '__main__':
+    sys.exit(main())
@@ -0,0 +1,297 @@
+"""
+benchmarks/run.py
+This module runs the benchmark suite and compares results between commits.
+
+Usage:
+    python -m benchmarks run --securities 5000 --years 30 --output head.json
+    python -m benchmarks compare base.json head.json
+"""
+
+import argparse
+import json
+import platform
+import random
+import sqlite3
+import statistics
+import subprocess
+import sys
+import tempfile
+import time
+from collections.abc import Callable
+from datetime import datetime
+from io import BytesIO
+from pathlib import Path
+from typing import Any
+from unittest.mock import patch
+import pandas as pd
+from benchmarks import synthetic
+from rock import data_service, stock
+from rock.data import db
+from rock.em import utils as em_utils
+from rock.exchange import exchange_sh
+
+
+SCHEMA_VERSION = 1
+
+# name -> factory; a factory prepares its inputs and returns a callable
+# that performs one timed iteration and returns the number of rows processed
+BENCHMARKS: dict[str, Callable[[argparse.Namespace, Path], Callable[[], int] | None]] = {}
+
+
+def benchmark(name: str):
+    """Register a benchmark factory under `name`."""
+    def decorator(factory):
+        BENCHMARKS[name] = factory
+        return factory
+    return decorator
+
+
+def _sample(args: argparse.Namespace) -> list[str]:
+    rng = random.Random(args.seed)
+    universe = synthetic.symbols(args.securities)
+    return rng.sample(universe, min(args.sample, len(universe)))
+
+
+@benchmark('db.bulk_insert_history')
+def bench_bulk_insert_history(args: argparse.Namespace, workdir: Path) -> Callable[[], int]:
+    """Insert `sample` securities of full history into an empty database."""
+    days = synthetic.trading_days(synthetic.EPOCH_START, synthetic.end_date(args.years))
+    rows = [synthetic.history_rows(i + 1, s, days)
+            for i, s in enumerate(synthetic.symbols(args.sample))]
+    paths = iter([synthetic.generate_db(workdir / f'insert-{i}.db', args.sample,
+                                        args.years, with_history=False)
+                  for i in range(args.repeat)])
+
+    def run() -> int:
+        with synthetic.use_db(next(paths)):
+            for r in rows:
+                db.bulk_insert_history(r)
+        return sum(len(r) for r in rows)
+    return run
+
+
+@benchmark('db.get_history')
+def bench_db_get_history(args: argparse.Namespace, _: Path) -> Callable[[], int]:
+    """Read the full history of `sample` random securities."""
+    sample = _sample(args)
+
+    def run() -> int:
+        return sum(len(rows) for rows in db.get_history(sample).values())
+    return run
+
+
+@benchmark('stock.get_history')
+def bench_stock_get_history(args: argparse.Namespace, _: Path) -> Callable[[], int]:
+    """Read the full history of `sample` random securities as DataFrames."""
+    sample = _sample(args)
+
+    def run() -> int:
+        return sum(len(df) for df in stock.get_history(sample).values())
+    return run
+
+
+@benchmark('stock.iter_history')
+def bench_stock_iter_history(_: argparse.Namespace, __: Path) -> Callable[[], int]:
+    """Stream the full history of all securities as DataFrame chunks."""
+
+    def run() -> int:
+        return sum(len(df) for df in stock.iter_history())
+    return run
+
+
+@benchmark('data_service.update_securities')
+def bench_update_securities(args: argparse.Namespace, workdir: Path) -> Callable[[], int]:
+    """Refresh the securities of a database that already holds all but 10% of them."""
+    existing = max(args.securities - args.securities // 10, 1)
+    listing = synthetic.stock_metas(args.securities)
+    paths = iter([synthetic.generate_db(workdir / f'securities-{i}.db', existing,
+                                        args.years, with_history=False)
+                  for i in range(args.repeat)])
+
+    def run() -> int:
+        with synthetic.use_db(next(paths)), \
+                patch.object(exchange_sh, 'get_a_shares', return_value=listing):
+            data_service.update_securities()
+        return len(listing)
+    return run
+
+
+@benchmark('em.parse_quote_history')
+def bench_parse_quote_history(args: argparse.Namespace, _: Path) -> Callable[[], int]:
+    """Parse `sample` full-history K-line responses."""
+    days = synthetic.trading_days(synthetic.EPOCH_START, synthetic.end_date(args.years))
+    payloads = [(synthetic.kline_payload(s, days), f'1.{s}') for s in synthetic.symbols(args.sample)]
+
+    def run() -> int:
+        return sum(len(em_utils.parse_quote_history(p, q)) for p, q in payloads)
+    return run
+
+
+@benchmark('exchange_sh.get_a_shares')
+def bench_sse_listing(args: argparse.Namespace, _: Path) -> Callable[[], int]:
+    """Convert an SSE stock list of `securities` rows into StockMeta records."""
+    listing = synthetic.sse_listing(args.securities)
+
+    def run() -> int:
+        with patch.object(exchange_sh, 'get_stock_list', return_value=listing):
+            return len(exchange_sh.get_a_shares())
+    return run
+
+
+@benchmark('exchange_sh.read_listing')
+def bench_sse_read_listing(args: argparse.Namespace, _: Path) -> Callable[[], int] | None:
+    """Decode a captured SSE commonExcelDd.do response (requires --sse-fixture)."""
+    if args.sse_fixture is None:
+        return None
+    content = Path(args.sse_fixture).read_bytes()
+
+    def run() -> int:
+        return len(pd.read_excel(BytesIO(content)))
+    return run
+
+
+def _git_revision() -> str | None:
+    try:
+        return subprocess.run(['git', 'rev-parse', 'HEAD'], capture_output=True,
+                              text=True, check=True).stdout.strip()
+    except (OSError, subprocess.CalledProcessError):
+        return None
+
+
+def _measure(run: Callable[[], int], repeat: int) -> dict[str, Any]:
+    timings = []
+    rows = 0
+    for _ in range(repeat):
+        begin = time.perf_counter()
+        rows = run()
+        timings.append(time.perf_counter() - begin)
+    best = min(timings)
+    return {
+        'timings': timings,
+        'min': best,
+        'median': statistics.median(timings),
+        'mean': statistics.fmean(timings),
+        'stdev': statistics.stdev(timings) if len(timings) > 1 else 0.0,
+        'rows': rows,
+        'rows_per_sec': rows / best if best > 0 else None,
+    }
+
+
+def run_suite(args: argparse.Namespace) -> dict[str, Any]:
+    """Run the selected benchmarks and return the result document."""
+    selected = args.only.split(',') if args.only else list(BENCHMARKS)
+    unknown = set(selected) - set(BENCHMARKS)
+    if unknown:
+        raise ValueError(f"Unknown benchmarks: {', '.join(sorted(unknown))}")
+
+    results = {}
+    with tempfile.TemporaryDirectory(prefix='rock-bench-') as tmp:
+        workdir = Path(tmp)
+        db_path = Path(args.db) if args.db else workdir / 'synthetic.db'
+        begin = time.perf_counter()
+        synthetic.generate_db(db_path, args.securities, args.years)
+        print(f'synthetic database ready in {time.perf_counter() - begin:.1f}s: {db_path}',
+              file=sys.stderr)
+
+        with synthetic.use_db(db_path):
+            for name in selected:
+                run = BENCHMARKS[name](args, workdir)
+                if run is None:
+                    print(f'{name}: skipped', file=sys.stderr)
+                    continue
+                results[name] = _measure(run, args.repeat)
+                print(f"{name}: median {results[name]['median']:.4f}s "
+                      f"({results[name]['rows']} rows)", file=sys.stderr)
+
+    return {
+        'schema': SCHEMA_VERSION,
+        'meta': {
+            'revision': _git_revision(),
+            'created_at': datetime.now().isoformat(timespec='seconds'),
+            'python': platform.python_version(),
+            'sqlite': sqlite3.sqlite_version,
+            'platform': platform.platform(),
+            'params': {
+                'securities': args.securities,
+                'years': args.years,
+                'sample': args.sample,
+                'repeat': args.repeat,
+                'seed': args.seed,
+            },
+        },
+        'results': results,
+    }
+
+
+def compare(base: dict[str, Any], head: dict[str, Any], threshold: float) -> list[str]:
+    """
+    Print a comparison of two result documents and
+    return the names of benchmarks whose median regressed by more than `threshold`.
+    """
+    if base['meta']['params'] != head['meta']['params']:
+        print('warning: results were produced with different parameters', file=sys.stderr)
+
+    regressions = []
+    print(f"{'benchmark':<34}{'base':>12}{'head':>12}{'change':>10}")
+    for name in sorted(set(base['results']) | set(head['results'])):
+        b = base['results'].get(name)
+        h = head['results'].get(name)
+        if b is None or h is None:
+            print(f"{name:<34}{'-' if b is None else format(b['median'], '.4f'):>12}"
+                  f"{'-' if h is None else format(h['median'], '.4f'):>12}{'n/a':>10}")
+            continue
+        change = (h['median'] - b['median']) / b['median'] if b['median'] else 0.0
+        flag = ''
+        if change > threshold:
+            regressions.append(name)
+            flag = '  REGRESSION'
+        print(f"{name:<34}{b['median']:>12.4f}{h['median']:>12.4f}{change:>+10.1%}{flag}")
+    return regressions
+
+
+def main(argv: list[str] | None = None) -> int:
+    """Command line entry point."""
+    parser = argparse.ArgumentParser(prog='python -m benchmarks', description=__doc__,
+                                     formatter_class=argparse.RawDescriptionHelpFormatter)
+    sub = parser.add_subparsers(dest='command', required=True)
+
+    run_parser = sub.add_parser('run', help='run the benchmark suite')
+    run_parser.add_argument('--securities', type=int, default=500)
+    run_parser.add_argument('--years', type=int, default=5)
+    run_parser.add_argument('--sample', type=int, default=50,
+                            help='securities per read/insert/parse benchmark')
+    run_parser.add_argument('--repeat', type=int, default=3)
+    run_parser.add_argument('--seed', type=int, default=0)
+    run_parser.add_argument('--db', help='reuse (or create) the synthetic database at this path')
+    run_parser.add_argument('--only', help='comma separated benchmark names')
+    run_parser.add_argument('--sse-fixture', help='captured commonExcelDd.do response')
+    run_parser.add_argument('--output', help='write JSON results to this file')
+    run_parser.add_argument('--list', action='store_true', help='list benchmarks and exit')
+
+    compare_parser = sub.add_parser('compare', help='compare two result files')
+    compare_parser.add_argument('base')
+    compare_parser.add_argument('head')
+    compare_parser.add_argument('--threshold', type=float, default=0.10,
+                                help='relative median slowdown reported as a regression')
+
+    args = parser.parse_args(argv)
+
+    if args.command == 'compare':
+        with open(args.base, encoding='utf-8') as f:
+            base = json.load(f)
+        with open(args.head, encoding='utf-8') as f:
+            head = json.load(f)
+        return 1 if compare(base, head, args.threshold) else 0
+
+    if args.list:
+        for name, factory in BENCHMARKS.items():
+            print(f'{name:<34}{factory.__doc__}')
+        return 0
+
+    document = run_suite(args)
+    text = json.dumps(document, indent=2)
+    if args.output:
+        Path(args.output).write_text(text, encoding='utf-8')
+    else:
+        print(text)
+    return 0
@@ -0,0 +1,258 @@
+"""
+benchmarks/standin.py
+A local HTTP stand-in for the EastMoney and SSE endpoints used by rock.
+
+It serves the search-suggest, K-line, market list and SSE `commonExcelDd.do`
+endpoints from deterministic synthetic data, with configurable latency, error
+rate and throttling. Point rock at it with the ROCK_EASTMONEY_SEARCH_URL,
+ROCK_EASTMONEY_HISTORY_URL, ROCK_EASTMONEY_QUOTE_URL and ROCK_SSE_QUERY_URL
+settings and an empty PROXY.
+
+Usage:
+    python -m benchmarks.standin --port 8765 --securities 5000 --years 30 --latency 0.05
+"""
+
+import argparse
+import json
+import random
+import threading
+import time
+from functools import lru_cache
+from http.server import BaseHTTPRequestHandler, ThreadingHTTPServer
+from io import BytesIO
+from pathlib import Path
+from urllib.parse import parse_qs, urlparse
+import numpy as np
+from benchmarks import synthetic
+
+
+class TokenBucket:
+    """A thread-safe token bucket; a rate of 0 disables throttling."""
+
+    def __init__(self, rate: float, burst: float | None = None):
+        self.rate = rate
+        self.capacity = burst if burst is not None else max(rate, 1.0)
+        self._tokens = self.capacity
+        self._last = time.monotonic()
+        self._lock = threading.Lock()
+
+    def take(self) -> bool:
+        """Take a token, returning False if the bucket is empty."""
+        if self.rate <= 0:
+            return True
+        with self._lock:
+            now = time.monotonic()
+            self._tokens = min(self.capacity, self._tokens + (now - self._last) * self.rate)
+            self._last = now
+            if self._tokens < 1:
+                return False
+            self._tokens -= 1
+            return True
+
+
+class StandInServer(ThreadingHTTPServer):
+    """HTTP server holding the synthetic dataset and fault-injection settings."""
+
+    daemon_threads = True
+
+    def __init__(self, address: tuple[str, int], securities: int = 500, years: int = 5,
+                 latency: float = 0.0, jitter: float = 0.0, error_rate: float = 0.0,
+                 rate_limit: float = 0.0, sse_fixture: str | None = None, seed: int = 0):
+        super().__init__(address, StandInHandler)
+        self.symbols = set(synthetic.symbols(securities))
+        self.days = synthetic.recent_days(years)
+        self.latency = latency
+        self.jitter = jitter
+        self.error_rate = error_rate
+        self.bucket = TokenBucket(rate_limit)
+        self.sse_fixture = sse_fixture
+        self.random = random.Random(seed)
+        self.stats = {'requests': 0, 'errors': 0, 'throttled': 0, 'bytes': 0}
+        self.stats_lock = threading.Lock()
+        self._securities = securities
+        self._quotes: list[dict] | None = None
+
+    @property
+    def url(self) -> str:
+        """Base URL of the server."""
+        host, port = self.server_address[:2]
+        return f'http://{host}:{port}'
+
+    def count(self, key: str, value: int = 1) -> None:
+        """Increase a statistics counter."""
+        with self.stats_lock:
+            self.stats[key] += value
+
+    @property
+    def quotes(self) -> list[dict]:
+        """The market list quotes of all symbols on the last day, in symbol order."""
+        with self.stats_lock:
+            if self._quotes is None:
+                self._quotes = [synthetic.snapshot_quote(symbol, self.days) for symbol in sorted(self.symbols)]
+            return self._quotes
+
+    def listing(self) -> bytes:
+        """Return the SSE stock list as an Excel workbook."""
+        if self.sse_fixture is not None:
+            return Path(self.sse_fixture).read_bytes()
+        return _listing_workbook(self._securities)
+
+
+@lru_cache(maxsize=4)
+def _listing_workbook(securities: int) -> bytes:
+    try:
+        import xlwt  # pylint: disable=import-outside-toplevel
+    except ImportError as e:
+        raise RuntimeError(
+            "xlwt is required to synthesize the SSE listing, install it or pass --sse-fixture"
+        ) from e
+    df = synthetic.sse_listing(securities)
+    workbook = xlwt.Workbook(encoding='utf-8')
+    sheet = workbook.add_sheet('sheet1')
+    for c, column in enumerate(df.columns):
+        sheet.write(0, c, column)
+        for r, value in enumerate(df[column].tolist(), start=1):
+            sheet.write(r, c, value)
+    buffer = BytesIO()
+    workbook.save(buffer)
+    return buffer.getvalue()
+
+
+class StandInHandler(BaseHTTPRequestHandler):
+    """Request handler serving the stand-in endpoints."""
+
+    server: StandInServer
+    protocol_version = 'HTTP/1.1'
+
+    def log_message(self, format, *args):  # pylint: disable=redefined-builtin
+        pass
+
+    def do_GET(self):  # pylint: disable=invalid-name
+        """Dispatch a GET request."""
+        server = self.server
+        server.count('requests')
+        url = urlparse('/' + self.path.lstrip('/'))
+        query = {k: v[-1] for k, v in parse_qs(url.query).items()}
+
+        if url.path == '/stats':
+            with server.stats_lock:
+                body = json.dumps(server.stats).encode()
+            self._send(200, body, 'application/json')
+            return
+
+        if server.latency or server.jitter:
+            time.sleep(max(0.0, server.latency + server.random.uniform(-server.jitter, server.jitter)))
+        if not server.bucket.take():
+            server.count('throttled')
+            self._send(429, b'Too Many Requests', 'text/plain')
+            return
+        if server.error_rate and server.random.random() < server.error_rate:
+            server.count('errors')
+            self._send(500, b'Internal Server Error', 'text/plain')
+            return
+
+        match url.path.rstrip('/'):
+            case '/api/suggest/get':
+                self._send(200, self._suggest(query), 'application/json')
+            case '/api/qt/stock/kline/get':
+                self._send(200, self._kline(query), 'application/json')
+            case '/api/qt/clist/get':
+                self._send(200, self._clist(query), 'application/json')
+            case '/sseQuery/commonExcelDd.do':
+                self._send(200, server.listing(), 'application/vnd.ms-excel')
+            case _:
+                self._send(404, b'Not Found', 'text/plain')
+
+    def _send(self, status: int, body: bytes, content_type: str) -> None:
+        self.send_response(status)
+        self.send_header('Content-Type', content_type)
+        self.send_header('Content-Length', str(len(body)))
+        self.end_headers()
+        self.wfile.write(body)
+        self.server.count('bytes', len(body))
+
+    def _suggest(self, query: dict[str, str]) -> bytes:
+        code = query.get('input', '')
+        data = None
+        if code in self.server.symbols:
+            market = '1' if code.startswith('6') else '0'
+            data = [{
+                'Code': code,
+                'Name': f'Synthetic {code}',
+                'PinYin': 'SYN',
+                'ID': f'{code}{market}',
+                'JYS': '2',
+                'Classify': 'AStock',
+                'MarketType': market,
+                'SecurityTypeName': '沪A',
+                'SecurityType': '1',
+                'MktNum': market,
+                'TypeUS': '2',
+                'QuoteID': f'{market}.{code}',
+                'UnifiedCode': code,
+                'InnerCode': code,
+            }]
+        return json.dumps({'QuotationCodeTable': {'Data': data}}).encode('utf-8')
+
+    def _kline(self, query: dict[str, str]) -> bytes:
+        code = query.get('secid', '').split('.')[-1]
+        if code not in self.server.symbols:
+            return json.dumps({'rc': 0, 'data': None}).encode('utf-8')
+        return synthetic.kline_payload(code, self.server.days,
+                                       _parse_date(query.get('beg')), _parse_date(query.get('end')))
+
+
+    def _clist(self, query: dict[str, str]) -> bytes:
+        quotes = self.server.quotes
+        size = int(query.get('pz', '20'))
+        page = max(1, int(query.get('pn', '1')))
+        diff = quotes[(page - 1) * size:page * size]
+        data = {'total': len(quotes), 'diff': diff} if diff else None
+        return json.dumps({'rc': 0, 'data': data}, ensure_ascii=False).encode('utf-8')
+
+
+def _parse_date(value: str | None) -> np.datetime64 | None:
+    if not value or len(value) != 8 or not value.isdigit():
+        return None
+    return np.datetime64(f'{value[:4]}-{value[4:6]}-{value[6:]}', 'D')
+
+
+def serve_in_thread(**kwargs) -> StandInServer:
+    """Start a stand-in server on a free local port in a daemon thread."""
+    server = StandInServer(('127.0.0.1', 0), **kwargs)
+    threading.Thread(target=server.serve_forever, daemon=True).start()
+    return server
+
+
+def main(argv: list[str] | None = None) -> None:
+    """Command line entry point."""
+    parser = argparse.ArgumentParser(prog='python -m benchmarks.standin', description=__doc__,
+                                     formatter_class=argparse.RawDescriptionHelpFormatter)
+    parser.add_argument('--host', default='127.0.0.1')
+    parser.add_argument('--port', type=int, default=8765)
+    parser.add_argument('--securities', type=int, default=500)
+    parser.add_argument('--years', type=int, default=5)
+    parser.add_argument('--latency', type=float, default=0.0, help='seconds added to each response')
+    parser.add_argument('--jitter', type=float, default=0.0, help='+/- seconds of random latency')
+    parser.add_argument('--error-rate', type=float, default=0.0,
+                        help='fraction of requests answered with HTTP 500')
+    parser.add_argument('--rate-limit', type=float, default=0.0,
+                        help='requests per second before answering HTTP 429, 0 to disable')
+    parser.add_argument('--sse-fixture', help='serve this captured SSE listing instead')
+    parser.add_argument('--seed', type=int, default=0)
+    args = parser.parse_args(argv)
+
+    server = StandInServer((args.host, args.port), securities=args.securities, years=args.years,
+                           latency=args.latency, jitter=args.jitter, error_rate=args.error_rate,
+                           rate_limit=args.rate_limit, sse_fixture=args.sse_fixture, seed=args.seed)
+    print(f'serving on {server.url}')
+    try:
+        server.serve_forever()
+    except KeyboardInterrupt:
+        pass
+    finally:
+        server.server_close()
+
+
+if __name__ == '__main__':
+    main()
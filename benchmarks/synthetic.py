@@ -0,0 +1,208 @@
+"""
+benchmarks/synthetic.py
+This module generates deterministic synthetic market data for benchmarks.
+"""
+
+import json
+import zlib
+from contextlib import contextmanager
+from pathlib import Path
+from typing import Iterator
+import numpy as np
+import pandas as pd
+from rock.data import db
+from rock.exchange.common import StockMeta
+
+
+FIRST_SYMBOL = 600000
+EPOCH_START = '1995-01-01'
+
+
+def symbols(count: int) -> list[str]:
+    """Return `count` synthetic six-digit symbols."""
+    return [str(FIRST_SYMBOL + i) for i in range(count)]
+
+
+def trading_days(start: str, end: str) -> np.ndarray:
+    """Return business days in [start, end) as datetime64[D]."""
+    days = np.arange(np.datetime64(start, 'D'), np.datetime64(end, 'D'))
+    return days[np.is_busday(days)]
+
+
+def end_date(years: int, start: str = EPOCH_START) -> str:
+    """Return the date `years` years after `start`."""
+    s = np.datetime64(start, 'D')
+    return str(s + np.timedelta64(int(years * 365.25), 'D'))
+
+
+def recent_days(years: int) -> np.ndarray:
+    """Return business days of the last `years` years up to and including today."""
+    today = np.datetime64('today', 'D')
+    return trading_days(str(today - np.timedelta64(int(years * 365.25), 'D')),
+                        str(today + 1))
+
+
+def generate_bars(symbol: str, days: np.ndarray) -> dict[str, np.ndarray]:
+    """
+    Generate a deterministic random-walk OHLCV series for a symbol.
+    The same symbol always yields the same series, so generated databases
+    and stand-in responses stay comparable between runs.
+    """
+    rng = np.random.default_rng(zlib.crc32(symbol.encode()))
+    n = len(days)
+    close = np.round(10 * np.exp(np.cumsum(rng.normal(0, 0.02, n))), 2)
+    close = np.maximum(close, 0.01)
+    open_ = np.round(close * (1 + rng.normal(0, 0.005, n)), 2)
+    high = np.round(np.maximum(open_, close) * (1 + np.abs(rng.normal(0, 0.01, n))), 2)
+    low = np.round(np.minimum(open_, close) * (1 - np.abs(rng.normal(0, 0.01, n))), 2)
+    low = np.maximum(low, 0.01)
+    volume = rng.integers(1_000, 10_000_000, n)
+    amount = (volume * close).astype(np.int64)
+    return {
+        'datetime': days,
+        'open': open_,
+        'close': close,
+        'high': high,
+        'low': low,
+        'volume': volume,
+        'amount': amount,
+    }
+
+
+def history_rows(security_id: int, symbol: str, days: np.ndarray) -> list[tuple]:
+    """Return synthetic bars in the row format of `db.bulk_insert_history`."""
+    bars = generate_bars(symbol, days)
+    return list(zip(
+        [security_id] * len(days),
+        np.datetime_as_string(bars['datetime']).tolist(),
+        bars['open'].tolist(),
+        bars['close'].tolist(),
+        bars['high'].tolist(),
+        bars['low'].tolist(),
+        bars['close'].tolist(),
+        bars['volume'].tolist(),
+        bars['amount'].tolist(),
+        ['1d'] * len(days),
+    ))
+
+
+def stock_metas(count: int) -> list[StockMeta]:
+    """Return synthetic listings as returned by exchange `get_a_shares`."""
+    return [StockMeta(symbol=s, name=f'Synthetic {s}', listing='1990-12-19', delisting=None)
+            for s in symbols(count)]
+
+
+def sse_listing(count: int) -> pd.DataFrame:
+    """Return a synthetic SSE stock list in the shape of `exchange_sh.get_stock_list`."""
+    codes = [int(s) for s in symbols(count)]
+    return pd.DataFrame({
+        'A股代码': codes,
+        'B股代码': ['-'] * count,
+        '证券简称': [f'Synthetic {c}' for c in codes],
+        '扩位证券简称': [f'Synthetic {c}' for c in codes],
+        '公司英文全称': ['-'] * count,
+        '上市日期': [19901219] * count,
+        '原公司代码': codes,
+        '原公司简称': [f'Synthetic {c}' for c in codes],
+        '终止上市日期': ['-'] * count,
+    })
+
+
+def kline_payload(symbol: str, days: np.ndarray, beg: np.datetime64 | None = None,
+                  end: np.datetime64 | None = None, name: str | None = None) -> bytes:
+    """
+    Return a synthetic EastMoney K-line response body.
+    Bars are generated over `days` and then limited to [beg, end], so a range
+    request returns the same values as the full history for those dates.
+    """
+    bars = generate_bars(symbol, days)
+    prev = np.concatenate(([bars['close'][0]], bars['close'][:-1]))
+    mask = np.ones(len(days), dtype=bool)
+    if beg is not None:
+        mask &= days >= beg
+    if end is not None:
+        mask &= days <= end
+    bars = {k: v[mask] for k, v in bars.items()}
+    prev = prev[mask]
+    change = np.round(bars['close'] - prev, 2)
+    pct = np.round(change / prev * 100, 2)
+    amplitude = np.round((bars['high'] - bars['low']) / prev * 100, 2)
+    klines = [
+        f'{d},{o:.2f},{c:.2f},{h:.2f},{l:.2f},{v},{a}.0,{amp:.2f},{p:.2f},{ch:.2f},1.00'
+        for d, o, c, h, l, v, a, amp, p, ch in zip(
+            np.datetime_as_string(bars['datetime']).tolist(),
+            bars['open'].tolist(), bars['close'].tolist(),
+            bars['high'].tolist(), bars['low'].tolist(),
+            bars['volume'].tolist(), bars['amount'].tolist(),
+            amplitude.tolist(), pct.tolist(), change.tolist())
+    ]
+    market = 1 if symbol.startswith('6') else 0
+    return json.dumps({
+        'rc': 0,
+        'data': {
+            'code': symbol,
+            'market': market,
+            'name': name or f'Synthetic {symbol}',
+            'klines': klines,
+        },
+    }, ensure_ascii=False).encode('utf-8')
+
+
+def snapshot_quote(symbol: str, days: np.ndarray) -> dict:
+    """
+    Return the synthetic EastMoney market list quote of a symbol on the last of
+    `days`, matching its last K-line bar.
+    """
+    bars = generate_bars(symbol, days)
+    previous = bars['close'][-2] if len(days) > 1 else bars['close'][-1]
+    # quotes are stamped at the close, 15:00 in China
+    updated = (days[-1].astype('datetime64[s]') + np.timedelta64(7, 'h')).astype(np.int64)
+    return {
+        'f12': symbol,
+        'f14': f'Synthetic {symbol}',
+        'f17': float(bars['open'][-1]),
+        'f2': float(bars['close'][-1]),
+        'f15': float(bars['high'][-1]),
+        'f16': float(bars['low'][-1]),
+        'f18': float(previous),
+        'f5': int(bars['volume'][-1]),
+        'f6': float(bars['amount'][-1]),
+        'f124': int(updated),
+    }
+
+
+@contextmanager
+def use_db(path: str | Path) -> Iterator[Path]:
+    """Temporarily point `rock.data.db` at another database file."""
+    original = db.DB_PATH
+    db.DB_PATH = Path(path)
+    try:
+        yield db.DB_PATH
+    finally:
+        db.DB_PATH = original
+
+
+def generate_db(path: str | Path, securities: int, years: int,
+                with_history: bool = True) -> Path:
+    """
+    Generate a synthetic database at `path` with `securities` stocks and
+    `years` years of daily bars each. An existing file is reused as is.
+    """
+    path = Path(path)
+    if path.exists():
+        return path
+
+    days = trading_days(EPOCH_START, end_date(years))
+    with use_db(path):
+        db.create_db()
+        db.insert_exchange('Shanghai Stock Exchange', 'SSE', 'stock')
+        exchange_id = db.get_exchange_id('SSE')
+        db.insert_securities([
+            (meta.symbol, meta.name, 'stock', meta.listing, meta.delisting, exchange_id)
+            for meta in stock_metas(securities)
+        ])
+        if with_history:
+            for security in db.get_all_securities():
+                db.bulk_insert_history(
+                    history_rows(int(security['id']), security['symbol'], days))
+    return path
@@ -0,0 +1,76 @@
+"""
+rock/adjustment.py
+This module derives the price adjustment factors of corporate actions from
+unadjusted bars, and adjusts prices with them when they are read.
+
+EastMoney gives the change of a bar (涨跌额) from the reference close of the
+exchange, which on an ex-date is the previous close less the dividend and
+scaled by splits and rights issues. Where the reference differs from the
+previous close, their ratio is the adjustment of the event. The backward
+factor of a bar is the product of the ratios of all events up to it, so
+backward adjusted prices do not change when new events happen, and forward
+adjusted prices are backward adjusted ones divided by the latest factor.
+"""
+from enum import StrEnum
+import numpy as np
+
+# Prices are quoted in fen, so a reference closer to the previous close than
+# half a fen is the previous close
+TOLERANCE = 0.005
+
+# The columns of a history adjusted by the factors
+ADJUSTED_COLUMNS = ('open', 'close', 'high', 'low')
+
+
+class Adjust(StrEnum):
+    """How prices are adjusted for corporate actions."""
+    NONE = 'none'
+    # prices are continuous with the latest ones
+    FORWARD = 'forward'
+    # prices are continuous with the first ones
+    BACKWARD = 'backward'
+
+
+def backward_factors(close: np.ndarray, change: np.ndarray, previous_close: float | np.ndarray = np.nan,
+                     factor: float | np.ndarray = 1.0) -> np.ndarray:
+    """
+    Compute the backward adjustment factor of each bar, along the last axis.
+    Args:
+        close (np.ndarray): The unadjusted closes in order.
+        change (np.ndarray): The changes of the closes from their reference closes.
+        previous_close (float | np.ndarray): The close of the bar before the first one,
+            NaN if there is none, of each series.
+        factor (float | np.ndarray): The factor of the bar before the first one of each series.
+    Returns:
+        np.ndarray: The factors, which change on the bars of corporate actions.
+    """
+    close = np.asarray(close, dtype=np.float64)
+    first = np.broadcast_to(np.asarray(previous_close, dtype=np.float64)[..., None], close.shape[:-1] + (1,))
+    previous = np.concatenate((first, close[..., :-1]), axis=-1)
+    reference = close - np.asarray(change, dtype=np.float64)
+    with np.errstate(invalid='ignore', divide='ignore'):
+        event = (np.abs(reference - previous) >= TOLERANCE) & (reference > 0)
+        ratio = np.where(event, previous / reference, 1.0)
+    return np.asarray(factor, dtype=np.float64)[..., None] * np.cumprod(ratio, axis=-1)
+
+
+def factors(datetimes: np.ndarray, event_datetimes: np.ndarray, event_factors: np.ndarray,
+            adjust: Adjust) -> np.ndarray:
+    """
+    Get the factors adjusting the prices of bars at `datetimes`.
+    Args:
+        datetimes (np.ndarray): The datetimes of the bars.
+        event_datetimes (np.ndarray): The datetimes of the corporate actions in order.
+        event_factors (np.ndarray): The backward factors from each corporate action on.
+        adjust (Adjust): The adjustment.
+    Returns:
+        np.ndarray: The factor to multiply the prices of each bar with.
+    """
+    if adjust == Adjust.NONE or not len(event_factors):
+        return np.ones(len(datetimes))
+    event_factors = np.asarray(event_factors, dtype=np.float64)
+    index = np.searchsorted(event_datetimes, datetimes, side='right') - 1
+    result = np.where(index >= 0, event_factors[np.maximum(index, 0)], 1.0)
+    if adjust == Adjust.FORWARD:
+        result /= event_factors[-1]
+    return result
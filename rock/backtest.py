@@ -0,0 +1,234 @@
+"""
+rock/backtest.py
+This module backtests signal strategies over a panel of symbols × dates with
+array operations, for many parameter combinations in one pass.
+
+A strategy is a signal giving the target weight of each symbol, from 0 to 1,
+decided at the close of a day and traded at the open of the next one. Each
+symbol is traded with an equal share of the capital. The simulation steps
+through time once for all combinations and symbols together and applies the
+A-share rules: trades pay commission, stamp duty on sales and slippage, buys
+are refused at limit-up and sales at limit-down, and shares bought on a day
+can only be sold from the next day (T+1), which binds intraday stop losses.
+Returns are of prices adjusted for corporate actions by the `adj_close` field,
+so ex-dates do not book gaps, while price limits apply to the raw prices.
+"""
+import itertools
+from collections.abc import Callable, Mapping, Sequence
+from typing import Any, NamedTuple
+import numpy as np
+import pandas as pd
+from rock import screen
+from rock.panel import Panel
+
+# Trading days per year, to annualize returns
+TRADING_DAYS = 245
+
+# ChiNext moved from 10% to 20% daily price limits on this day
+CHINEXT_REFORM = np.datetime64('2020-08-24')
+
+
+class Costs(NamedTuple):
+    """Trading costs as fractions of the traded value."""
+    commission: float = 0.00025
+    # charged on sales only
+    stamp_duty: float = 0.0005
+    slippage: float = 0.0005
+
+
+class Result(NamedTuple):
+    """
+    The results of a backtest. `positions` and `returns` have the shape
+    (combinations, symbols, dates), or are None without details; `portfolio`
+    has the daily returns of each combination over all symbols.
+    """
+    params: list[dict[str, Any]]
+    symbols: list[str]
+    dates: np.ndarray
+    positions: np.ndarray | None
+    returns: np.ndarray | None
+    portfolio: np.ndarray
+    trades: np.ndarray
+    blocked: np.ndarray
+
+    def summary(self) -> pd.DataFrame:
+        """Performance of each parameter combination."""
+        equity = np.cumprod(1 + self.portfolio, axis=1)
+        days = max(self.portfolio.shape[1], 1)
+        std = self.portfolio.std(axis=1)
+        with np.errstate(divide='ignore', invalid='ignore'):
+            sharpe = np.where(std > 0, self.portfolio.mean(axis=1) / std * np.sqrt(TRADING_DAYS), np.nan)
+        total = equity[:, -1] - 1 if equity.shape[1] else np.zeros(len(self.params))
+        peak = np.maximum.accumulate(equity, axis=1)
+        return pd.DataFrame({
+            **pd.DataFrame(self.params).to_dict('list'),
+            'total_return': total,
+            'annual_return': (1 + total) ** (TRADING_DAYS / days) - 1,
+            'sharpe': sharpe,
+            'max_drawdown': (1 - equity / peak).max(axis=1) if equity.shape[1] else 0.0,
+            'trades': self.trades,
+            'blocked': self.blocked,
+        })
+
+
+def price_limits(symbols: Sequence[str], dates: np.ndarray) -> np.ndarray:
+    """
+    Daily price limits of `symbols` on `dates` as fractions of the previous
+    close by board: 20% on STAR and on ChiNext since its reform, 30% on the
+    Beijing exchange and 10% elsewhere. ST stocks are not told apart.
+    """
+    limits = np.full((len(symbols), len(dates)), 0.1)
+    for i, symbol in enumerate(symbols):
+        if symbol.startswith(('688', '689')):
+            limits[i] = 0.2
+        elif symbol.startswith(('300', '301')):
+            limits[i, dates >= CHINEXT_REFORM] = 0.2
+        elif symbol.startswith(('4', '8', '92')):
+            limits[i] = 0.3
+    return limits
+
+
+def _forward_fill(values: np.ndarray) -> np.ndarray:
+    """Fill missing values along time with the last value before them."""
+    index = np.where(np.isnan(values), 0, np.arange(values.shape[1]))
+    np.maximum.accumulate(index, axis=1, out=index)
+    return np.take_along_axis(values, index, axis=1)
+
+
+def parameter_grid(params: Mapping[str, Sequence[Any]] | Sequence[dict[str, Any]] | None
+                   ) -> list[dict[str, Any]]:
+    """Every combination of the values of each parameter, or the given combinations."""
+    if not params:
+        return [{}]
+    if not isinstance(params, Mapping):
+        return [dict(combination) for combination in params]
+    return [dict(zip(params, values)) for values in itertools.product(*params.values())]
+
+
+def _targets(signal: Callable[..., np.ndarray] | str, panel: Panel, combination: dict[str, Any]) -> np.ndarray:
+    """The target weights of a signal for one parameter combination."""
+    if isinstance(signal, str):
+        target = screen.evaluate(signal.format(**combination), panel)
+    else:
+        target = signal(panel, **combination)
+    target = np.asarray(target, dtype=np.float64)
+    if target.shape != panel['close'].shape:
+        raise ValueError(f'signal returned shape {target.shape}, expected {panel["close"].shape}')
+    return np.clip(target, 0.0, 1.0)
+
+
+def backtest(signal: Callable[..., np.ndarray] | str, panel: Panel,
+             params: Mapping[str, Sequence[Any]] | Sequence[dict[str, Any]] | None = None, costs: Costs = Costs(),
+             limits: np.ndarray | None = None, detail: bool = True) -> Result:
+    """
+    Backtest a signal over a panel for every combination of parameters.
+    Args:
+        signal (Callable | str): A function of the panel and the parameters of a combination
+            returning target weights of (symbols, dates), or a `rock.screen` expression, formatted
+            with the parameters, holding a symbol while it is true. NaN keeps the current weight.
+        panel (Panel): The history, with open, high, low and close fields, and adj_close
+            to adjust returns for corporate actions.
+        params (Mapping[str, Sequence] | Sequence[dict] | None): Values of each parameter, all
+            combinations are run, or the list of combinations to run.
+            The `stop_loss` parameter is not passed to the signal: it sells positions bought
+            on previous days during the day they fall by that fraction below their entry price.
+        costs (Costs): Trading costs.
+        limits (np.ndarray | None): Daily price limits of (symbols, dates), by board if None.
+        detail (bool): Whether to keep the positions and returns of each symbol, or only
+            the portfolio returns, which takes far less memory for large grids.
+    Returns:
+        Result: The positions, returns and performance of each combination.
+    """
+    combinations = parameter_grid(params)
+    symbols, dates = len(panel.symbols), len(panel.dates)
+    if limits is None:
+        limits = price_limits(panel.symbols, panel.dates)
+
+    # combinations differing only by stop loss share their signal
+    signals: dict[tuple, np.ndarray] = {}
+    for combination in combinations:
+        signal_params = {k: v for k, v in combination.items() if k != 'stop_loss'}
+        key = tuple(signal_params.items())
+        if key not in signals:
+            signals[key] = _targets(signal, panel, signal_params)
+    stop_loss = np.array([[combination.get('stop_loss') or np.nan] for combination in combinations])
+
+    # prices scaled by `scale` are adjusted backward, continuous over corporate actions
+    adjusted = panel['adj_close'] if 'adj_close' in panel.fields else panel['close']
+    with np.errstate(invalid='ignore', divide='ignore'):
+        scale = adjusted / panel['close']
+    scale = np.where(np.isfinite(scale) & (scale > 0), scale, 1.0)
+    # the adjusted close of the last bar before each day
+    previous_close = np.full((symbols, dates), np.nan)
+    previous_close[:, 1:] = _forward_fill(panel['close'] * scale)[:, :-1]
+    # limits are set from the previous close in the prices of the day, lowered on ex-dates
+    reference = previous_close / scale
+    # the simulation steps through time, so arrays are laid out time first
+    open_, high, low, close = (np.ascontiguousarray(panel[field].T) for field in ('open', 'high', 'low', 'close'))
+    up_limit = np.round(reference * (1 + limits), 2).T.copy()
+    down_limit = np.round(reference * (1 - limits), 2).T.copy()
+    previous_close = previous_close.T.copy()
+    scale = scale.T.copy()
+    targets = np.empty((dates, len(combinations), symbols))
+    for i, combination in enumerate(combinations):
+        key = tuple((k, v) for k, v in combination.items() if k != 'stop_loss')
+        targets[:, i] = signals[key].T
+
+    shape = (len(combinations), symbols)
+    weight = np.zeros(shape)
+    entry = np.full(shape, np.nan)
+    trades = np.zeros(shape, dtype=np.int64)
+    blocked = np.zeros(shape, dtype=np.int64)
+    positions = np.zeros((dates,) + shape) if detail else None
+    returns = np.zeros((dates,) + shape) if detail else None
+    portfolio = np.zeros((len(combinations), dates))
+    trade_cost = costs.commission + costs.slippage
+
+    with np.errstate(invalid='ignore', divide='ignore'):
+        for t in range(dates):
+            o, h, l, c = open_[t], high[t], low[t], close[t]
+            # adjusted prices of the day
+            s = scale[t]
+            adjusted_open, adjusted_close = o * s, c * s
+            bar = ~np.isnan(o)
+            target = targets[t - 1] if t > 0 else weight
+            target = np.where(np.isnan(target), weight, target)
+
+            # trades at the open, refused at the price limits
+            buy = bar & (target > weight) & ~(o >= up_limit[t])
+            sell = bar & (target < weight) & ~(o <= down_limit[t])
+            blocked += bar & (target != weight) & ~(buy | sell)
+            traded = np.where(buy | sell, target, weight)
+            change = traded - weight
+            bought, sold = np.maximum(change, 0), np.maximum(-change, 0)
+            cost = np.abs(change) * trade_cost + sold * costs.stamp_duty
+            entry = np.where(buy & (weight == 0), adjusted_open, entry)
+            trades += (buy | sell)
+
+            # stop losses sell what was held before today, unless locked at limit-down
+            held = np.minimum(weight, traded)
+            level = entry * (1 - stop_loss)
+            stopped = np.where(bar & (held > 0) & (l * s <= level) & ~(h <= down_limit[t]), held, 0.0)
+            price = np.fmax(np.minimum(adjusted_open, level), down_limit[t] * s)
+            cost += stopped * (trade_cost + costs.stamp_duty)
+            trades += stopped > 0
+
+            # returns on the capital at the previous close
+            last = previous_close[t]
+            day = ((held - stopped) * (adjusted_close / last - 1) + stopped * (price / last - 1)
+                   + bought * (c / o - 1) + sold * (adjusted_open / last - 1))
+            weight = traded - stopped
+            entry = np.where(weight > 0, entry, np.nan)
+            # a missing bar or a first close leaves NaN for zero weights
+            day = np.nan_to_num(day) - cost
+            if symbols:
+                portfolio[:, t] = day.mean(axis=1)
+            if detail:
+                positions[t] = weight
+                returns[t] = day
+
+    if detail:
+        positions = np.moveaxis(positions, 0, -1)
+        returns = np.moveaxis(returns, 0, -1)
+    return Result(combinations, panel.symbols, panel.dates, positions, returns, portfolio,
+                  trades.sum(axis=1), blocked.sum(axis=1))
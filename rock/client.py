@@ -0,0 +1,83 @@
+"""
+rock/client.py
+A thin client of the query server (`rock-server`), mirroring `rock.stock`.
+Repeated queries of many processes are answered from the cache of the server.
+"""
+import json
+import socket
+from collections.abc import Mapping, Sequence
+from typing import Any
+import pandas as pd
+from rock import adjustment, config, protocol
+
+
+class Client:
+    """
+    A connection to the query server.
+    Usage:
+        with Client() as client:
+            histories = client.get_history(['600000'], start='2020-01-01')
+    """
+
+    def __init__(self, address: str | None = None, timeout: float | None = None):
+        parsed = protocol.parse_address(address or config.SERVER_ADDRESS)
+        if isinstance(parsed, tuple):
+            self._socket = socket.create_connection(parsed, timeout)
+        else:
+            self._socket = socket.socket(socket.AF_UNIX, socket.SOCK_STREAM)
+            self._socket.settimeout(timeout)
+            self._socket.connect(parsed)
+        self._file = self._socket.makefile('rwb')
+
+    def __enter__(self) -> 'Client':
+        return self
+
+    def __exit__(self, *exc_info) -> None:
+        self.close()
+
+    def close(self) -> None:
+        """Close the connection."""
+        self._file.close()
+        self._socket.close()
+
+    def _request(self, request: dict[str, Any]) -> tuple[dict[str, Any], bytes]:
+        self._file.write(protocol.encode_message(request))
+        self._file.flush()
+        frame = self._file.read(protocol.FRAME.size)
+        if len(frame) < protocol.FRAME.size:
+            raise ConnectionError('query server closed the connection')
+        header_size, body_size = protocol.decode_header(frame)
+        header = json.loads(self._file.read(header_size))
+        body = self._file.read(body_size)
+        if 'error' in header:
+            raise RuntimeError(f"query server: {header['error']}")
+        return header, body
+
+    def get_history(self, symboles: Sequence[str],
+                    start: str | None = None,   # YYYY-MM-DD
+                    end: str | None = None,     # YYYY-MM-DD
+                    indicators: Sequence[str] = (),
+                    adjust: str = adjustment.Adjust.NONE,
+                    frequency: str = '1d'
+                ) -> Mapping[str, pd.DataFrame]:
+        """Retrieve historical stock data like `rock.stock.get_history`."""
+        header, body = self._request({'op': 'get_history', 'symbols': list(symboles),
+                                      'start': start, 'end': end, 'indicators': list(indicators),
+                                      'adjust': str(adjust), 'frequency': frequency})
+        result = {}
+        offset = 0
+        for description in header['histories']:
+            columns, offset = protocol.decode_columns(description, body, offset)
+            index = pd.DatetimeIndex(columns.pop('datetime'), name='datetime')
+            result[description['symbol']] = pd.DataFrame(columns, index=index)
+        return result
+
+    def get_securities(self) -> Sequence[str]:
+        """Retrieve all securities like `rock.stock.get_securities`."""
+        header, _ = self._request({'op': 'get_securities'})
+        return header['securities']
+
+    def stats(self) -> dict[str, Any]:
+        """Get the cache statistics of the server."""
+        header, _ = self._request({'op': 'stats'})
+        return header
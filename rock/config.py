@@ -1,10 +1,13 @@
 """
 Configuration settings for the Rock application.
+Settings are read from `config.json` in the root directory. Optional settings
+can be overridden by environment variables prefixed with `ROCK_`.
 """
 from pathlib import Path
 import json
+import os
 
-ROOT_DIR = Path.home() / ".rock"
+ROOT_DIR = Path(os.environ.get('ROCK_HOME', Path.home() / ".rock"))
 ROOT_DIR.mkdir(parents=True, exist_ok=True)
 
 config_file = ROOT_DIR / "config.json"
@@ -12,7 +15,64 @@ with open(config_file, 'r', encoding='utf-8') as f:
     config = json.load(f)
 
 
+def get_setting(key: str, default: str) -> str:
+    """Get an optional setting from the environment or the config file."""
+    return os.environ.get(f'ROCK_{key}', config.get(key, default))
+
+
 USERNAME = config['USERNAME']
 PASSWORD = config['PASSWORD']
 PROXY = config['PROXY']
 PORT = config['PORT']
+
+# Base URLs of the data sources, configurable to point at a local stand-in
+EASTMONEY_SEARCH_URL = get_setting('EASTMONEY_SEARCH_URL', 'https://searchapi.eastmoney.com')
+EASTMONEY_HISTORY_URL = get_setting('EASTMONEY_HISTORY_URL', 'https://push2his.eastmoney.com')
+EASTMONEY_QUOTE_URL = get_setting('EASTMONEY_QUOTE_URL', 'https://push2.eastmoney.com')
+SSE_QUERY_URL = get_setting('SSE_QUERY_URL', 'https://query.sse.com.cn')
+
+# Number of concurrent K-line fetches
+FETCH_THREADS = int(get_setting('FETCH_THREADS', '8'))
+
+# HTTP requests: tries and total deadline in seconds of a request, base and cap of the
+# exponential backoff between tries, and connect and read timeouts of each try
+HTTP_TRIES = int(get_setting('HTTP_TRIES', '3'))
+HTTP_DEADLINE = float(get_setting('HTTP_DEADLINE', '60'))
+HTTP_BACKOFF = float(get_setting('HTTP_BACKOFF', '0.5'))
+HTTP_MAX_BACKOFF = float(get_setting('HTTP_MAX_BACKOFF', '8'))
+HTTP_CONNECT_TIMEOUT = float(get_setting('HTTP_CONNECT_TIMEOUT', '5'))
+HTTP_READ_TIMEOUT = float(get_setting('HTTP_READ_TIMEOUT', '30'))
+# Consecutive failures opening the circuit of a host, and seconds before it is tried again
+HTTP_BREAKER_FAILURES = int(get_setting('HTTP_BREAKER_FAILURES', '5'))
+HTTP_BREAKER_COOLDOWN = float(get_setting('HTTP_BREAKER_COOLDOWN', '30'))
+
+# Number of processes parsing K-line responses, 0 to parse in the fetch threads
+PARSE_PROCESSES = int(get_setting('PARSE_PROCESSES', '0'))
+
+# Layout of new history tables: 'real' prices or 'compact' integer prices in fen
+HISTORY_LAYOUT = get_setting('HISTORY_LAYOUT', 'real')
+
+# Split history across database files by 'exchange' or by 'year' range, 'none' keeps one file
+HISTORY_SHARDING = get_setting('HISTORY_SHARDING', 'none')
+# Years of history per shard when sharding by year
+HISTORY_SHARD_YEARS = int(get_setting('HISTORY_SHARD_YEARS', '10'))
+
+# Query server: Unix socket path or host:port, and cache size in MB
+SERVER_ADDRESS = get_setting('SERVER_ADDRESS', str(ROOT_DIR / "rock.sock"))
+SERVER_CACHE_MB = int(get_setting('SERVER_CACHE_MB', '1024'))
+
+# Comma separated indicators maintained by each update, like 'sma_200,macd_12_26_9'
+INDICATORS = get_setting('INDICATORS', '')
+
+# Shared memory panel published after each update (empty name to disable) and its start date
+PANEL_NAME = get_setting('PANEL_NAME', '')
+PANEL_START = get_setting('PANEL_START', '')
+
+# Realtime poller: seconds between market snapshots and ticks kept per symbol
+REALTIME_INTERVAL = float(get_setting('REALTIME_INTERVAL', '3'))
+REALTIME_CAPACITY = int(get_setting('REALTIME_CAPACITY', '1200'))
+
+# Metrics export: JSON summary path, Prometheus textfile path and HTTP port (empty to disable)
+METRICS_JSON = get_setting('METRICS_JSON', str(ROOT_DIR / "metrics.json"))
+METRICS_TEXTFILE = get_setting('METRICS_TEXTFILE', '')
+METRICS_PORT = get_setting('METRICS_PORT', '')
@@ -3,11 +3,14 @@ rock/db.py
 """
 import sqlite3
 import os
-from collections.abc import Mapping
-from typing import Any
+from collections import defaultdict
+from collections.abc import Iterator, Mapping
+from pathlib import Path
+from typing import Any, NamedTuple
 from enum import StrEnum
 from datetime import datetime as dt
 from rock.logger import logger
+from rock import metrics, config
 
 from rock.config import ROOT_DIR
 
@@ -21,8 +24,16 @@ def adapt_datetime_epoch(val):
 def convert_epoch_datetime(val):
     """Convert Unix timestamp to datetime."""
     return dt.fromtimestamp(int(val))
+def convert_fen(val):
+    """Convert a price in fen to yuan."""
+    return int(val) / 100
+def convert_frequency(val):
+    """Convert a frequency code to the frequency."""
+    return FREQUENCIES[int(val)]
 sqlite3.register_adapter(dt, adapt_datetime_epoch)
 sqlite3.register_converter("timestamp", convert_epoch_datetime)
+sqlite3.register_converter("fen", convert_fen)
+sqlite3.register_converter("frequency", convert_frequency)
 
 
 class Tables(StrEnum):
@@ -30,6 +41,68 @@ class Tables(StrEnum):
     SECURITY = 'security'
     EXCHANGE = 'exchange'
     HISTORY = 'history'
+    RUN = 'run'
+    RUN_ITEM = 'run_item'
+    INDICATOR = 'indicator'
+    INDICATOR_STATE = 'indicator_state'
+    ADJUSTMENT = 'adjustment'
+
+
+class RunStatus(StrEnum):
+    """Status of an update run."""
+    RUNNING = 'running'
+    COMPLETED = 'completed'
+
+
+class ItemStatus(StrEnum):
+    """Status of a security within an update run."""
+    PENDING = 'pending'
+    DONE = 'done'
+    FAILED = 'failed'
+
+
+# Runs in which a failing security is retried before the run is completed without it
+MAX_RUN_ATTEMPTS = 3
+
+
+class Sharding(StrEnum):
+    """How history is split across database files."""
+    NONE = 'none'
+    EXCHANGE = 'exchange'
+    YEAR = 'year'
+
+
+HISTORY_SHARDING = Sharding(config.HISTORY_SHARDING)
+HISTORY_SHARD_YEARS = config.HISTORY_SHARD_YEARS
+
+HISTORY_COLUMNS = ('security_id', 'datetime', 'open', 'close', 'high', 'low',
+                   'adj_close', 'volume', 'amount', 'frequency')
+PRICE_COLUMNS = ('open', 'close', 'high', 'low', 'adj_close')
+
+# Meta key of the history generation, which is stamped on every history row
+# written and increased by each update run
+HISTORY_GENERATION = 'history_generation'
+
+# Meta key set while the first full load of an empty database runs in bootstrap mode
+BOOTSTRAP = 'bootstrap'
+
+# Whether connections of this process load in bootstrap mode
+_bootstrap = False
+
+
+class HistoryLayout(StrEnum):
+    """Storage layout of the history table."""
+    # prices as REAL, frequency as TEXT
+    REAL = 'real'
+    # prices as integers in fen, frequency as an integer code, clustered WITHOUT ROWID
+    COMPACT = 'compact'
+
+
+HISTORY_LAYOUT = HistoryLayout(config.HISTORY_LAYOUT)
+
+# Frequency codes of the compact layout
+FREQUENCY_CODES = {'1m': 0, '1d': 1}
+FREQUENCIES = {code: frequency for frequency, code in FREQUENCY_CODES.items()}
 
 
 def create_db() -> None:
@@ -60,21 +133,7 @@ def create_db() -> None:
             )
         ''')
     def create_history_table():
-        cursor.execute(f'''
-            CREATE TABLE IF NOT EXISTS {Tables.HISTORY} (
-                security_id INTEGER NOT NULL REFERENCES {Tables.SECURITY}(id),
-                datetime TIMESTAMP NOT NULL DEFAULT 0 CHECK ( datetime >= 0),
-                open REAL NOT NULL,
-                close REAL NOT NULL,
-                high REAL NOT NULL,
-                low REAL NOT NULL,
-                adj_close REAL NOT NULL,
-                volume INTEGER NOT NULL CHECK (volume >= 0),
-                amount INTEGER NOT NULL CHECK (amount >= 0),
-                frequency TEXT NOT NULL CHECK (frequency IN ('1m', '1d')),
-                PRIMARY KEY (security_id, datetime)
-            )
-        ''')
+        _create_history_table(cursor)
 
     def create_meta_table():
         cursor.execute('''
@@ -92,6 +151,9 @@ def create_db() -> None:
         create_exchange_table()
         create_history_table()
         create_meta_table()
+        _create_run_tables(cursor)
+        _create_indicator_tables(cursor)
+        _create_adjustment_table(cursor)
         connection.commit()
         logger.info('Database %s created successfully.', DB_PATH)
     finally:
@@ -99,6 +161,195 @@ def create_db() -> None:
         connection.close()
 
 
+def upgrade_db() -> None:
+    """
+    Add tables introduced after the database was created.
+    With sharding enabled, history still in the main database is moved to the shards.
+    """
+    connection = get_connection()
+    cursor = connection.cursor()
+    try:
+        _create_run_tables(cursor)
+        _add_generation_column(cursor)
+        _create_indicator_tables(cursor)
+        _create_adjustment_table(cursor)
+        connection.commit()
+    finally:
+        cursor.close()
+        connection.close()
+
+    if HISTORY_SHARDING != Sharding.NONE:
+        move_history_to_shards()
+
+
+def _create_history_table(cursor: sqlite3.Cursor, references: bool = True,
+                          layout: HistoryLayout|None = None, table: str = Tables.HISTORY) -> None:
+    """
+    Create the history table in `layout`, by default HISTORY_LAYOUT. Shards are
+    separate files and can not reference the security table, so they are created
+    without the foreign key. Prices of the compact layout are declared as FEN and
+    frequencies as FREQUENCY, so reads convert them back by their registered converters.
+    """
+    layout = layout or HISTORY_LAYOUT
+    security_id = (f'INTEGER NOT NULL REFERENCES {Tables.SECURITY}(id)' if references
+                   else 'INTEGER NOT NULL')
+    if layout == HistoryLayout.COMPACT:
+        price = 'FEN'
+        frequency = f"FREQUENCY NOT NULL CHECK (frequency IN ({', '.join(map(str, FREQUENCIES))}))"
+        options = 'WITHOUT ROWID'
+    else:
+        price = 'REAL'
+        frequency = "TEXT NOT NULL CHECK (frequency IN ('1m', '1d'))"
+        options = ''
+    cursor.execute(f'''
+        CREATE TABLE IF NOT EXISTS {table} (
+            security_id {security_id},
+            datetime TIMESTAMP NOT NULL DEFAULT 0 CHECK ( datetime >= 0),
+            open {price} NOT NULL,
+            close {price} NOT NULL,
+            high {price} NOT NULL,
+            low {price} NOT NULL,
+            adj_close {price} NOT NULL,
+            volume INTEGER NOT NULL CHECK (volume >= 0),
+            amount INTEGER NOT NULL CHECK (amount >= 0),
+            frequency {frequency},
+            generation INTEGER NOT NULL DEFAULT 0,
+            PRIMARY KEY (security_id, datetime)
+        ) {options}
+    ''')
+
+
+def _add_generation_column(cursor: sqlite3.Cursor) -> None:
+    """Add the generation column to a history table created before it existed."""
+    cursor.execute(f'PRAGMA table_info({Tables.HISTORY})')
+    columns = [row['name'] for row in cursor.fetchall()]
+    if columns and 'generation' not in columns:
+        cursor.execute(f'ALTER TABLE {Tables.HISTORY} ADD COLUMN generation INTEGER NOT NULL DEFAULT 0')
+
+
+def get_history_layout(cursor: sqlite3.Cursor, table: str = Tables.HISTORY) -> HistoryLayout|None:
+    """Get the layout of the history table of the database of `cursor`, None if it does not exist."""
+    cursor.execute("SELECT sql FROM sqlite_master WHERE type = 'table' AND name = ?", (table,))
+    row = cursor.fetchone()
+    if row is None:
+        return None
+    return HistoryLayout.COMPACT if 'WITHOUT ROWID' in row[0].upper() else HistoryLayout.REAL
+
+
+class WriteCounts(NamedTuple):
+    """History rows written by an upsert: new rows, changed rows and rows left as they were."""
+    inserted: int = 0
+    updated: int = 0
+    unchanged: int = 0
+
+    def __add__(self, other: tuple) -> 'WriteCounts':  # type: ignore[override]
+        return WriteCounts(*(a + b for a, b in zip(self, other)))
+
+
+def _count_history_writes(counts: WriteCounts) -> None:
+    metrics.DB_ROWS_WRITTEN.inc(counts.inserted + counts.updated, table=Tables.HISTORY)
+    for outcome, rows in counts._asdict().items():
+        metrics.DB_HISTORY_UPSERTS.inc(rows, outcome=outcome)
+
+
+def _encode_history(history: list[tuple], layout: HistoryLayout | None) -> list[tuple]:
+    """Encode history rows for a table of `layout`, prices in fen for the compact one."""
+    if layout != HistoryLayout.COMPACT:
+        return history
+    return [(item[0], item[1], *(round(price * 100) for price in item[2:7]),
+             item[7], item[8], FREQUENCY_CODES[item[9]], *item[10:]) for item in history]
+
+
+def _insert_history(cursor: sqlite3.Cursor, history: list[tuple], generation: int|None = None) -> WriteCounts:
+    """
+    Upsert history rows, encoding them for the layout of the table. New rows
+    are inserted and existing rows are only rewritten where a value changed,
+    so refetching an unchanged range writes no pages. Written rows are stamped
+    with `generation`, or with the generation in the meta table of the
+    database of `cursor` as it is when the rows are written.
+    """
+    history = _encode_history(history, get_history_layout(cursor))
+    stamp = _CURRENT_GENERATION if generation is None else '?'
+    stamped = () if generation is None else (generation,)
+    cursor.executemany(_INSERT_HISTORY.format(generation=stamp), [(*item, *stamped) for item in history])
+    inserted = max(cursor.rowcount, 0)
+    if inserted == len(history):
+        # a backfill of new rows has nothing to compare
+        return WriteCounts(inserted)
+    cursor.executemany(_UPDATE_HISTORY.format(generation=stamp),
+                       [(*item[2:], *stamped, *item[:2]) for item in history])
+    updated = max(cursor.rowcount, 0)
+    return WriteCounts(inserted, updated, len(history) - inserted - updated)
+
+
+def _create_run_tables(cursor: sqlite3.Cursor) -> None:
+    """Create the run journal tables."""
+    cursor.execute(f'''
+        CREATE TABLE IF NOT EXISTS {Tables.RUN} (
+            id INTEGER PRIMARY KEY AUTOINCREMENT,
+            started_at TIMESTAMP NOT NULL,
+            finished_at TIMESTAMP DEFAULT NULL,
+            start TEXT DEFAULT NULL,
+            as_of TEXT NOT NULL,
+            status TEXT NOT NULL CHECK (status IN ('running', 'completed'))
+        )
+    ''')
+    # security_id is deliberately not a foreign key: the journal must not
+    # prevent removing a security, and rows are only ever looked up by run
+    cursor.execute(f'''
+        CREATE TABLE IF NOT EXISTS {Tables.RUN_ITEM} (
+            run_id INTEGER NOT NULL REFERENCES {Tables.RUN}(id),
+            security_id INTEGER NOT NULL,
+            status TEXT NOT NULL CHECK (status IN ('pending', 'done', 'failed')),
+            attempts INTEGER NOT NULL DEFAULT 0,
+            rows INTEGER NOT NULL DEFAULT 0,
+            error TEXT DEFAULT NULL,
+            updated_at TIMESTAMP DEFAULT NULL,
+            PRIMARY KEY (run_id, security_id)
+        )
+    ''')
+
+
+def _create_indicator_tables(cursor: sqlite3.Cursor) -> None:
+    """
+    Create the tables of indicator values, one row per column and bar, and of
+    the state of each indicator and security after its last bar.
+    """
+    cursor.execute(f'''
+        CREATE TABLE IF NOT EXISTS {Tables.INDICATOR} (
+            security_id INTEGER NOT NULL REFERENCES {Tables.SECURITY}(id),
+            name TEXT NOT NULL,
+            datetime TIMESTAMP NOT NULL,
+            value REAL NOT NULL,
+            PRIMARY KEY (security_id, name, datetime)
+        ) WITHOUT ROWID
+    ''')
+    cursor.execute(f'''
+        CREATE TABLE IF NOT EXISTS {Tables.INDICATOR_STATE} (
+            security_id INTEGER NOT NULL REFERENCES {Tables.SECURITY}(id),
+            name TEXT NOT NULL,
+            datetime TIMESTAMP NOT NULL,
+            state TEXT NOT NULL,
+            PRIMARY KEY (security_id, name)
+        )
+    ''')
+
+
+def _create_adjustment_table(cursor: sqlite3.Cursor) -> None:
+    """
+    Create the table of the backward adjustment factors of each security, one
+    row per corporate action giving the factor from its date on.
+    """
+    cursor.execute(f'''
+        CREATE TABLE IF NOT EXISTS {Tables.ADJUSTMENT} (
+            security_id INTEGER NOT NULL REFERENCES {Tables.SECURITY}(id),
+            datetime TIMESTAMP NOT NULL,
+            factor REAL NOT NULL CHECK (factor > 0),
+            PRIMARY KEY (security_id, datetime)
+        ) WITHOUT ROWID
+    ''')
+
+
 def db_exist() -> bool:
     """Check if the database exists."""
     return os.path.exists(DB_PATH)
@@ -108,10 +359,81 @@ def get_connection() -> sqlite3.Connection:
     """Get a database connection."""
     connection = sqlite3.connect(DB_PATH, detect_types=sqlite3.PARSE_DECLTYPES)
     connection.row_factory = sqlite3.Row
-    connection.execute('PRAGMA foreign_keys = ON;')
+    if _bootstrap:
+        # commits are not synced and foreign keys are checked once by end_bootstrap
+        connection.execute('PRAGMA synchronous = NORMAL;')
+    else:
+        connection.execute('PRAGMA foreign_keys = ON;')
     return connection
 
 
+def begin_bootstrap() -> None:
+    """
+    Enter bootstrap mode for the first full load of an empty database. The
+    database switches to write-ahead logging, where commits are not synced to
+    disk: a power loss may lose the last transactions but never corrupts the
+    database, and the run journal, written in the same transactions as the
+    history, refetches what was lost. Foreign keys are not checked per row.
+    The mode is recorded in the database, so a resumed run continues in it.
+    """
+    global _bootstrap  # pylint: disable=global-statement
+    connection = get_connection()
+    try:
+        connection.execute('PRAGMA journal_mode = WAL;')
+        connection.execute("INSERT OR REPLACE INTO meta (key, value) VALUES (?, '1')", (BOOTSTRAP,))
+        connection.commit()
+    finally:
+        connection.close()
+    _bootstrap = True
+    logger.info("Loading %s in bootstrap mode.", DB_PATH)
+
+
+def resume_bootstrap() -> bool:
+    """Continue in bootstrap mode if the database is in it, and return whether it is."""
+    global _bootstrap  # pylint: disable=global-statement
+    _bootstrap = get_meta(BOOTSTRAP) is not None
+    return _bootstrap
+
+
+def end_bootstrap() -> None:
+    """
+    Leave bootstrap mode: check the foreign keys of all rows loaded, then
+    checkpoint the write-ahead log and return to the rollback journal.
+    Raises:
+        sqlite3.IntegrityError: If loaded rows reference missing rows, in which
+            case the database stays in bootstrap mode.
+    """
+    global _bootstrap  # pylint: disable=global-statement
+    connection = get_connection()
+    try:
+        violations = connection.execute('PRAGMA foreign_key_check;').fetchall()
+        if violations:
+            tables = ', '.join(sorted({row[0] for row in violations}))
+            raise sqlite3.IntegrityError(f'{len(violations)} rows of {tables} violate foreign keys')
+        connection.execute('DELETE FROM meta WHERE key = ?', (BOOTSTRAP,))
+        connection.commit()
+        connection.execute('PRAGMA optimize;')
+        connection.execute('PRAGMA wal_checkpoint(TRUNCATE);')
+        connection.execute('PRAGMA journal_mode = DELETE;')
+    finally:
+        connection.close()
+    _bootstrap = False
+    logger.info("Bootstrap of %s completed.", DB_PATH)
+
+
+def has_history() -> bool:
+    """Whether the database, or any of its shards, holds history."""
+    connection = get_connection()
+    cursor = connection.cursor()
+    try:
+        history_source = _attach_shards(connection)
+        cursor.execute(f'SELECT EXISTS (SELECT 1 FROM {history_source}) AS any_row')
+        return bool(cursor.fetchone()['any_row'])
+    finally:
+        cursor.close()
+        connection.close()
+
+
 def insert_exchange(name: str, acronym: str, exchange_type: str) -> None:
     """Insert exchange data into the database."""
     connection = get_connection()
@@ -146,6 +468,7 @@ def insert_security(symbol: str, name: str, symbol_type: str, listing: str,
         connection.close()
 
 
+@metrics.timed('insert_securities')
 def insert_securities(securities: list[tuple[str, str, str, str, str, int]]) -> None:
     """Insert multiple securities into the database."""
     connection = get_connection()
@@ -159,6 +482,7 @@ def insert_securities(securities: list[tuple[str, str, str, str, str, int]]) ->
                dt.fromisoformat(row[4]) if row[4] is not None else None,
                row[5]) for row in securities])
         connection.commit()
+        metrics.DB_ROWS_WRITTEN.inc(len(securities), table=Tables.SECURITY)
     finally:
         cursor.close()
         connection.close()
@@ -205,23 +529,366 @@ def get_meta(key: str) -> str|None:
         connection.close()
 
 
-def bulk_insert_history(history: list[tuple[int, str, float, float, float, float, float, int, int, str]]) -> None:
-    """Insert multiple history into the database."""
+def get_generation() -> int:
+    """Get the current history generation."""
+    value = get_meta(HISTORY_GENERATION)
+    return 0 if value is None else int(value)
+
+
+def bump_generation() -> int:
+    """Start a new history generation and return it."""
     connection = get_connection()
-    transformed_history = ((item[0], dt.fromisoformat(item[1]), *item[2:]) for item in history)
     cursor = connection.cursor()
     try:
-        cursor.executemany(f'''
-            INSERT OR REPLACE INTO {Tables.HISTORY}
-                (security_id, datetime, open, close, high, low, adj_close, volume, amount, frequency)
-            VALUES (?, ?, ?, ?, ?, ?, ?, ?, ?, ?)
-        ''', transformed_history)
+        cursor.execute('''
+            INSERT INTO meta (key, value) VALUES (?, '1')
+            ON CONFLICT (key) DO UPDATE SET value = CAST(value AS INTEGER) + 1
+        ''', (HISTORY_GENERATION,))
+        cursor.execute('SELECT value FROM meta WHERE key = ?', (HISTORY_GENERATION,))
+        generation = int(cursor.fetchone()['value'])
         connection.commit()
+        return generation
     finally:
         cursor.close()
         connection.close()
 
 
+@metrics.timed('bulk_insert_history')
+def bulk_insert_history(history: list[tuple[int, str, float, float, float, float, float, int, int, str]]
+                        ) -> WriteCounts:
+    """
+    Upsert multiple history into the database, or into its shards if sharding is enabled.
+    Returns the counts of inserted, updated and unchanged rows.
+    """
+    transformed_history = [(item[0], dt.fromisoformat(item[1]), *item[2:]) for item in history]
+    if HISTORY_SHARDING != Sharding.NONE:
+        return _insert_history_shards(transformed_history)
+
+    connection = get_connection()
+    cursor = connection.cursor()
+    try:
+        counts = _insert_history(cursor, transformed_history)
+        connection.commit()
+        _count_history_writes(counts)
+        return counts
+    finally:
+        cursor.close()
+        connection.close()
+
+
+@metrics.timed('write_history')
+def write_history(history: list[tuple[int, str, float, float, float, float, float, int, int, str]],
+                  run_id: int|None = None,
+                  items: list[tuple[int, str, int, str|None]] = (),
+                  adjustments: list[tuple[int, str, float]] = ()) -> WriteCounts:
+    """
+    Upsert history and its (security_id, date, factor) adjustment factors and
+    record the (security_id, status, rows, error) results of a run in a single
+    transaction. With sharding enabled the history is committed to the shards
+    first, so results are never recorded for history not written.
+    Returns the counts of inserted, updated and unchanged rows.
+    """
+    counts = WriteCounts()
+    transformed_history = [(item[0], dt.fromisoformat(item[1]), *item[2:]) for item in history]
+    if HISTORY_SHARDING != Sharding.NONE and transformed_history:
+        counts = _insert_history_shards(transformed_history)
+
+    connection = get_connection()
+    cursor = connection.cursor()
+    try:
+        if HISTORY_SHARDING == Sharding.NONE:
+            counts = _insert_history(cursor, transformed_history)
+        if adjustments:
+            cursor.executemany(f'''
+                INSERT OR REPLACE INTO {Tables.ADJUSTMENT} (security_id, datetime, factor) VALUES (?, ?, ?)
+            ''', [(item[0], dt.fromisoformat(item[1]), item[2]) for item in adjustments])
+        if run_id is not None:
+            _mark_run_items(cursor, run_id, list(items))
+        connection.commit()
+        if HISTORY_SHARDING == Sharding.NONE:
+            _count_history_writes(counts)
+        return counts
+    finally:
+        cursor.close()
+        connection.close()
+
+
+_INSERT_HISTORY = f'''
+    INSERT INTO {Tables.HISTORY} ({', '.join(HISTORY_COLUMNS)}, generation)
+    VALUES ({', '.join('?' * len(HISTORY_COLUMNS))}, {{generation}})
+    ON CONFLICT (security_id, datetime) DO NOTHING
+'''
+# rewrites an existing row only if one of its values changed
+_UPDATE_HISTORY = f'''
+    UPDATE {Tables.HISTORY} SET {', '.join(f'{column} = ?' for column in HISTORY_COLUMNS[2:])},
+        generation = {{generation}}
+    WHERE security_id = ? AND datetime = ? AND ({' OR '.join(f'{column} IS NOT ?{i}'
+                                                             for i, column in enumerate(HISTORY_COLUMNS[2:], 1))})
+'''
+# copies rows with their generation, replacing rows of the same bar
+_COPY_HISTORY = f'''
+    INSERT OR REPLACE INTO {Tables.HISTORY} ({', '.join(HISTORY_COLUMNS)}, generation)
+    VALUES ({', '.join('?' * (len(HISTORY_COLUMNS) + 1))})
+'''
+_CURRENT_GENERATION = f"""COALESCE((SELECT CAST(value AS INTEGER) FROM meta
+                                    WHERE key = '{HISTORY_GENERATION}'), 0)"""
+
+
+def shard_dir() -> Path:
+    """Directory of the history shards of the database."""
+    return DB_PATH.parent / f'{DB_PATH.stem}.shards'
+
+
+def get_shards() -> list[Path]:
+    """Get the paths of all history shards."""
+    directory = shard_dir()
+    if not directory.is_dir():
+        return []
+    return sorted(directory.glob(f'{Tables.HISTORY}_*.db'))
+
+
+def get_shard_connection(name: str, layout: HistoryLayout|None = None) -> sqlite3.Connection:
+    """
+    Get a connection to the history shard `name`, creating it if needed.
+    Each shard is a separate file, so shards can be written concurrently.
+    New shards have the layout of the main database, so they can be read together.
+    """
+    path = shard_dir() / f'{Tables.HISTORY}_{name}.db'
+    path.parent.mkdir(parents=True, exist_ok=True)
+    connection = _connect(path)
+    cursor = connection.cursor()
+    try:
+        _create_history_table(cursor, references=False, layout=layout or _main_history_layout())
+        _add_generation_column(cursor)
+    finally:
+        cursor.close()
+    return connection
+
+
+def _connect(path: Path) -> sqlite3.Connection:
+    connection = sqlite3.connect(path, detect_types=sqlite3.PARSE_DECLTYPES)
+    connection.row_factory = sqlite3.Row
+    return connection
+
+
+def _main_history_layout() -> HistoryLayout|None:
+    connection = get_connection()
+    cursor = connection.cursor()
+    try:
+        return get_history_layout(cursor)
+    finally:
+        cursor.close()
+        connection.close()
+
+
+def _shard_name(exchange: str|None, datetime: dt) -> str:
+    """Name of the shard a history row is stored in."""
+    if HISTORY_SHARDING == Sharding.EXCHANGE:
+        return (exchange or 'none').lower()
+    first = datetime.year - datetime.year % HISTORY_SHARD_YEARS
+    return f'{first}_{first + HISTORY_SHARD_YEARS - 1}'
+
+
+def _get_security_exchanges(security_ids: set[int]) -> dict[int, str|None]:
+    """Get the exchange acronyms of securities by security ID."""
+    if HISTORY_SHARDING != Sharding.EXCHANGE:
+        return {}
+    connection = get_connection()
+    cursor = connection.cursor()
+    try:
+        cursor.execute(f'''
+            SELECT s.id, e.acronym FROM {Tables.SECURITY} s
+            LEFT JOIN {Tables.EXCHANGE} e ON s.exchange_id = e.id
+            WHERE s.id IN ({', '.join('?' * len(security_ids))})
+        ''', list(security_ids))
+        return {row['id']: row['acronym'] for row in cursor.fetchall()}
+    finally:
+        cursor.close()
+        connection.close()
+
+
+def _group_by_shard(history: list[tuple]) -> dict[str, list[tuple]]:
+    """Group history rows by the shard they belong to."""
+    exchanges = _get_security_exchanges({item[0] for item in history})
+    shards = defaultdict(list)
+    for item in history:
+        shards[_shard_name(exchanges.get(item[0]), item[1])].append(item)
+    return shards
+
+
+def _insert_history_shards(history: list[tuple]) -> WriteCounts:
+    """Upsert history rows into the shards they belong to."""
+    layout = _main_history_layout()
+    generation = get_generation()
+    total = WriteCounts()
+    for name, rows in _group_by_shard(history).items():
+        connection = get_shard_connection(name, layout)
+        cursor = connection.cursor()
+        try:
+            counts = _insert_history(cursor, rows, generation)
+            connection.commit()
+            _count_history_writes(counts)
+            total += counts
+        finally:
+            cursor.close()
+            connection.close()
+    return total
+
+
+def move_history_to_shards(batch_size: int = 100_000) -> int:
+    """
+    Move history rows of the main database to the shards and return their number.
+    Rows are copied as they are stored, keeping their generation so incremental
+    exports do not read them again, and before they are deleted, so an interrupted
+    move is completed by running it again. Changing the sharding mode of existing
+    shards is not supported.
+    """
+    connection = get_connection()
+    cursor = connection.cursor()
+    moved = 0
+    try:
+        layout = get_history_layout(cursor)
+        cursor.execute(f'SELECT {", ".join(HISTORY_COLUMNS)}, generation FROM {Tables.HISTORY}')
+        while rows := cursor.fetchmany(batch_size):
+            for name, shard_rows in _group_by_shard([tuple(row) for row in rows]).items():
+                shard = get_shard_connection(name, layout)
+                try:
+                    shard.executemany(_COPY_HISTORY, _encode_history(shard_rows, layout))
+                    shard.commit()
+                finally:
+                    shard.close()
+            moved += len(rows)
+        if moved:
+            cursor.execute(f'DELETE FROM {Tables.HISTORY}')
+            connection.commit()
+            logger.info('Moved %d history rows to %s.', moved, shard_dir())
+        return moved
+    finally:
+        cursor.close()
+        connection.close()
+
+
+def migrate_history_layout(layout: HistoryLayout, batch_size: int = 200) -> int:
+    """
+    Convert the history of the database and of its shards to `layout` and
+    return the number of rows copied. The migration runs online: history is
+    copied to a new table in batches of `batch_size` securities, each in its own
+    transaction, triggers copy rows inserted or updated meanwhile, and the new table
+    replaces the old one in a final short transaction. An interrupted migration
+    starts over when run again. Run VACUUM afterwards to return the freed space.
+    """
+    copied = 0
+    for path in [DB_PATH, *get_shards()]:
+        connection = get_connection() if path == DB_PATH else _connect(path)
+        try:
+            copied += _migrate_history_table(connection, layout, path == DB_PATH, batch_size)
+        finally:
+            connection.close()
+    return copied
+
+
+def _migrate_history_table(connection: sqlite3.Connection, layout: HistoryLayout,
+                           references: bool, batch_size: int) -> int:
+    """Convert the history table of one database file to `layout`."""
+    new_table = f'{Tables.HISTORY}_migration'
+    triggers = {'INSERT': f'{Tables.HISTORY}_migration_copy', 'UPDATE': f'{Tables.HISTORY}_migration_update'}
+    cursor = connection.cursor()
+    try:
+        current = get_history_layout(cursor)
+        if current is None or current == layout:
+            return 0
+
+        for trigger in triggers.values():
+            cursor.execute(f'DROP TRIGGER IF EXISTS {trigger}')
+        cursor.execute(f'DROP TABLE IF EXISTS {new_table}')
+        _create_history_table(cursor, references, layout, new_table)
+        columns = ', '.join(HISTORY_COLUMNS) + ', generation'
+        for event, trigger in triggers.items():
+            # upserts rewrite changed rows with an UPDATE
+            cursor.execute(f'''
+                CREATE TRIGGER {trigger} AFTER {event} ON {Tables.HISTORY}
+                BEGIN
+                    INSERT OR REPLACE INTO {new_table} ({columns})
+                    VALUES ({_convert_history_columns(layout, 'NEW.')}, NEW.generation);
+                END
+            ''')
+        connection.commit()
+
+        cursor.execute(f'SELECT DISTINCT security_id FROM {Tables.HISTORY} ORDER BY security_id')
+        security_ids = [row[0] for row in cursor.fetchall()]
+        copied = 0
+        for i in range(0, len(security_ids), batch_size):
+            batch = security_ids[i:i + batch_size]
+            cursor.execute(f'''
+                INSERT OR REPLACE INTO {new_table} ({columns})
+                SELECT {_convert_history_columns(layout)}, generation FROM {Tables.HISTORY}
+                WHERE security_id BETWEEN ? AND ?
+            ''', (batch[0], batch[-1]))
+            copied += cursor.rowcount
+            connection.commit()
+
+        cursor.execute('BEGIN IMMEDIATE')
+        for trigger in triggers.values():
+            cursor.execute(f'DROP TRIGGER {trigger}')
+        cursor.execute(f'DROP TABLE {Tables.HISTORY}')
+        cursor.execute(f'ALTER TABLE {new_table} RENAME TO {Tables.HISTORY}')
+        connection.commit()
+        logger.info('Converted %d history rows to the %s layout.', copied, layout)
+        return copied
+    finally:
+        cursor.close()
+
+
+def _convert_history_columns(layout: HistoryLayout, prefix: str = '', alias: bool = False) -> str:
+    """SQL expressions converting the history columns of the other layout to `layout`."""
+    expressions = []
+    for column in HISTORY_COLUMNS:
+        value = f'{prefix}{column}'
+        if column in PRICE_COLUMNS:
+            value = (f'CAST(ROUND({value} * 100) AS INTEGER)' if layout == HistoryLayout.COMPACT
+                     else f'{value} / 100.0')
+        elif column == 'frequency':
+            cases = ' '.join(f"WHEN '{f}' THEN {code}" if layout == HistoryLayout.COMPACT
+                             else f"WHEN {code} THEN '{f}'" for f, code in FREQUENCY_CODES.items())
+            value = f'CASE {value} {cases} END'
+        if alias and value != f'{prefix}{column}':
+            value = f'{value} AS {column}'
+        expressions.append(value)
+    return ', '.join(expressions)
+
+
+def vacuum() -> None:
+    """Rebuild the database and its shards to return free pages to the file system."""
+    for path in [DB_PATH, *get_shards()]:
+        connection = _connect(path)
+        try:
+            connection.execute('VACUUM')
+        finally:
+            connection.close()
+
+
+def _attach_shards(connection: sqlite3.Connection) -> str:
+    """
+    Attach the history shards to `connection` and return a source selecting
+    the history of the main database and of all shards.
+    """
+    shards = get_shards()
+    limit = connection.getlimit(sqlite3.SQLITE_LIMIT_ATTACHED)
+    if len(shards) > limit:
+        raise sqlite3.OperationalError(
+            f'{len(shards)} history shards exceed the limit of {limit} attached databases')
+
+    columns = ', '.join(HISTORY_COLUMNS) + ', generation'
+    selects = [f'SELECT {columns} FROM main.{Tables.HISTORY}']
+    for i, path in enumerate(shards):
+        connection.execute('ATTACH DATABASE ? AS ?', (str(path), f'shard_{i}'))
+        selects.append(f'SELECT {columns} FROM shard_{i}.{Tables.HISTORY}')
+    if len(selects) == 1:
+        return Tables.HISTORY
+    return f"({' UNION ALL '.join(selects)})"
+
+
+@metrics.timed('update_security_delisting')
 def update_security_delisting(symbol: str, delisting: str) -> None:
     """Update security data in the database."""
     connection = get_connection()
@@ -237,6 +904,7 @@ def update_security_delisting(symbol: str, delisting: str) -> None:
         connection.close()
 
 
+@metrics.timed('get_all_securities')
 def get_all_securities() -> list[sqlite3.Row]:
     """Get all security data from the database."""
     connection = get_connection()
@@ -246,12 +914,14 @@ def get_all_securities() -> list[sqlite3.Row]:
             SELECT * FROM {Tables.SECURITY}
         ''')
         result = cursor.fetchall()
+        metrics.DB_ROWS_READ.inc(len(result), table=Tables.SECURITY)
         return result
     finally:
         cursor.close()
         connection.close()
 
 
+@metrics.timed('get_security')
 def get_security(symbols: str|list[str]) -> sqlite3.Row|list[sqlite3.Row]|None:
     """Get security data from the database."""
     return _get_data_from_table(Tables.SECURITY, 'symbol', symbols)
@@ -262,9 +932,12 @@ def get_exchange(ex: str|list[str]) -> sqlite3.Row|list[sqlite3.Row]|None:
     return _get_data_from_table(Tables.EXCHANGE, 'acronym', ex)
 
 
+@metrics.timed('get_history')
 def get_history(symbols: str|list[str], start: str|None = None,
-                end: str|None = None) -> Mapping[str, list[sqlite3.Row]]:
-    """Get history data from the database."""
+                end: str|None = None, frequency: str = '1d') -> Mapping[str, list[sqlite3.Row]]:
+    """
+    Get history data of `frequency` from the database, including history stored in shards.
+    """
     if isinstance(symbols, str):
         symbols = [symbols]
 
@@ -277,6 +950,12 @@ def get_history(symbols: str|list[str], start: str|None = None,
     connection = get_connection()
     cursor = connection.cursor()
     try:
+        history_source = _attach_shards(connection)
+        # converting in SQL is faster than the FEN and FREQUENCY converters
+        columns = (_convert_history_columns(HistoryLayout.REAL, alias=True)
+                   if get_history_layout(cursor) == HistoryLayout.COMPACT
+                   else ', '.join(HISTORY_COLUMNS))
+        frequency_value = _frequency_value(cursor, frequency)
         result = {}
         for symbol in symbols:
             cursor.execute(f'''
@@ -288,23 +967,298 @@ def get_history(symbols: str|list[str], start: str|None = None,
                 continue
 
             cursor.execute(f'''
-                SELECT * FROM {Tables.HISTORY} WHERE security_id = ?
-                AND datetime >= ? AND datetime <= ?
+                SELECT {columns} FROM {history_source} WHERE security_id = ?
+                AND datetime >= ? AND datetime <= ? AND frequency = ?
+                ORDER BY datetime
             ''', (security['id'],
                   0 if s is None else s,
-                  dt.max if e is None else e))
+                  dt.max if e is None else e,
+                  frequency_value))
             history = cursor.fetchall()
             if not history:
                 result[symbol] = []
                 continue
 
             result[symbol] = history
+            metrics.DB_ROWS_READ.inc(len(history), table=Tables.HISTORY)
 
         return result
     finally:
         cursor.close()
         connection.close()
 
+def _wanted_securities(cursor: sqlite3.Cursor, symbols: list[str]|None) -> str:
+    """Return a source selecting the securities of `symbols`, or all securities if None."""
+    if symbols is None:
+        return Tables.SECURITY
+    cursor.execute('CREATE TEMP TABLE IF NOT EXISTS wanted (symbol TEXT PRIMARY KEY)')
+    cursor.executemany('INSERT OR IGNORE INTO temp.wanted VALUES (?)',
+                       [(symbol,) for symbol in symbols])
+    return (f'(SELECT * FROM {Tables.SECURITY} WHERE symbol IN '
+            f'(SELECT symbol FROM temp.wanted))')
+
+
+def _frequency_value(cursor: sqlite3.Cursor, frequency: str) -> str|int:
+    """Return `frequency` as stored by the layout of the history table."""
+    if get_history_layout(cursor) == HistoryLayout.COMPACT:
+        return FREQUENCY_CODES[frequency]
+    return frequency
+
+
+def iter_history(symbols: list[str]|None = None, start: str|None = None, end: str|None = None,
+                 chunk_rows: int = 100_000, since: int|None = None,
+                 frequency: str|None = None) -> Iterator[list[sqlite3.Row]]:
+    """
+    Iterate over the history of `symbols`, or of all securities if None, in
+    chunks of at most `chunk_rows` rows ordered by security and datetime.
+    With `since`, only rows written after that history generation are read,
+    and with `frequency` only rows of that frequency.
+    Rows are read with fetchmany, so memory does not grow with the database.
+    The rows have a `symbol` column besides the history columns. The database
+    is read in one transaction, which delays writers until the iteration ends.
+    """
+    s = dt.fromisoformat(start) if start else None
+    e = dt.fromisoformat(end) if end else None
+
+    connection = get_connection()
+    cursor = connection.cursor()
+    try:
+        history_source = _attach_shards(connection)
+        columns = (_convert_history_columns(HistoryLayout.REAL, 'h.', alias=True)
+                   if get_history_layout(cursor) == HistoryLayout.COMPACT
+                   else ', '.join(f'h.{column}' for column in HISTORY_COLUMNS))
+        securities = _wanted_securities(cursor, symbols)
+        parameters = [0 if s is None else s, dt.max if e is None else e, -1 if since is None else since]
+        where = ''
+        if frequency is not None:
+            where = 'AND h.frequency = ?'
+            parameters.append(_frequency_value(cursor, frequency))
+        cursor.execute(f'''
+            SELECT s.symbol, {columns} FROM {securities} s
+            JOIN {history_source} h ON h.security_id = s.id
+            WHERE h.datetime >= ? AND h.datetime <= ? AND h.generation > ? {where}
+            ORDER BY h.security_id, h.datetime
+        ''', parameters)
+        while rows := cursor.fetchmany(chunk_rows):
+            metrics.DB_ROWS_READ.inc(len(rows), table=Tables.HISTORY)
+            yield rows
+    finally:
+        cursor.close()
+        connection.close()
+
+
+def get_history_index(symbols: list[str]|None = None, start: str|None = None, end: str|None = None,
+                      frequency: str = '1d') -> tuple[list[str], list[dt]]:
+    """
+    Get the symbols of `symbols`, or of all securities if None, having history
+    of `frequency` between `start` and `end`, ordered by security, and the
+    distinct datetimes of that history in order.
+    """
+    s = dt.fromisoformat(start) if start else None
+    e = dt.fromisoformat(end) if end else None
+
+    connection = get_connection()
+    cursor = connection.cursor()
+    try:
+        history_source = _attach_shards(connection)
+        securities = _wanted_securities(cursor, symbols)
+        parameters = (0 if s is None else s, dt.max if e is None else e,
+                      _frequency_value(cursor, frequency))
+        cursor.execute(f'''
+            SELECT symbol FROM {securities} s WHERE EXISTS (
+                SELECT 1 FROM {history_source} h WHERE h.security_id = s.id
+                AND h.datetime >= ? AND h.datetime <= ? AND h.frequency = ?)
+            ORDER BY s.id
+        ''', parameters)
+        found = [row['symbol'] for row in cursor.fetchall()]
+        cursor.execute(f'''
+            SELECT DISTINCT h.datetime FROM {securities} s
+            JOIN {history_source} h ON h.security_id = s.id
+            WHERE h.datetime >= ? AND h.datetime <= ? AND h.frequency = ?
+            ORDER BY h.datetime
+        ''', parameters)
+        return found, [row['datetime'] for row in cursor.fetchall()]
+    finally:
+        cursor.close()
+        connection.close()
+
+
+# Comparisons of history columns which can be pushed down into SQL
+SQL_OPERATORS = ('<', '<=', '>', '>=', '=', '!=')
+
+
+def find_symbols(conditions: list[tuple[str, str, float]], symbols: list[str]|None = None,
+                 start: str|None = None, end: str|None = None, frequency: str = '1d') -> list[str]:
+    """
+    Get the symbols of `symbols`, or of all securities if None, having a bar of
+    `frequency` between `start` and `end` satisfying all (column, operator,
+    value) conditions, ordered by security.
+    """
+    s = dt.fromisoformat(start) if start else None
+    e = dt.fromisoformat(end) if end else None
+
+    connection = get_connection()
+    cursor = connection.cursor()
+    try:
+        history_source = _attach_shards(connection)
+        compact = get_history_layout(cursor) == HistoryLayout.COMPACT
+        where = []
+        parameters: list[Any] = [0 if s is None else s, dt.max if e is None else e,
+                                 _frequency_value(cursor, frequency)]
+        for column, operator, value in conditions:
+            if column not in HISTORY_COLUMNS or operator not in SQL_OPERATORS:
+                raise ValueError(f'can not push {column} {operator} down')
+            # prices of the compact layout are stored in fen, decoded as they are read
+            decoded = f'h.{column} / 100.0' if compact and column in PRICE_COLUMNS else f'h.{column}'
+            where.append(f'AND {decoded} {operator} ?')
+            parameters.append(value)
+        securities = _wanted_securities(cursor, symbols)
+        cursor.execute(f'''
+            SELECT symbol FROM {securities} s WHERE EXISTS (
+                SELECT 1 FROM {history_source} h WHERE h.security_id = s.id
+                AND h.datetime >= ? AND h.datetime <= ? AND h.frequency = ? {' '.join(where)})
+            ORDER BY s.id
+        ''', parameters)
+        return [row['symbol'] for row in cursor.fetchall()]
+    finally:
+        cursor.close()
+        connection.close()
+
+
+def get_indicator_states(name: str) -> dict[int, sqlite3.Row]:
+    """Get the stored states of the indicator `name` by security id."""
+    connection = get_connection()
+    cursor = connection.cursor()
+    try:
+        cursor.execute(f'''
+            SELECT security_id, datetime, state FROM {Tables.INDICATOR_STATE} WHERE name = ?
+        ''', (name,))
+        return {row['security_id']: row for row in cursor.fetchall()}
+    finally:
+        cursor.close()
+        connection.close()
+
+
+@metrics.timed('write_indicators')
+def write_indicators(name: str, values: list[tuple[int, str, dt, float]],
+                     states: list[tuple[int, dt, str]]) -> None:
+    """
+    Write the (security_id, column, datetime, value) values of the indicator
+    `name` and its (security_id, datetime, state) states in a single transaction.
+    """
+    connection = get_connection()
+    cursor = connection.cursor()
+    try:
+        cursor.executemany(f'''
+            INSERT OR REPLACE INTO {Tables.INDICATOR} (security_id, name, datetime, value)
+            VALUES (?, ?, ?, ?)
+        ''', values)
+        cursor.executemany(f'''
+            INSERT OR REPLACE INTO {Tables.INDICATOR_STATE} (security_id, name, datetime, state)
+            VALUES (?, ?, ?, ?)
+        ''', [(security_id, name, datetime, state) for security_id, datetime, state in states])
+        connection.commit()
+        metrics.DB_ROWS_WRITTEN.inc(len(values), table=Tables.INDICATOR)
+    finally:
+        cursor.close()
+        connection.close()
+
+
+def delete_indicators(name: str, columns: tuple[str, ...]) -> None:
+    """Delete the values of `columns` and the states of the indicator `name`."""
+    connection = get_connection()
+    cursor = connection.cursor()
+    try:
+        cursor.executemany(f'DELETE FROM {Tables.INDICATOR} WHERE name = ?',
+                           [(column,) for column in columns])
+        cursor.execute(f'DELETE FROM {Tables.INDICATOR_STATE} WHERE name = ?', (name,))
+        connection.commit()
+    finally:
+        cursor.close()
+        connection.close()
+
+
+@metrics.timed('get_indicators')
+def get_indicators(symbols: list[str], columns: list[str], start: str|None = None,
+                   end: str|None = None) -> Mapping[str, list[sqlite3.Row]]:
+    """Get the (name, datetime, value) indicator values of `columns` of each symbol."""
+    s = dt.fromisoformat(start) if start else None
+    e = dt.fromisoformat(end) if end else None
+
+    connection = get_connection()
+    cursor = connection.cursor()
+    try:
+        result = {}
+        for symbol in symbols:
+            cursor.execute(f'''
+                SELECT i.name, i.datetime, i.value FROM {Tables.SECURITY} s
+                JOIN {Tables.INDICATOR} i ON i.security_id = s.id
+                WHERE s.symbol = ? AND i.name IN ({','.join(['?'] * len(columns))})
+                AND i.datetime >= ? AND i.datetime <= ?
+            ''', (symbol, *columns, 0 if s is None else s, dt.max if e is None else e))
+            result[symbol] = cursor.fetchall()
+            metrics.DB_ROWS_READ.inc(len(result[symbol]), table=Tables.INDICATOR)
+        return result
+    finally:
+        cursor.close()
+        connection.close()
+
+
+def get_adjustments(symbols: list[str]) -> Mapping[str, list[sqlite3.Row]]:
+    """Get the (datetime, factor) adjustment factors of each symbol in order."""
+    connection = get_connection()
+    cursor = connection.cursor()
+    try:
+        result = {}
+        for symbol in symbols:
+            cursor.execute(f'''
+                SELECT a.datetime, a.factor FROM {Tables.SECURITY} s
+                JOIN {Tables.ADJUSTMENT} a ON a.security_id = s.id
+                WHERE s.symbol = ? ORDER BY a.datetime
+            ''', (symbol,))
+            result[symbol] = cursor.fetchall()
+        return result
+    finally:
+        cursor.close()
+        connection.close()
+
+
+def get_adjustment_bases(security_ids: list[int], before: str) -> dict[int, tuple[dt, float, float]]:
+    """
+    Get the datetime and close of the last daily bar before `before` of each
+    security and its adjustment factor, to continue the factors over the bars
+    from `before` on. Securities without such a bar are left out.
+    """
+    b = dt.fromisoformat(before)
+    connection = get_connection()
+    cursor = connection.cursor()
+    try:
+        history_source = _attach_shards(connection)
+        compact = get_history_layout(cursor) == HistoryLayout.COMPACT
+        frequency = _frequency_value(cursor, '1d')
+        result = {}
+        for security_id in security_ids:
+            cursor.execute(f'''
+                SELECT datetime, close FROM {history_source} WHERE security_id = ? AND frequency = ?
+                AND datetime < ? ORDER BY datetime DESC LIMIT 1
+            ''', (security_id, frequency, b))
+            bar = cursor.fetchone()
+            if bar is None:
+                continue
+            cursor.execute(f'''
+                SELECT factor FROM {Tables.ADJUSTMENT} WHERE security_id = ? AND datetime < ?
+                ORDER BY datetime DESC LIMIT 1
+            ''', (security_id, b))
+            factor = cursor.fetchone()
+            # the union of shards loses the declared type converting fen
+            close = bar['close'] / 100 if compact and isinstance(bar['close'], int) else bar['close']
+            result[security_id] = (bar['datetime'], float(close), 1.0 if factor is None else factor['factor'])
+        return result
+    finally:
+        cursor.close()
+        connection.close()
+
+
 def get_exchange_id(acronym: str) -> int|None:
     """Get exchange ID from the database."""
     connection = get_connection()
@@ -347,3 +1301,136 @@ def _get_data_from_table(table: str, field: str, value_in: Any|list[Any]) -> sql
     finally:
         cursor.close()
         connection.close()
+
+
+def start_run(start: str|None, as_of: str, security_ids: list[int]) -> int:
+    """
+    Start an update run fetching history from `start` for the securities.
+    `as_of` is stored as the history update date once the run completes.
+    """
+    connection = get_connection()
+    cursor = connection.cursor()
+    try:
+        cursor.execute(f'''
+            INSERT INTO {Tables.RUN} (started_at, start, as_of, status)
+            VALUES (?, ?, ?, ?)
+        ''', (dt.now(), start, as_of, RunStatus.RUNNING))
+        run_id = cursor.lastrowid
+        cursor.executemany(f'''
+            INSERT INTO {Tables.RUN_ITEM} (run_id, security_id, status) VALUES (?, ?, ?)
+        ''', [(run_id, security_id, ItemStatus.PENDING) for security_id in security_ids])
+        connection.commit()
+        return run_id   # type: ignore
+    finally:
+        cursor.close()
+        connection.close()
+
+
+def get_unfinished_run() -> sqlite3.Row|None:
+    """Get the latest run which has not completed."""
+    connection = get_connection()
+    cursor = connection.cursor()
+    try:
+        cursor.execute(f'''
+            SELECT * FROM {Tables.RUN} WHERE status = ? ORDER BY id DESC LIMIT 1
+        ''', (RunStatus.RUNNING,))
+        return cursor.fetchone()
+    finally:
+        cursor.close()
+        connection.close()
+
+
+def add_run_items(run_id: int, security_ids: list[int]) -> None:
+    """Add securities which are not yet part of a run as pending."""
+    connection = get_connection()
+    cursor = connection.cursor()
+    try:
+        cursor.executemany(f'''
+            INSERT OR IGNORE INTO {Tables.RUN_ITEM} (run_id, security_id, status) VALUES (?, ?, ?)
+        ''', [(run_id, security_id, ItemStatus.PENDING) for security_id in security_ids])
+        connection.commit()
+    finally:
+        cursor.close()
+        connection.close()
+
+
+def get_run_todo(run_id: int) -> list[int]:
+    """Get the securities of a run which are pending or failed and may be retried."""
+    connection = get_connection()
+    cursor = connection.cursor()
+    try:
+        cursor.execute(f'''
+            SELECT security_id FROM {Tables.RUN_ITEM}
+            WHERE run_id = ? AND (status = ? OR (status = ? AND attempts < ?))
+            ORDER BY security_id
+        ''', (run_id, ItemStatus.PENDING, ItemStatus.FAILED, MAX_RUN_ATTEMPTS))
+        return [row['security_id'] for row in cursor.fetchall()]
+    finally:
+        cursor.close()
+        connection.close()
+
+
+def mark_run_items(run_id: int, items: list[tuple[int, str, int, str|None]]) -> None:
+    """Record (security_id, status, rows, error) results of a run."""
+    connection = get_connection()
+    cursor = connection.cursor()
+    try:
+        _mark_run_items(cursor, run_id, items)
+        connection.commit()
+    finally:
+        cursor.close()
+        connection.close()
+
+
+def _mark_run_items(cursor: sqlite3.Cursor, run_id: int,
+                    items: list[tuple[int, str, int, str|None]]) -> None:
+    cursor.executemany(f'''
+        UPDATE {Tables.RUN_ITEM}
+        SET status = ?, rows = ?, error = ?, attempts = attempts + 1, updated_at = ?
+        WHERE run_id = ? AND security_id = ?
+    ''', [(status, rows, error, dt.now(), run_id, security_id)
+          for security_id, status, rows, error in items])
+
+
+def finish_run(run_id: int, meta_key: str) -> bool:
+    """
+    Complete a run if no security is left to retry, storing its `as_of` date
+    under `meta_key` in the same transaction. Return whether the run completed.
+    """
+    connection = get_connection()
+    cursor = connection.cursor()
+    try:
+        cursor.execute(f'''
+            SELECT COUNT(*) AS todo FROM {Tables.RUN_ITEM}
+            WHERE run_id = ? AND (status = ? OR (status = ? AND attempts < ?))
+        ''', (run_id, ItemStatus.PENDING, ItemStatus.FAILED, MAX_RUN_ATTEMPTS))
+        if cursor.fetchone()['todo'] > 0:
+            return False
+        cursor.execute(f'''
+            UPDATE {Tables.RUN} SET status = ?, finished_at = ? WHERE id = ?
+        ''', (RunStatus.COMPLETED, dt.now(), run_id))
+        cursor.execute(f'''
+            INSERT OR REPLACE INTO meta (key, value)
+            SELECT ?, as_of FROM {Tables.RUN} WHERE id = ?
+        ''', (meta_key, run_id))
+        connection.commit()
+        return True
+    finally:
+        cursor.close()
+        connection.close()
+
+
+def get_run_failures(run_id: int) -> list[sqlite3.Row]:
+    """Get the securities of a run which failed, with their symbols and errors."""
+    connection = get_connection()
+    cursor = connection.cursor()
+    try:
+        cursor.execute(f'''
+            SELECT s.symbol, i.attempts, i.error FROM {Tables.RUN_ITEM} i
+            LEFT JOIN {Tables.SECURITY} s ON s.id = i.security_id
+            WHERE i.run_id = ? AND i.status = ?
+        ''', (run_id, ItemStatus.FAILED))
+        return cursor.fetchall()
+    finally:
+        cursor.close()
+        connection.close()
@@ -0,0 +1,192 @@
+"""
+rock/data/export.py
+This module streams history from the database into CSV, Arrow IPC or Parquet files.
+Arrow IPC and Parquet need pyarrow, installed with the `export` extra.
+"""
+import argparse
+import csv
+import json
+import sys
+from concurrent.futures import ProcessPoolExecutor
+from enum import StrEnum
+from pathlib import Path
+from typing import Any
+from rock.data import db
+from rock.logger import logger
+
+
+class Format(StrEnum):
+    """Export file formats."""
+    CSV = 'csv'
+    ARROW = 'arrow'
+    PARQUET = 'parquet'
+
+
+EXPORT_COLUMNS = ('symbol', 'datetime', 'open', 'close', 'high', 'low',
+                  'adj_close', 'volume', 'amount', 'frequency')
+
+
+class _CsvWriter:
+    """Writes history rows to a CSV file."""
+
+    def __init__(self, path: Path):
+        self._file = open(path, 'w', newline='', encoding='utf-8')  # pylint: disable=consider-using-with
+        self._writer = csv.writer(self._file)
+        self._writer.writerow(EXPORT_COLUMNS)
+
+    def write(self, rows: list) -> None:
+        """Write a chunk of rows of `db.iter_history`."""
+        self._writer.writerows((row[0], row[2].isoformat(), *row[3:]) for row in rows)
+
+    def close(self) -> None:
+        """Close the file."""
+        self._file.close()
+
+
+class _ArrowWriter:
+    """Writes history rows to an Arrow IPC or Parquet file, one record batch per chunk."""
+
+    def __init__(self, path: Path, fmt: Format):
+        try:
+            # pylint: disable=import-outside-toplevel
+            import pyarrow as pa
+            from pyarrow import ipc
+            from pyarrow import parquet
+        except ImportError as e:
+            raise RuntimeError(f"pyarrow is required to export {fmt}, install rock[export]") from e
+        self._pa = pa
+        self.schema = pa.schema([
+            ('symbol', pa.string()),
+            ('datetime', pa.timestamp('s')),
+            *((column, pa.float64()) for column in db.PRICE_COLUMNS),
+            ('volume', pa.int64()),
+            ('amount', pa.int64()),
+            ('frequency', pa.string()),
+        ])
+        if fmt == Format.PARQUET:
+            self._writer = parquet.ParquetWriter(path, self.schema)
+        else:
+            self._writer = ipc.new_file(path, self.schema)
+
+    def write(self, rows: list) -> None:
+        """Write a chunk of rows of `db.iter_history`."""
+        columns = list(zip(*rows))
+        del columns[1]
+        # iter_history orders prices as open, close, high, low, adj_close like PRICE_COLUMNS
+        self._writer.write_batch(self._pa.record_batch(
+            [self._pa.array(column, type=field.type) for column, field in zip(columns, self.schema)],
+            schema=self.schema))
+
+    def close(self) -> None:
+        """Finish and close the file."""
+        self._writer.close()
+
+
+def _open_writer(path: Path, fmt: Format) -> _CsvWriter | _ArrowWriter:
+    if fmt == Format.CSV:
+        return _CsvWriter(path)
+    return _ArrowWriter(path, fmt)
+
+
+def _export_part(db_path: str, path: str, fmt: Format, symbols: list[str] | None,
+                 start: str | None, end: str | None, since: int | None, chunk_rows: int) -> int:
+    """Export the history of `symbols` to one file and return the number of rows."""
+    db.DB_PATH = Path(db_path)
+    writer = _open_writer(Path(path), fmt)
+    rows = 0
+    try:
+        for chunk in db.iter_history(symbols, start, end, chunk_rows, since):
+            writer.write(chunk)
+            rows += len(chunk)
+    finally:
+        writer.close()
+    return rows
+
+
+def export_history(path: str | Path, fmt: Format | str | None = None,
+                   symbols: list[str] | None = None, start: str | None = None,
+                   end: str | None = None, since: int | None = None,
+                   chunk_rows: int = 100_000, workers: int = 1) -> dict[str, Any]:
+    """
+    Stream history into a file without holding it in memory.
+    Args:
+        path (str | Path): The output file, or with several workers the output directory.
+        fmt (Format | str | None): The file format, by default from the suffix of `path`.
+        symbols (list[str] | None): The symbols to export, all securities if None.
+        start (str | None): The start date in YYYY-MM-DD format.
+        end (str | None): The end date in YYYY-MM-DD format.
+        since (int | None): Only export rows written after this history generation.
+        chunk_rows (int): Rows read and written at a time.
+        workers (int): Processes exporting contiguous symbol ranges, each to its own part file.
+    Returns:
+        dict[str, Any]: The number of rows, the files written and the generation to pass
+            as `since` to the next incremental export. Rows may be exported again by
+            it but are never missed.
+    """
+    path = Path(path)
+    fmt = Format(fmt or path.suffix.lstrip('.') or Format.CSV)
+    # a run in progress may still write the current generation
+    generation = db.get_generation()
+    if db.get_unfinished_run() is not None:
+        generation -= 1
+
+    if workers <= 1:
+        path.parent.mkdir(parents=True, exist_ok=True)
+        parts = [(str(path), symbols)]
+    else:
+        if symbols is None:
+            symbols = [security['symbol'] for security in
+                       sorted(db.get_all_securities(), key=lambda security: security['id'])]
+        size = -(-len(symbols) // workers)
+        path.mkdir(parents=True, exist_ok=True)
+        parts = [(str(path / f'part-{i:03d}.{fmt}'), symbols[offset:offset + size])
+                 for i, offset in enumerate(range(0, len(symbols), size))]
+
+    if len(parts) == 1:
+        counts = [_export_part(str(db.DB_PATH), parts[0][0], fmt, parts[0][1],
+                               start, end, since, chunk_rows)]
+    else:
+        with ProcessPoolExecutor(min(workers, len(parts))) as executor:
+            counts = list(executor.map(_export_part, *zip(*[
+                (str(db.DB_PATH), part, fmt, part_symbols, start, end, since, chunk_rows)
+                for part, part_symbols in parts])))
+
+    logger.info("Exported %d history rows to %s.", sum(counts), path)
+    return {
+        'rows': sum(counts),
+        'files': [part for part, _ in parts],
+        'generation': generation,
+    }
+
+
+def parse_args(argv: list[str] | None = None) -> argparse.Namespace:
+    """Parse the command line arguments of the export tool."""
+    parser = argparse.ArgumentParser(prog='rock-export', description='Export history of the rock database.')
+    parser.add_argument('path', help='output file, or output directory with several workers')
+    parser.add_argument('--format', choices=[fmt.value for fmt in Format],
+                        help='file format (default: from the suffix of PATH)')
+    parser.add_argument('--symbols', help='comma separated symbols (default: all)')
+    parser.add_argument('--start', help='start date, YYYY-MM-DD')
+    parser.add_argument('--end', help='end date, YYYY-MM-DD')
+    parser.add_argument('--since', type=int, metavar='GENERATION',
+                        help='only export rows written after this generation, '
+                             'as printed by the previous export')
+    parser.add_argument('--chunk-rows', type=int, default=100_000, metavar='N',
+                        help='rows read and written at a time (default: %(default)s)')
+    parser.add_argument('--workers', type=int, default=1, metavar='N',
+                        help='export symbol ranges in N processes to part files (default: %(default)s)')
+    return parser.parse_args(argv)
+
+
+def run(argv: list[str] | None = None) -> None:
+    """Run the export tool and print its summary as JSON."""
+    args = parse_args(argv)
+    summary = export_history(args.path, args.format,
+                             args.symbols.split(',') if args.symbols else None,
+                             args.start, args.end, args.since, args.chunk_rows, args.workers)
+    json.dump(summary, sys.stdout, indent=2)
+    print()
+
+
+if __name__ == "__main__":
+    run()
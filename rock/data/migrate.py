@@ -0,0 +1,39 @@
+"""
+rock/data/migrate.py
+Command line tool converting the history of the database to another layout.
+"""
+import argparse
+from rock.data import db
+from rock.logger import logger
+
+
+def parse_args(argv: list[str] | None = None) -> argparse.Namespace:
+    """Parse the command line arguments of the migration tool."""
+    parser = argparse.ArgumentParser(prog='rock-migrate-db',
+                                     description='Convert the history of the rock database to another layout.')
+    parser.add_argument('layout', choices=[layout.value for layout in db.HistoryLayout],
+                        help='the layout to convert to')
+    parser.add_argument('--batch-size', type=int, default=200, metavar='N',
+                        help='securities copied per transaction (default: %(default)s)')
+    parser.add_argument('--vacuum', action='store_true',
+                        help='rebuild the database files afterwards to return the freed space; '
+                             'this locks the database until it is done')
+    return parser.parse_args(argv)
+
+
+def run(argv: list[str] | None = None) -> None:
+    """Run the migration tool."""
+    args = parse_args(argv)
+    if not db.db_exist():
+        logger.error("Database %s does not exist.", db.DB_PATH)
+        return
+
+    copied = db.migrate_history_layout(db.HistoryLayout(args.layout), args.batch_size)
+    logger.info("History is in the %s layout, %d rows converted.", args.layout, copied)
+    if args.vacuum:
+        db.vacuum()
+        logger.info("Database vacuumed.")
+
+
+if __name__ == "__main__":
+    run()
@@ -3,7 +3,8 @@ web_scraper.py
 This module provides a function to retrieve stock related data.
 """
 from collections.abc import Sequence, Mapping
-from pandas import DataFrame
+from concurrent.futures import Executor
+from pandas import DataFrame, to_datetime
 from rock.common.types import Interval
 from rock.em import utils as em_utils
 
@@ -22,7 +23,8 @@ INTERVAL_KLT_MAPPING = {
 def get_history(symboles: Sequence[str],
                  interval: Interval = Interval.ONE_DAY,
                  start: str | None = None,   # YYYY-MM-DD
-                 end: str | None = None      # YYYY-MM-DD
+                 end: str | None = None,     # YYYY-MM-DD
+                 parse_pool: Executor | None = None
              ) -> Mapping[str, DataFrame]:
     """
     Retrieve historical stock data for the given symbols.
@@ -31,14 +33,22 @@ def get_history(symboles: Sequence[str],
         interval (Interval): The interval for the data.
         start (str | None): The start date in YYYY-MM-DD format.
         end (str | None): The end date in YYYY-MM-DD format.
+        parse_pool (Executor | None): A process pool to parse responses in, so the
+            fetch threads only download. Responses are parsed in the fetch threads if None.
     Returns:
-        Mapping[str, DataFrame]: A dictionary of DataFrames containing historical data for each symbol.
+        Mapping[str, DataFrame]: A dictionary of DataFrames containing unadjusted historical data
+            for each symbol, with the `change` of each close from the reference close of the
+            exchange to derive adjustment factors from. Symbols which could not be fetched are
+            missing from the dictionary.
     """
     start = str(start).replace('-', '') if start is not None else '19000101'
     end = str(end).replace('-', '') if end is not None else '20500101'
 
     klt = INTERVAL_KLT_MAPPING.get(interval, 101)
-    not_adjusted = em_utils.get_quote_history(
+    if parse_pool is not None:
+        return _get_history_arrays(list(symboles), klt, start, end, parse_pool)
+
+    histories = em_utils.get_quote_history(
         list(symboles),
         start,
         end,
@@ -48,30 +58,74 @@ def get_history(symboles: Sequence[str],
         True
     )
 
-    adjusted = em_utils.get_quote_history(
-        list(symboles),
-        start,
-        end,
-        klt,
-        1,
-        True,
-        True
-    )
+    result = {}
+    for s in symboles:
+        if s not in histories:
+            # fetching failed, leave the symbol out so callers can retry it
+            continue
+        df = histories[s]
+        result[s] = DataFrame({
+            'name': df['股票名称'],
+            'datetime': df['日期'],
+            'open': df['开盘'],
+            'high': df['最高'],
+            'low': df['最低'],
+            'close': df['收盘'],
+            'change': df['涨跌额'],
+            'volume': df['成交量'],
+            'amount': df['成交额']
+        })
+
+    return result
+
+
+def get_snapshot() -> DataFrame:
+    """
+    Retrieve the latest daily bar of every A-share in a few requests.
+    Returns:
+        DataFrame: The `symbol`, `name` and `datetime` (YYYY-MM-DD, in China time) of each
+            quote and its unadjusted open, close, high, low, volume and amount so far, with
+            the `change` of the close from the reference close and the `timestamp` of the
+            quote in seconds since the epoch. Prices are NaN for securities which did not trade.
+    """
+    df = em_utils.get_market_snapshot()
+    updated = to_datetime(df['更新时间'], unit='s', utc=True).dt.tz_convert('Asia/Shanghai')
+    return DataFrame({
+        'symbol': df['代码'].astype(str),
+        'name': df['名称'],
+        'datetime': updated.dt.strftime('%Y-%m-%d'),
+        'open': df['开盘'],
+        'high': df['最高'],
+        'low': df['最低'],
+        'close': df['收盘'],
+        'change': df['收盘'] - df['昨收'],
+        'volume': df['成交量'],
+        'amount': df['成交额'],
+        'timestamp': df['更新时间']
+    })
+
+
+def _get_history_arrays(symboles: list[str], klt: int, start: str, end: str,
+                        parse_pool: Executor) -> Mapping[str, DataFrame]:
+    """Retrieve historical stock data, parsing the responses in `parse_pool`."""
+    histories = em_utils.get_quote_history_arrays(symboles, parse_pool, start, end, klt, 0,
+                                                  suppress_error=True)
 
     result = {}
     for s in symboles:
-        not_adjusted_df = not_adjusted[s].set_index('日期', drop=False)
-        adjusted_df = adjusted[s].set_index('日期', drop=False)
+        if s not in histories:
+            continue
+        bars = histories[s]
         result[s] = DataFrame({
-            'name': not_adjusted_df['股票名称'],
-            'datetime': not_adjusted_df['日期'],
-            'open': not_adjusted_df['开盘'],
-            'high': not_adjusted_df['最高'],
-            'low': not_adjusted_df['最低'],
-            'close': not_adjusted_df['收盘'],
-            'adj_close': adjusted_df['收盘'],
-            'volume': not_adjusted_df['成交量'],
-            'amount': not_adjusted_df['成交额']
+            'name': bars.name,
+            'datetime': bars.datetime,
+            'open': bars.open,
+            'high': bars.high,
+            'low': bars.low,
+            'close': bars.close,
+            'change': bars.change,
+            'volume': bars.volume,
+            'amount': bars.amount
         })
 
     return result
@@ -0,0 +1,138 @@
+"""
+rock/data/writer.py
+This module provides a dedicated thread writing history to the database in large transactions.
+"""
+import queue
+import threading
+import time
+from typing import Any
+from rock.data import db
+from rock import profiling
+from rock.logger import logger
+
+
+# A transaction is committed once it holds this many rows...
+MAX_TRANSACTION_ROWS = 50_000
+# ...or its first batch has waited this many seconds
+MAX_TRANSACTION_DELAY = 1.0
+
+_STOP = object()
+
+
+class HistoryWriter:
+    """
+    Writes history batches put by any thread from a single writer thread.
+    Batches of many securities are grouped into one transaction together with
+    their run results, so a run commits once per transaction instead of once per
+    security. Pending batches are committed when the writer is closed.
+    A failed transaction stops the writer; the error is raised by the next
+    `put`, `flush` or `close`, and batches after it are dropped.
+    """
+
+    def __init__(self, run_id: int | None = None, max_rows: int = MAX_TRANSACTION_ROWS,
+                 max_delay: float = MAX_TRANSACTION_DELAY, max_pending: int = 64):
+        self.run_id = run_id
+        self.max_rows = max_rows
+        self.max_delay = max_delay
+        self.transactions = 0
+        self.rows = 0
+        self.counts = db.WriteCounts()
+        self._queue: queue.Queue = queue.Queue(max_pending)
+        self._thread: threading.Thread | None = None
+        self._error: BaseException | None = None
+
+    def __enter__(self) -> 'HistoryWriter':
+        self.start()
+        return self
+
+    def __exit__(self, *exc_info) -> None:
+        self.close()
+
+    def start(self) -> None:
+        """Start the writer thread."""
+        self._thread = threading.Thread(target=self._run, name='rock-writer', daemon=True)
+        self._thread.start()
+
+    def put(self, history: list[tuple], result: tuple[int, str, int, str | None] | None = None,
+            adjustments: list[tuple[int, str, float]] = ()) -> None:
+        """
+        Queue history rows in the format of `db.bulk_insert_history`, with the
+        (security_id, status, rows, error) run result and the (security_id, date,
+        factor) adjustment factors to record with them.
+        Blocks while `max_pending` batches are waiting.
+        """
+        self._check()
+        self._queue.put((history, result, adjustments))
+
+    def flush(self) -> None:
+        """Commit all queued batches and wait until they are written."""
+        done = threading.Event()
+        self._queue.put(done)
+        while not done.wait(0.1):
+            if self._thread is None or not self._thread.is_alive():
+                break
+        self._check()
+
+    def close(self) -> None:
+        """Commit all queued batches and stop the writer thread."""
+        if self._thread is not None:
+            self._queue.put(_STOP)
+            self._thread.join()
+            self._thread = None
+        self._check()
+
+    def _check(self) -> None:
+        if self._error is not None:
+            raise RuntimeError('history writer failed') from self._error
+
+    def _run(self) -> None:
+        history: list[tuple] = []
+        results: list[tuple] = []
+        adjustments: list[tuple] = []
+        waiters: list[threading.Event] = []
+        deadline = None
+        stopping = False
+        while not stopping:
+            timeout = None if deadline is None else max(0.0, deadline - time.monotonic())
+            try:
+                item: Any = self._queue.get(timeout=timeout)
+            except queue.Empty:
+                item = None
+
+            if item is _STOP:
+                stopping = True
+            elif isinstance(item, threading.Event):
+                waiters.append(item)
+            elif item is not None:
+                batch, result, factors = item
+                history.extend(batch)
+                adjustments.extend(factors)
+                if result is not None:
+                    results.append(result)
+                if deadline is None:
+                    deadline = time.monotonic() + self.max_delay
+
+            # batches arriving steadily do not postpone the deadline of the first one
+            expired = deadline is not None and time.monotonic() >= deadline
+            if item is None or stopping or waiters or expired or len(history) >= self.max_rows:
+                if history or results:
+                    self._commit(history, results, adjustments)
+                    history, results, adjustments = [], [], []
+                deadline = None
+                for waiter in waiters:
+                    waiter.set()
+                waiters.clear()
+
+    def _commit(self, history: list[tuple], results: list[tuple], adjustments: list[tuple]) -> None:
+        if self._error is not None:
+            return
+        try:
+            with profiling.span('db_write'):
+                counts = db.write_history(history, self.run_id, results, adjustments=adjustments)
+        except Exception as e:  # pylint: disable=W0718
+            logger.error("Failed to write %d history rows: %s", len(history), e)
+            self._error = e
+            return
+        self.transactions += 1
+        self.rows += len(history)
+        self.counts += counts
@@ -1,13 +1,16 @@
 """Service code for data."""
 
-import pkgutil
-import importlib
+import argparse
+from collections import defaultdict
+from collections.abc import Sequence
+from concurrent.futures import ProcessPoolExecutor, ThreadPoolExecutor, as_completed
 from enum import StrEnum
-from typing import Generator
-from types import ModuleType
-from sqlite3 import Row, Error
-from rock.data import db, web_scraper
-from rock import exchange
+from sqlite3 import Row
+import numpy as np
+import pandas as pd
+from rock.data import db, web_scraper, writer
+from rock import adjustment, exchange, indicators, metrics, panel, profiling, config
+from rock.exchange.common import ExchangeModule
 from rock.logger import logger
 from rock.common import utils
 
@@ -15,36 +18,51 @@ from rock.common import utils
 class DBKeys(StrEnum):
     """Keys for database metadata."""
     HISTORY_UPDATED_AT = 'history_updated_at'
+    # set once full histories were fetched with their adjustment factors
+    ADJUSTMENT_FACTORS = 'adjustment_factors'
+
+
+# Securities fetched and inserted between two journal updates
+HISTORY_CHUNK_SIZE = 100
+
+# Securities whose indicators are computed together
+INDICATOR_BATCH_SIZE = 500
+
+# Fraction of the securities with a bar on the last stored day whose previous
+# close in the market snapshot must be that bar, for the snapshot to follow it
+SNAPSHOT_MATCH = 0.9
 
 
 def init_db() -> None:
     """Initialize the database."""
     for module in get_exchange_modules():
-        if not hasattr(module, 'METADATA'):
-            logger.warning("Module %s does not have METADATA.", module.__name__)
-            continue
-
         db.insert_exchange(*module.METADATA)
 
     logger.info("Database initialized successfully.")
 
 
 def update_securities() -> None:
-    """Update the securities in the database."""
+    """
+    Update the securities in the database. The listings of all exchanges are
+    fetched concurrently and written as each one arrives.
+    """
     logger.info("Updating securities...")
 
-    for module in get_exchange_modules():
-        if not hasattr(module, 'get_stock_list'):
-            logger.warning("Module %s does not have get_stock_list function.", module.__name__)
-            continue
-
-        if hasattr(module, 'get_a_shares'):
+    modules = get_exchange_modules()
+    if not modules:
+        logger.info("Securities updated.")
+        return
+    known = {security['symbol']: security for security in db.get_all_securities()}
+    with ThreadPoolExecutor(max_workers=len(modules)) as fetchers:
+        futures = {fetchers.submit(module.get_a_shares): module for module in modules}
+        for future in as_completed(futures):
+            module = futures[future]
             try:
-                stock_list = module.get_a_shares()
+                stock_list = future.result()
                 exchange_id = db.get_exchange_id(module.METADATA.acronym)
                 insert_list = []
                 for stock in stock_list:
-                    security: Row|None = db.get_security(str(stock.symbol))  # type: ignore
+                    security = known.get(str(stock.symbol))
                     if not security:
                         insert_list.append((stock.symbol, stock.name, 'stock',
                                            stock.listing,
@@ -56,59 +74,351 @@ def update_securities() -> None:
                         # security already exists and is not delisted
                         continue
                 db.insert_securities(insert_list)
-            except Error as e:  # pylint: disable=W0718
+            except Exception as e:  # pylint: disable=W0718
                 logger.error("Error updating securities from %s: %s", module.__name__, e)
                 continue
 
     logger.info("Securities updated.")
 
 
-def update_histories(inc: bool = False) -> None:
-    """Update the historical data in the database."""
+def update_histories(inc: bool = False, chunk_size: int = HISTORY_CHUNK_SIZE,
+                     parse_processes: int = 0, indicator_names: Sequence[str] = (),
+                     snapshot: bool = True, bootstrap: bool = True) -> None:
+    """
+    Update the historical data in the database.
+    Progress is journaled per security, so an interrupted run is resumed by the
+    next call: finished securities are skipped and only pending and failed ones
+    are fetched again. Securities failing to fetch are retried within the call
+    until they succeed or `db.MAX_RUN_ATTEMPTS` attempts failed, so they do not
+    hold back the others. The history update date is only written once the run completes.
+    With `parse_processes` > 0 responses are parsed in a pool of that many
+    processes and the fetch threads only download. Histories are written by a
+    single writer thread in transactions spanning many securities.
+    Bars are fetched unadjusted, with the adjustment factors of their corporate
+    actions derived from them. Histories stored without adjustment factors are
+    fetched again in full once.
+    With `snapshot`, an incremental update takes the bars of the latest trading
+    day of the whole market from a few market snapshot requests when the stored
+    histories end on the day before it, and fetches K-lines only for the others.
+    With `bootstrap`, the first full load of an empty database runs in the
+    bootstrap mode of `db.begin_bootstrap` until the run completes.
+    The indicators `indicator_names` are then advanced over the new bars.
+    """
     logger.info("Updating historical data...")
-    securities = db.get_all_securities()
-    history_updated_at = db.get_meta(DBKeys.HISTORY_UPDATED_AT)
-    histories = web_scraper.get_history(
-        [security['symbol'] for security in securities],
+    securities = {security['id']: security for security in db.get_all_securities()}
+
+    run = db.get_unfinished_run()
+    if run is None:
+        history_updated_at = db.get_meta(DBKeys.HISTORY_UPDATED_AT)
         start = history_updated_at if inc else None
-    )
-    for security in securities:
-        history = histories[security['symbol']]
-        if not history.empty:
-            db.bulk_insert_history([(
-                int(security['id']),
-                str(row.datetime),
-                float(row.open),    # type: ignore
-                float(row.close),    # type: ignore
-                float(row.high),    # type: ignore
-                float(row.low),    # type: ignore
-                float(row.adj_close),    # type: ignore
-                int(row.volume),    # type: ignore
-                int(row.amount),    # type: ignore
-                web_scraper.Interval.ONE_DAY,
-            ) for row in history.itertuples(index=False)])
-        else:
-            logger.warning("No history data for %s", security['symbol'])
-    db.insert_meta(DBKeys.HISTORY_UPDATED_AT, utils.get_current_date())
-    logger.info("Historical data updated.")
+        if start is not None and db.get_meta(DBKeys.ADJUSTMENT_FACTORS) is None:
+            logger.info("Fetching full histories once to derive their adjustment factors.")
+            start = None
+        run_id = db.start_run(start, utils.get_current_date(), list(securities))
+        if bootstrap and start is None and not db.has_history():
+            db.begin_bootstrap()
+    else:
+        run_id, start = run['id'], run['start']
+        logger.info("Resuming run %d started at %s.", run_id, run['started_at'])
+        db.add_run_items(run_id, list(securities))
+
+    bootstrapping = db.resume_bootstrap()
+
+    # rows written by this run can be exported incrementally by their generation
+    generation = db.bump_generation()
+    logger.info("Writing history generation %d.", generation)
+
+    todo = [security_id for security_id in db.get_run_todo(run_id) if security_id in securities]
+    if snapshot and start is not None and todo:
+        with profiling.stage('update_from_snapshot'):
+            todo = _update_from_snapshot(run_id, [securities[i] for i in todo])
+    parse_pool = ProcessPoolExecutor(parse_processes) if parse_processes > 0 and todo else None
+    try:
+        with writer.HistoryWriter(run_id) as history_writer:
+            for attempt in range(db.MAX_RUN_ATTEMPTS):
+                if attempt:
+                    # the results of the previous pass are committed before reading what failed
+                    history_writer.flush()
+                    todo = [security_id for security_id in db.get_run_todo(run_id) if security_id in securities]
+                    if not todo:
+                        break
+                    logger.info("Retrying %d securities which failed to fetch.", len(todo))
+                _update_history_chunks(start, [securities[i] for i in todo], chunk_size,
+                                       parse_pool, history_writer)
+        logger.info("History rows inserted: %d, updated: %d, unchanged: %d.", *history_writer.counts)
+    finally:
+        if parse_pool is not None:
+            parse_pool.shutdown(cancel_futures=True)
+
+    if bootstrapping and not db.get_run_todo(run_id):
+        with profiling.stage('end_bootstrap'):
+            db.end_bootstrap()
+    if db.finish_run(run_id, DBKeys.HISTORY_UPDATED_AT):
+        if start is None:
+            db.insert_meta(DBKeys.ADJUSTMENT_FACTORS, utils.get_current_date())
+        for failure in db.get_run_failures(run_id):
+            logger.warning("Gave up on %s after %d attempts: %s",
+                           failure['symbol'], failure['attempts'], failure['error'])
+        logger.info("Historical data updated.")
+    else:
+        logger.warning("Historical data partially updated, run %d will be resumed.", run_id)
 
+    if indicator_names:
+        with profiling.stage('update_indicators'):
+            update_indicators(indicator_names)
 
-def get_exchange_modules() -> Generator[ModuleType, None,None]:
-    """Get all exchange modules."""
-    for module_info in pkgutil.iter_modules(exchange.__path__, exchange.__name__ + '.'):
-        if module_info.name.split('.')[-1].startswith('exchange'):
-            module = importlib.import_module(module_info.name)
-            yield module
 
+def update_indicators(names: Sequence[str], batch_size: int = INDICATOR_BATCH_SIZE,
+                      rebuild: bool = False) -> None:
+    """
+    Advance the stored indicators `names`, like `sma_200` or `macd_12_26_9`,
+    of every security over its daily bars after the last bar of its stored
+    state, and store their values and new states. Securities without a state
+    are computed over all their history, as are all of them with `rebuild`.
+    Bars changed at or before the last bar of a state are not taken into
+    account until the indicator is rebuilt.
+    """
+    specs = [indicators.parse_spec(name) for name in names]
+    if rebuild:
+        for spec in specs:
+            db.delete_indicators(spec.name, spec.columns)
+    states = {spec.name: db.get_indicator_states(spec.name) for spec in specs}
 
-def run() -> None:
+    # securities at the same bars of all indicators are advanced together
+    groups = defaultdict(list)
+    for security in sorted(db.get_all_securities(), key=lambda security: security['id']):
+        last = tuple(None if (state := states[spec.name].get(security['id'])) is None
+                     else state['datetime'] for spec in specs)
+        groups[last].append(security)
+
+    for last, securities in groups.items():
+        for i in range(0, len(securities), batch_size):
+            _update_indicator_batch(specs, last, securities[i:i + batch_size], states)
+    logger.info("Indicators %s updated.", ', '.join(spec.name for spec in specs))
+
+
+def _update_indicator_batch(specs: list[indicators.Spec], last: tuple, securities: list[Row],
+                            states: dict[str, dict[int, Row]]) -> None:
+    """Advance the indicators of securities whose states end at the `last` bars."""
+    start = None if None in last else min(last).isoformat()
+    fields = tuple(dict.fromkeys(field for spec in specs for field in spec.inputs))
+    bars = panel.build_panel([security['symbol'] for security in securities], start, fields=fields)
+    ids = {security['symbol']: security['id'] for security in securities}
+    security_ids = np.array([ids[symbol] for symbol in bars.symbols], dtype=np.int64)
+
+    for spec, spec_last in zip(specs, last):
+        new = np.ones(len(bars.dates), dtype=bool) if spec_last is None else bars.dates > np.datetime64(spec_last)
+        if not new.any():
+            continue
+        state = (None if spec_last is None else
+                 indicators.load_states(spec, [states[spec.name][i]['state'] for i in security_ids]))
+        columns, state = indicators.compute(spec, {field: bars[field][:, new] for field in fields}, state)
+
+        dates = bars.dates[new].tolist()
+        values = []
+        for column, array in columns.items():
+            rows, times = np.nonzero(~np.isnan(array))
+            values.extend(zip(security_ids[rows].tolist(), [column] * len(rows),
+                              [dates[t] for t in times], array[rows, times].tolist()))
+        # the state of a security advances to its last new bar
+        traded = ~np.isnan(bars[spec.inputs[0]][:, new])
+        last_bar = traded.shape[1] - 1 - np.argmax(traded[:, ::-1], axis=1)
+        db.write_indicators(spec.name, values, [
+            (int(security_id), dates[t], dump)
+            for security_id, t, dump, any_bar in zip(security_ids, last_bar, indicators.dump_states(state),
+                                                     traded.any(axis=1))
+            if any_bar])
+
+
+def _update_from_snapshot(run_id: int, todo: list[Row]) -> list[int]:
+    """
+    Write the bars of the latest trading day of `todo` securities from a market
+    snapshot in one transaction, when their stored histories end on the trading
+    day before it.
+    Returns:
+        list[int]: The securities left for K-line fetches.
+    """
+    ids = [int(security['id']) for security in todo]
+    try:
+        quotes = web_scraper.get_snapshot()
+    except Exception as e:  # pylint: disable=W0718
+        logger.warning("Failed to fetch the market snapshot, fetching K-lines: %s", e)
+        return ids
+    traded = quotes[quotes['close'].notna() & (quotes['volume'] > 0)]
+    if traded.empty:
+        return ids
+    day = traded['datetime'].max()
+    quotes = quotes.set_index('symbol')
+    quotes = quotes[~quotes.index.duplicated()]
+    bases = db.get_adjustment_bases(ids, day)
+    if not bases:
+        return ids
+
+    # the snapshot follows the last stored day if the previous closes match it
+    last_day = max(base[0] for base in bases.values())
+    candidates = [security for security in todo
+                  if security['id'] in bases and bases[security['id']][0] == last_day
+                  and security['symbol'] in quotes.index]
+    if not candidates:
+        return ids
+    rows = quotes.loc[[security['symbol'] for security in candidates]]
+    base_close = np.array([bases[security['id']][1] for security in candidates])
+    base_factor = np.array([bases[security['id']][2] for security in candidates])
+    close = rows['close'].to_numpy(dtype=np.float64)
+    change = rows['change'].to_numpy(dtype=np.float64)
+    on_day = ((rows['datetime'] == day) & rows['close'].notna() & (rows['volume'] > 0)).to_numpy()
+    matched = np.abs(close - change - base_close) < adjustment.TOLERANCE
+    if not on_day.any() or matched[on_day].mean() < SNAPSHOT_MATCH:
+        logger.info("The market snapshot of %s does not follow the bars of %s, fetching K-lines.",
+                    day, last_day.date())
+        return ids
+
+    factors = adjustment.backward_factors(close[:, None], change[:, None], base_close, base_factor)[:, 0]
+    history, results, adjustments = [], [], []
+    for security, row, factor, fresh in zip(candidates, rows.itertuples(), factors, on_day):
+        security_id = int(security['id'])
+        if not fresh:
+            # suspended on the day
+            results.append((security_id, db.ItemStatus.DONE, 0, None))
+            continue
+        history.append((security_id, day, float(row.open), float(row.close), float(row.high),
+                        float(row.low), round(float(row.close * factor), 4), int(row.volume),
+                        int(row.amount), web_scraper.Interval.ONE_DAY))
+        results.append((security_id, db.ItemStatus.DONE, 1, None))
+        if factor != bases[security_id][2]:
+            adjustments.append((security_id, day, float(factor)))
+    with profiling.stage('write_snapshot'):
+        db.write_history(history, run_id, results, adjustments=adjustments)
+    logger.info("Wrote %d bars of %s from the market snapshot.", len(history), day)
+    done = {item[0] for item in results}
+    return [security_id for security_id in ids if security_id not in done]
+
+
+def _update_history_chunks(start: str | None, todo: list[Row], chunk_size: int,
+                           parse_pool: ProcessPoolExecutor | None,
+                           history_writer: writer.HistoryWriter) -> None:
+    """Fetch the histories of `todo` securities and queue them with their results for writing."""
+    for i in range(0, len(todo), chunk_size):
+        chunk = todo[i:i + chunk_size]
+        with profiling.stage('fetch_histories'):
+            histories = web_scraper.get_history(
+                [security['symbol'] for security in chunk],
+                start = start,
+                parse_pool = parse_pool
+            )
+        # adjustment factors continue from the last bar stored before the fetched ones
+        bases = db.get_adjustment_bases([security['id'] for security in chunk], start) if start else {}
+        with profiling.stage('queue_histories'):
+            for security in chunk:
+                history = histories.get(security['symbol'])
+                if history is None:
+                    logger.warning("Failed to fetch history for %s", security['symbol'])
+                    history_writer.put([], (security['id'], db.ItemStatus.FAILED, 0, 'fetch failed'))
+                    continue
+                if history.empty:
+                    logger.warning("No history data for %s", security['symbol'])
+                    history_writer.put([], (security['id'], db.ItemStatus.DONE, 0, None))
+                    continue
+                history_writer.put(*_history_rows(int(security['id']), history,
+                                                  *bases.get(security['id'], (None, np.nan, 1.0))[1:]))
+
+
+def _history_rows(security_id: int, history: pd.DataFrame, previous_close: float,
+                  factor: float) -> tuple[list[tuple], tuple, list[tuple]]:
+    """
+    The history rows of a fetched history, its run result and its adjustment
+    factors. The stored adjusted close is adjusted backward, so it is not made
+    stale by later corporate actions.
+    """
+    close = history['close'].to_numpy(dtype=np.float64)
+    factors = adjustment.backward_factors(close, history['change'].to_numpy(dtype=np.float64),
+                                          previous_close, factor)
+    events = np.flatnonzero(np.diff(factors, prepend=factor) != 0)
+    datetimes = history['datetime'].astype(str).tolist()
+    rows = [(
+        security_id,
+        datetime,
+        float(row.open),    # type: ignore
+        float(row.close),    # type: ignore
+        float(row.high),    # type: ignore
+        float(row.low),    # type: ignore
+        round(float(adj_close), 4),
+        int(row.volume),    # type: ignore
+        int(row.amount),    # type: ignore
+        web_scraper.Interval.ONE_DAY,
+    ) for row, datetime, adj_close in zip(history.itertuples(index=False), datetimes, close * factors)]
+    return (rows, (security_id, db.ItemStatus.DONE, len(history), None),
+            [(security_id, datetimes[i], float(factors[i])) for i in events])
+
+
+def get_exchange_modules() -> tuple[ExchangeModule, ...]:
+    """Get all exchange modules, from the registry of `rock.exchange`."""
+    return exchange.get_modules()
+
+
+def parse_args(argv: list[str] | None = None) -> argparse.Namespace:
+    """Parse the command line arguments of the data service."""
+    parser = argparse.ArgumentParser(prog='rock-data-service', description='Update the rock database.')
+    parser.add_argument('--parse-processes', type=int, default=config.PARSE_PROCESSES, metavar='N',
+                        help='parse responses in N processes, 0 to parse in the fetch threads '
+                             '(default: %(default)s)')
+    parser.add_argument('--indicators', default=config.INDICATORS, metavar='NAMES',
+                        help='comma separated indicators to maintain, like sma_200,rsi_14 '
+                             '(default: %(default)r)')
+    parser.add_argument('--panel', default=config.PANEL_NAME, metavar='NAME',
+                        help='publish history in shared memory as panel NAME after the update '
+                             '(default: %(default)r)')
+    parser.add_argument('--no-snapshot', dest='snapshot', action='store_false',
+                        help='fetch K-lines of every security instead of the market snapshot')
+    parser.add_argument('--no-bootstrap', dest='bootstrap', action='store_false',
+                        help='load an empty database with every per-row check and synced commits')
+    parser.add_argument('--slowest', type=int, default=10, metavar='N',
+                        help='report the N slowest symbols (default: %(default)s)')
+    parser.add_argument('--profile', metavar='PATH',
+                        help='run the sampling profiler and write collapsed stacks to PATH')
+    parser.add_argument('--profile-interval', type=float, default=0.005, metavar='SECONDS',
+                        help='sampling interval of the profiler (default: %(default)s)')
+    return parser.parse_args(argv)
+
+
+def run(argv: list[str] | None = None) -> None:
     """Run the data service."""
-    if not db.db_exist():
-        db.create_db()
-        init_db()
+    args = parse_args(argv)
+    if config.METRICS_PORT:
+        metrics.REGISTRY.serve(int(config.METRICS_PORT))
+
+    profiling.TRACER.reset()
+    profiler = None
+    if args.profile:
+        profiler = profiling.SamplingProfiler(args.profile_interval)
+        profiler.start()
+
+    try:
+        if not db.db_exist():
+            db.create_db()
+            init_db()
+        else:
+            db.upgrade_db()
 
-    update_securities()
-    update_histories(True)
+        with profiling.stage('update_securities'):
+            update_securities()
+        with profiling.stage('update_histories'):
+            update_histories(True, parse_processes=args.parse_processes,
+                             indicator_names=args.indicators.split(',') if args.indicators else (),
+                             snapshot=args.snapshot, bootstrap=args.bootstrap)
+        if args.panel:
+            with profiling.stage('publish_panel'):
+                panel.publish_panel(args.panel, start=config.PANEL_START or None)
+    finally:
+        if profiler is not None:
+            profiler.stop()
+            profiler.write(args.profile)
+            logger.info("Profile of %d samples written to %s, top frames: %s",
+                        profiler.samples, args.profile, profiler.top(5))
+        logger.info("Run timings:\n%s", profiling.TRACER.format_report(args.slowest))
+        summary = metrics.export(config.METRICS_JSON, config.METRICS_TEXTFILE,
+                                 timings=profiling.TRACER.report(args.slowest))
+        logger.info("Run metrics: %s", summary['rates'])
 
 
 if __name__ == "__main__":
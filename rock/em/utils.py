@@ -7,28 +7,32 @@ import re
 import time
 from collections import namedtuple
 from collections.abc import Callable
+from concurrent.futures import Executor, ThreadPoolExecutor, as_completed
 from functools import wraps
-from typing import List, TypeVar, ParamSpec, Dict
+from typing import List, TypeVar, ParamSpec, Dict, Tuple
 import requests
 from requests.adapters import HTTPAdapter
 from jsonpath import jsonpath
 
+import numpy as np
 import pandas as pd
-from retry.api import retry
 import multitasking
 from tqdm.auto import tqdm
 
 from rock.em.cache import em_cache
+from rock import metrics, profiling, retry
+from rock.logger import logger
 import rock.config as config
 
-multitasking.set_max_threads(8)
-MAX_CONNECTIONS = 10
+multitasking.set_max_threads(config.FETCH_THREADS)
+MAX_CONNECTIONS = config.FETCH_THREADS + 2
 
 ADDRESS = f"http://{config.USERNAME}:{config.PASSWORD}@{config.PROXY}:{config.PORT}/"
+# An empty PROXY setting connects directly, e.g. to a local stand-in server
 proxies={
     "http": ADDRESS,
     "https": ADDRESS
-}
+} if config.PROXY else {}
 
 EASTMONEY_REQUEST_HEADERS = {
     "User-Agent": "Mozilla/5.0 (Windows NT 6.3; WOW64; Trident/7.0; Touch; rv:11.0) like Gecko",
@@ -52,19 +56,43 @@ EASTMONEY_KLINE_FIELDS = {
     "f61": "换手率",
 }
 
+EASTMONEY_SNAPSHOT_FIELDS = {
+    "f12": "代码",
+    "f14": "名称",
+    "f17": "开盘",
+    "f2": "收盘",
+    "f15": "最高",
+    "f16": "最低",
+    "f18": "昨收",
+    "f5": "成交量",
+    "f6": "成交额",
+    "f124": "更新时间",
+}
+
+# The A-share boards of the market list: Shenzhen main board and ChiNext,
+# Shanghai main board and STAR, and Beijing
+EASTMONEY_A_SHARES = "m:0+t:6,m:0+t:80,m:1+t:2,m:1+t:23,m:0+t:81+s:2048"
+
+# Quotes per page of the market list, the most the endpoint returns
+SNAPSHOT_PAGE_SIZE = 100
+
 
 class CustomedSession(requests.Session):
     """
-    Custom session class to set a default timeout for requests.
+    Custom session class sending requests with the retry policy of `rock.retry`,
+    or the one passed as `policy`, and recording metrics.
     """
-    def request(self, *args, **kwargs):
-        kwargs.setdefault("timeout", 180)  # 3min
-        return super().request(*args, **kwargs)
+    def request(self, method, url, *args, policy: retry.Policy | None = None, **kwargs):
+        timeout = kwargs.pop("timeout", None)
+        return retry.request(url, lambda default: metrics.timed_request(
+            url, lambda: super(CustomedSession, self).request(
+                method, url, *args, timeout=timeout or default, **kwargs)), policy)
 
 
 session = CustomedSession()
+# requests are retried by `rock.retry`, not by the adapter
 adapter = HTTPAdapter(
-    pool_connections=MAX_CONNECTIONS, pool_maxsize=MAX_CONNECTIONS, max_retries=5
+    pool_connections=MAX_CONNECTIONS, pool_maxsize=MAX_CONNECTIONS, max_retries=0
 )
 session.mount("http://", adapter)
 session.mount("https://", adapter)
@@ -72,6 +100,7 @@ session.mount("https://", adapter)
 T = TypeVar("T")
 P = ParamSpec("P")
 
+
 def to_numeric(func: Callable[P, T]) -> Callable[P, T]:
     """
     Convert DataFrame values to numeric types where possible.
@@ -132,7 +161,6 @@ Quote = namedtuple(
 )
 
 
-@retry(tries=3, delay=1)
 def get_quote_id(
     stock_code: str,
     use_local=True,
@@ -171,7 +199,7 @@ def search_quote(
         quote = search_quote_locally(keyword)
         if quote:
             return quote
-    url = "https://searchapi.eastmoney.com/api/suggest/get"
+    url = f"{config.EASTMONEY_SEARCH_URL}/api/suggest/get"
     params = (
         ("input", f"{keyword}"),
         ("type", "14"),
@@ -289,7 +317,6 @@ def get_quote_history(
     return df
 
 
-@to_numeric
 def get_quote_history_single(
     code: str,
     beg: str = "19000101",
@@ -303,17 +330,47 @@ def get_quote_history_single(
     """
     Get the K-line data for a single stock.
     """
+    payload, quote_id = fetch_quote_history(
+        code,
+        beg=beg,
+        end=end,
+        klt=klt,
+        fqt=fqt,
+        suppress_error=suppress_error,
+        use_id_cache=use_id_cache,
+        **kwargs,
+    )
+    with profiling.span("parse", code):
+        return parse_quote_history(payload, quote_id)
+
+
+def fetch_quote_history(
+    code: str,
+    beg: str = "19000101",
+    end: str = "20500101",
+    klt: int = 101,
+    fqt: int = 1,
+    suppress_error: bool = False,
+    use_id_cache: bool = True,
+    policy: retry.Policy | None = None,
+    **kwargs,
+) -> Tuple[bytes, str]:
+    """
+    Download the raw K-line response body for a single stock, with the retry
+    `policy` of `rock.retry`, the configured one if None.
+    Returns the body and the quote ID it was requested for.
+    """
 
     fields = list(EASTMONEY_KLINE_FIELDS.keys())
-    columns = list(EASTMONEY_KLINE_FIELDS.values())
     fields2 = ",".join(fields)
 
-    quote_id = get_quote_id(
-        stock_code=code,
-        use_local=use_id_cache,
-        suppress_error=suppress_error,
-        **kwargs,
-    )
+    with profiling.span("quote_id", code):
+        quote_id = get_quote_id(
+            stock_code=code,
+            use_local=use_id_cache,
+            suppress_error=suppress_error,
+            **kwargs,
+        )
 
     params = (
         ("fields1", "f1,f2,f3,f4,f5,f6,f7,f8,f9,f10,f11,f12,f13"),
@@ -326,11 +383,24 @@ def get_quote_history_single(
         ("fqt", f"{fqt}"),
     )
 
-    url = "https://push2his.eastmoney.com/api/qt/stock/kline/get"
+    url = f"{config.EASTMONEY_HISTORY_URL}/api/qt/stock/kline/get"
+
+    with profiling.span("kline_fetch", code):
+        response = session.get(
+            url, headers=EASTMONEY_REQUEST_HEADERS, params=params, verify=True, proxies=proxies,
+            policy=policy
+        )
+    return response.content, quote_id
+
+
+@to_numeric
+def parse_quote_history(payload: str|bytes, quote_id: str) -> pd.DataFrame:
+    """
+    Parse a raw K-line response body into a DataFrame.
+    """
+    columns = list(EASTMONEY_KLINE_FIELDS.values())
 
-    json_response = session.get(
-        url, headers=EASTMONEY_REQUEST_HEADERS, params=params, verify=True, proxies=proxies
-    ).json()
+    json_response = json.loads(payload)
     klines = jsonpath(json_response, "$..klines[:]")
     if not klines:
         columns.insert(0, "代码")
@@ -353,7 +423,7 @@ def get_quote_history_multi(
     end: str = "20500101",
     klt: int = 101,
     fqt: int = 1,
-    tries: int = 3,
+    tries: int = config.HTTP_TRIES,
     suppress_error: bool = False,
     use_id_cache: bool = True,
     **kwargs,
@@ -365,9 +435,9 @@ def get_quote_history_multi(
 
     dfs: Dict[str, pd.DataFrame] = {}
     total = len(codes)
+    policy = retry.Policy(tries=tries)
 
     @multitasking.task
-    @retry(tries=tries, delay=1)
     def start(code: str):
         _df = get_quote_history_single(
             code,
@@ -377,6 +447,7 @@ def get_quote_history_multi(
             fqt=fqt,
             suppress_error=suppress_error,
             use_id_cache=use_id_cache,
+            policy=policy,
             **kwargs,
         )
         dfs[code] = _df
@@ -393,3 +464,167 @@ def get_quote_history_multi(
     pbar.close()
 
     return dfs
+
+
+QuoteArrays = namedtuple(
+    "QuoteArrays",
+    [
+        "code",
+        "name",
+        "datetime",
+        "open",
+        "close",
+        "high",
+        "low",
+        "volume",
+        "amount",
+        "change",
+    ],
+)
+
+
+def parse_quote_arrays(payload: str|bytes, quote_id: str) -> QuoteArrays:
+    """
+    Parse a raw K-line response body into compact NumPy arrays.
+    Unlike `parse_quote_history` this builds no DataFrame, so it is cheap to
+    run in a worker process and to send the result back.
+    """
+    json_response = json.loads(payload)
+    data = json_response.get("data") or {}
+    klines = data.get("klines") or []
+    code = quote_id.split(".")[-1]
+    if not klines:
+        empty = np.empty(0, dtype=np.float64)
+        return QuoteArrays(code, data.get("name", ""), np.empty(0, dtype="U10"),
+                           empty, empty, empty, empty, np.empty(0, dtype=np.int64), empty, empty)
+
+    fields = np.array([kline.split(",") for kline in klines])
+    return QuoteArrays(
+        code=code,
+        name=data["name"],
+        datetime=fields[:, 0],
+        open=fields[:, 1].astype(np.float64),
+        close=fields[:, 2].astype(np.float64),
+        high=fields[:, 3].astype(np.float64),
+        low=fields[:, 4].astype(np.float64),
+        volume=fields[:, 5].astype(np.float64).astype(np.int64),
+        amount=fields[:, 6].astype(np.float64),
+        change=fields[:, 9].astype(np.float64),
+    )
+
+
+def _parse_quote_arrays_timed(payload: bytes, quote_id: str) -> Tuple[QuoteArrays, float, float]:
+    """Parse in a worker process and return the wall and CPU time it took."""
+    wall = time.perf_counter()
+    cpu = time.thread_time()
+    arrays = parse_quote_arrays(payload, quote_id)
+    return arrays, time.perf_counter() - wall, time.thread_time() - cpu
+
+
+def get_quote_history_arrays(
+    codes: List[str],
+    parse_pool: Executor,
+    beg: str = "19000101",
+    end: str = "20500101",
+    klt: int = 101,
+    fqt: int = 1,
+    tries: int = config.HTTP_TRIES,
+    suppress_error: bool = False,
+    use_id_cache: bool = True,
+    **kwargs,
+) -> Dict[str, QuoteArrays]:
+    """
+    Fetch historical market data for multiple stocks, parsing in `parse_pool`.
+    I/O threads only download raw bodies and hand them to the pool, typically a
+    ProcessPoolExecutor, so parsing is not limited by the GIL of the fetch threads.
+    Codes which could not be fetched or parsed are missing from the result.
+    """
+
+    policy = retry.Policy(tries=tries)
+    results: Dict[str, QuoteArrays] = {}
+    pbar = tqdm(total=len(codes))
+
+    with ThreadPoolExecutor(max_workers=config.FETCH_THREADS) as fetchers:
+        downloads = {
+            fetchers.submit(fetch_quote_history, code, beg=beg, end=end, klt=klt, fqt=fqt,
+                            suppress_error=suppress_error, use_id_cache=use_id_cache,
+                            policy=policy, **kwargs): code
+            for code in codes
+        }
+        parses = {}
+        for future in as_completed(downloads):
+            code = downloads[future]
+            try:
+                payload, quote_id = future.result()
+            except Exception as e:  # pylint: disable=W0718
+                logger.warning("Failed to fetch %s: %s", code, e)
+                pbar.update(1)
+                continue
+            parses[parse_pool.submit(_parse_quote_arrays_timed, payload, quote_id)] = code
+
+        for future in as_completed(parses):
+            code = parses[future]
+            try:
+                arrays, wall, cpu = future.result()
+            except Exception as e:  # pylint: disable=W0718
+                logger.warning("Failed to parse %s: %s", code, e)
+            else:
+                profiling.TRACER.record("parse", wall, cpu, code)
+                results[code] = arrays
+            pbar.update(1)
+            pbar.set_description_str(f"Processing => {code}")
+
+    pbar.close()
+    return results
+
+
+def fetch_market_snapshot_page(page: int, page_size: int = SNAPSHOT_PAGE_SIZE) -> Tuple[int, List[dict]]:
+    """
+    Download a page of the quotes of all A-shares.
+    Returns the total number of quotes and the quotes of the page.
+    """
+    params = (
+        ("pn", f"{page}"),
+        ("pz", f"{page_size}"),
+        ("po", "0"),
+        ("np", "1"),
+        ("fltt", "2"),
+        ("invt", "2"),
+        ("fid", "f12"),
+        ("fs", EASTMONEY_A_SHARES),
+        ("fields", ",".join(EASTMONEY_SNAPSHOT_FIELDS)),
+    )
+    url = f"{config.EASTMONEY_QUOTE_URL}/api/qt/clist/get"
+    with profiling.span("snapshot_fetch", str(page)):
+        response = session.get(
+            url, headers=EASTMONEY_REQUEST_HEADERS, params=params, verify=True, proxies=proxies
+        )
+    data = response.json().get("data") or {}
+    quotes = data.get("diff") or []
+    if isinstance(quotes, dict):
+        quotes = list(quotes.values())
+    return int(data.get("total") or 0), quotes
+
+
+def get_market_snapshot(page_size: int = SNAPSHOT_PAGE_SIZE) -> pd.DataFrame:
+    """
+    Fetch the latest quotes of all A-shares from the paginated market list, in
+    a few requests instead of one per security. The first page gives the number
+    of pages and the others are fetched concurrently.
+    Prices are NaN for securities which did not trade, and `更新时间` is the
+    time of the quote in seconds since the epoch.
+    """
+    total, quotes = fetch_market_snapshot_page(1, page_size)
+    pages = -(-total // page_size)
+    if pages > 1:
+        with ThreadPoolExecutor(max_workers=min(config.FETCH_THREADS, pages - 1)) as fetchers:
+            for _, page in fetchers.map(lambda p: fetch_market_snapshot_page(p, page_size),
+                                        range(2, pages + 1)):
+                quotes.extend(page)
+
+    df = pd.DataFrame(quotes, columns=list(EASTMONEY_SNAPSHOT_FIELDS)).rename(
+        columns=EASTMONEY_SNAPSHOT_FIELDS)
+    # quotes which did not trade are "-"
+    for column in df.columns[2:]:
+        df[column] = pd.to_numeric(df[column], errors="coerce")
+    return df.drop_duplicates(subset="代码", ignore_index=True)
@@ -0,0 +1,27 @@
+"""
+Exchange modules. Each `exchange_*` module implements `common.ExchangeModule`
+for one exchange and is found by `get_modules`.
+"""
+import functools
+import importlib
+import pkgutil
+from rock.exchange.common import ExchangeModule
+from rock.logger import logger
+
+
+@functools.cache
+def get_modules() -> tuple[ExchangeModule, ...]:
+    """
+    Get the exchange modules, scanned and imported once per process. Modules
+    not implementing `ExchangeModule` are left out with a warning.
+    """
+    modules = []
+    for module_info in pkgutil.iter_modules(__path__, __name__ + '.'):
+        if not module_info.name.split('.')[-1].startswith('exchange'):
+            continue
+        module = importlib.import_module(module_info.name)
+        if isinstance(module, ExchangeModule):
+            modules.append(module)
+        else:
+            logger.warning("Module %s does not implement the exchange module interface.", module.__name__)
+    return tuple(modules)
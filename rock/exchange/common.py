@@ -1,5 +1,18 @@
 """Exchange common module."""
 from collections import namedtuple
+from typing import Protocol, Sequence, runtime_checkable
 
 ExchangeMeta = namedtuple('ExchangeMeta', ['name', 'acronym', 'type'])
 StockMeta = namedtuple('StockMeta', ['symbol', 'name', 'listing', 'delisting'])
+
+
+@runtime_checkable
+class ExchangeModule(Protocol):
+    """
+    The interface of an `exchange_*` module of `rock.exchange`: the metadata
+    of its exchange and the A-shares listed on it.
+    """
+    METADATA: ExchangeMeta
+
+    def get_a_shares(self) -> Sequence[StockMeta]:
+        """Get the A-shares listed on the exchange, including delisted ones."""
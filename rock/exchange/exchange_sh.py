@@ -7,6 +7,7 @@ from enum import IntEnum, StrEnum
 from typing import Type, TypeVar, Sequence
 import requests
 import pandas as pd
+from rock import config, metrics, retry
 from .common import ExchangeMeta, StockMeta
 
 
@@ -150,21 +151,19 @@ def _query(types: str, status: str) -> requests.Response:
         "Accept-Language": "zh-CN,zh;q=0.9,en;q=0.8",
         "Cache-Control": "no-cache",
         "Connection": "keep-alive",
-        "Host": "query.sse.com.cn",
         "Pragma": "no-cache",
         "Referer": "https://www.sse.com.cn/",
         "User-Agent": "Mozilla/5.0 (Windows NT 10.0; Win64; x64) AppleWebKit/537.36 "
         "(KHTML, like Gecko) Chrome/97.0.4692.71 Safari/537.36",
     }
 
-    url = (f'https://query.sse.com.cn//sseQuery/commonExcelDd.do?'
+    url = (f'{config.SSE_QUERY_URL}//sseQuery/commonExcelDd.do?'
            f'sqlId=COMMON_SSE_CP_GPJCTPZ_GPLB_ZZGP_L'
            f'&type=inParams&STOCK_CODE=&REG_PROVINCE='
            f'&STOCK_TYPE={types}'
            f'&COMPANY_STATUS={status}'
     )
 
-    # Make the request
-    response = requests.get(url, headers=headers, timeout=10)
-    response.raise_for_status()
-    return response
+    # Make the request with the retry policy, which raises for an unsuccessful status
+    return retry.request(url, lambda timeout: metrics.timed_request(
+        url, lambda: requests.get(url, headers=headers, timeout=timeout)))
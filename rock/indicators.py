@@ -0,0 +1,392 @@
+"""
+rock/indicators.py
+This module computes technical indicators with NumPy over whole panels of
+symbols × time at once.
+
+Indicators take arrays of shape (symbols, time), such as the fields of a
+`rock.panel.Panel`, or a single series, with NaN where a symbol has no bar.
+They run over the bars of each symbol, skipping missing ones, and are NaN at
+missing bars and until enough bars have been seen. Each returns its values
+with a state: passing the state back with the next bars computes only the new
+values, which equal those of a computation over all bars.
+
+Exponential averages follow pandas `ewm(adjust=False, min_periods=n)`, seeded
+with the first bar; RSI and ATR use Wilder's smoothing, alpha = 1 / n.
+"""
+import json
+from collections.abc import Iterator, Mapping
+from typing import Any, NamedTuple
+import numpy as np
+
+
+class SMAState(NamedTuple):
+    """State of a moving window: the last n - 1 bars of each symbol, oldest first."""
+    n: int
+    tail: np.ndarray
+
+
+class EMAState(NamedTuple):
+    """State of an exponential moving average of each symbol and its number of bars."""
+    n: int
+    alpha: float
+    value: np.ndarray
+    count: np.ndarray
+
+
+class RSIState(NamedTuple):
+    """State of a relative strength index: the last close, average gain and average loss."""
+    close: np.ndarray
+    gain: EMAState
+    loss: EMAState
+
+
+class ATRState(NamedTuple):
+    """State of an average true range: the last close and the average."""
+    close: np.ndarray
+    tr: EMAState
+
+
+class MACDState(NamedTuple):
+    """State of a MACD: its fast, slow and signal averages."""
+    fast: EMAState
+    slow: EMAState
+    signal: EMAState
+
+
+class BollingerState(NamedTuple):
+    """State of Bollinger bands: the band width in deviations and the window."""
+    k: float
+    window: SMAState
+
+
+class SMA(NamedTuple):
+    """A simple moving average."""
+    value: np.ndarray
+    state: SMAState
+
+
+class EMA(NamedTuple):
+    """An exponential moving average."""
+    value: np.ndarray
+    state: EMAState
+
+
+class RSI(NamedTuple):
+    """A relative strength index from 0 to 100."""
+    value: np.ndarray
+    state: RSIState
+
+
+class ATR(NamedTuple):
+    """An average true range."""
+    value: np.ndarray
+    state: ATRState
+
+
+class MACD(NamedTuple):
+    """A MACD line, its signal line and their difference."""
+    macd: np.ndarray
+    signal: np.ndarray
+    hist: np.ndarray
+    state: MACDState
+
+
+class Bollinger(NamedTuple):
+    """Bollinger bands around a simple moving average."""
+    middle: np.ndarray
+    upper: np.ndarray
+    lower: np.ndarray
+    state: BollingerState
+
+
+def _as_panel(values: np.ndarray) -> tuple[np.ndarray, bool]:
+    """Return `values` as a float array of (symbols, time) and whether it was a single series."""
+    array = np.asarray(values, dtype=np.float64)
+    if array.ndim == 1:
+        return array[np.newaxis], True
+    return array, False
+
+
+def _output(values: np.ndarray, single: bool) -> np.ndarray:
+    return values[0] if single else values
+
+
+def pack_bars(values: np.ndarray) -> tuple[np.ndarray, tuple[np.ndarray, np.ndarray] | None]:
+    """
+    Move the bars of each symbol to the front, keeping their order, so no
+    missing bar is followed by a bar. Returns them and the order to unpack.
+    """
+    missing = np.isnan(values)
+    # only symbols with a missing bar followed by a bar are reordered
+    rows = np.flatnonzero((np.diff(missing.view(np.int8), axis=1) < 0).any(axis=1))
+    if len(rows) == 0:
+        return values, None
+    order = np.argsort(missing[rows], axis=1, kind='stable')
+    packed = values.copy()
+    packed[rows] = np.take_along_axis(values[rows], order, axis=1)
+    return packed, (rows, order)
+
+
+def reorder_bars(values: np.ndarray, order: tuple[np.ndarray, np.ndarray] | None) -> np.ndarray:
+    """Pack other fields of the same bars like `pack_bars` packed the first."""
+    if order is None:
+        return values
+    rows, row_order = order
+    packed = values.copy()
+    packed[rows] = np.take_along_axis(values[rows], row_order, axis=1)
+    return packed
+
+
+def unpack_bars(packed: np.ndarray, order: tuple[np.ndarray, np.ndarray] | None,
+                missing: np.ndarray) -> np.ndarray:
+    """Put values computed on packed bars back at the times of the bars, in place."""
+    values = packed
+    if order is not None:
+        rows, row_order = order
+        unpacked = np.empty((len(rows), packed.shape[1]))
+        np.put_along_axis(unpacked, row_order, packed[rows], axis=1)
+        values[rows] = unpacked
+    values[missing] = np.nan
+    return values
+
+
+def _last_bars(values: np.ndarray, k: int) -> np.ndarray:
+    """The last `k` bars of each symbol, oldest first, padded in front with NaN."""
+    if values.shape[1] < k:
+        padding = np.full((values.shape[0], k - values.shape[1]), np.nan)
+        values = np.concatenate([padding, values], axis=1)
+    order = np.argsort(~np.isnan(values), axis=1, kind='stable')
+    return np.take_along_axis(values, order[:, values.shape[1] - k:], axis=1)
+
+
+def _window(values: np.ndarray, n: int, deviation: bool = False) -> tuple[np.ndarray, np.ndarray | None]:
+    """
+    The mean, and the population standard deviation, of the windows of `n`
+    columns ending at each column, NaN unless all of them are bars.
+    """
+    valid = ~np.isnan(values)
+    # sums relative to the first bar of each symbol lose less precision
+    first = np.take_along_axis(values, np.argmax(valid, axis=1)[:, np.newaxis], axis=1)
+    shifted = np.where(valid, values - np.nan_to_num(first), 0.0)
+
+    def window_sum(x: np.ndarray) -> np.ndarray:
+        total = np.cumsum(x, axis=1)
+        result = total.copy()
+        result[:, n:] -= total[:, :-n]
+        return result
+
+    full = window_sum(valid.astype(np.int32)) == n
+    mean = window_sum(shifted) / n
+    std = None
+    if deviation:
+        std = np.sqrt(np.maximum(window_sum(shifted * shifted) / n - mean * mean, 0.0))
+        std[~full] = np.nan
+    mean = np.where(full, mean + np.nan_to_num(first), np.nan)
+    return mean, std
+
+
+def _ema(packed: np.ndarray, state: EMAState) -> tuple[np.ndarray, EMAState]:
+    """An exponential moving average of packed bars, skipping missing ones."""
+    value = state.value.copy()
+    count = state.count.copy()
+    result = np.empty_like(packed)
+    for t in range(packed.shape[1]):
+        x = packed[:, t]
+        valid = ~np.isnan(x)
+        value = np.where(valid, np.where(count > 0, value + state.alpha * (x - value), x), value)
+        count += valid
+        result[:, t] = np.where(count >= state.n, value, np.nan)
+    return result, state._replace(value=value, count=count)
+
+
+def _ema_state(symbols: int, n: int, alpha: float) -> EMAState:
+    return EMAState(n, alpha, np.full(symbols, np.nan), np.zeros(symbols, dtype=np.int64))
+
+
+def _previous(packed: np.ndarray, last: np.ndarray) -> np.ndarray:
+    """The previous bar of each packed bar, the first one following `last`."""
+    return np.concatenate([last[:, np.newaxis], packed[:, :-1]], axis=1)
+
+
+def sma(values: np.ndarray, n: int = 20, state: SMAState | None = None) -> SMA:
+    """Simple moving average of `n` bars, continuing from `state` if given."""
+    x, single = _as_panel(values)
+    if state is None:
+        state = SMAState(n, np.full((x.shape[0], n - 1), np.nan))
+    packed, order = pack_bars(x)
+    bars = np.concatenate([state.tail, packed], axis=1)
+    mean, _ = _window(bars, state.n)
+    value = unpack_bars(mean[:, state.n - 1:], order, np.isnan(x))
+    return SMA(_output(value, single), SMAState(state.n, _last_bars(bars, state.n - 1)))
+
+
+def ema(values: np.ndarray, n: int = 20, state: EMAState | None = None) -> EMA:
+    """Exponential moving average with span `n`, continuing from `state` if given."""
+    x, single = _as_panel(values)
+    if state is None:
+        state = _ema_state(x.shape[0], n, 2 / (n + 1))
+    packed, order = pack_bars(x)
+    value, state = _ema(packed, state)
+    return EMA(_output(unpack_bars(value, order, np.isnan(x)), single), state)
+
+
+def rsi(close: np.ndarray, n: int = 14, state: RSIState | None = None) -> RSI:
+    """Relative strength index of `n` bars, continuing from `state` if given. A flat market is 50."""
+    x, single = _as_panel(close)
+    if state is None:
+        state = RSIState(np.full(x.shape[0], np.nan),
+                         _ema_state(x.shape[0], n, 1 / n), _ema_state(x.shape[0], n, 1 / n))
+    packed, order = pack_bars(x)
+    change = packed - _previous(packed, state.close)
+    gain, gain_state = _ema(np.clip(change, 0, None), state.gain)
+    loss, loss_state = _ema(np.clip(-change, 0, None), state.loss)
+    with np.errstate(divide='ignore', invalid='ignore'):
+        value = 100 * gain / (gain + loss)
+    value[gain + loss == 0] = 50.0
+    last = _last_bars(np.concatenate([state.close[:, np.newaxis], packed], axis=1), 1)[:, 0]
+    return RSI(_output(unpack_bars(value, order, np.isnan(x)), single),
+               RSIState(last, gain_state, loss_state))
+
+
+def atr(high: np.ndarray, low: np.ndarray, close: np.ndarray, n: int = 14,
+        state: ATRState | None = None) -> ATR:
+    """
+    Average true range of `n` bars, continuing from `state` if given. The
+    true range of the first bar of a symbol is its high minus its low.
+    """
+    c, single = _as_panel(close)
+    h, _ = _as_panel(high)
+    l, _ = _as_panel(low)
+    if state is None:
+        state = ATRState(np.full(c.shape[0], np.nan), _ema_state(c.shape[0], n, 1 / n))
+    missing = np.isnan(c)
+    packed, order = pack_bars(c)
+    h, l = reorder_bars(h, order), reorder_bars(l, order)
+    previous = _previous(packed, state.close)
+    # fmax ignores the missing close before the first bar
+    tr = np.fmax(h - l, np.fmax(np.abs(h - previous), np.abs(l - previous)))
+    tr[np.isnan(packed)] = np.nan
+    value, tr_state = _ema(tr, state.tr)
+    last = _last_bars(np.concatenate([state.close[:, np.newaxis], packed], axis=1), 1)[:, 0]
+    return ATR(_output(unpack_bars(value, order, missing), single), ATRState(last, tr_state))
+
+
+def macd(close: np.ndarray, fast: int = 12, slow: int = 26, signal: int = 9,
+         state: MACDState | None = None) -> MACD:
+    """MACD of exponential moving averages with spans `fast` and `slow`, continuing from `state` if given."""
+    x, single = _as_panel(close)
+    if state is None:
+        state = MACDState(*(_ema_state(x.shape[0], n, 2 / (n + 1)) for n in (fast, slow, signal)))
+    missing = np.isnan(x)
+    packed, order = pack_bars(x)
+    fast_value, fast_state = _ema(packed, state.fast)
+    slow_value, slow_state = _ema(packed, state.slow)
+    line = fast_value - slow_value
+    signal_value, signal_state = _ema(line, state.signal)
+    line, signal_value = (_output(unpack_bars(v, order, missing), single) for v in (line, signal_value))
+    return MACD(line, signal_value, line - signal_value, MACDState(fast_state, slow_state, signal_state))
+
+
+def bollinger(close: np.ndarray, n: int = 20, k: float = 2.0,
+              state: BollingerState | None = None) -> Bollinger:
+    """
+    Bollinger bands `k` population standard deviations around the simple
+    moving average of `n` bars, continuing from `state` if given.
+    """
+    x, single = _as_panel(close)
+    if state is None:
+        state = BollingerState(k, SMAState(n, np.full((x.shape[0], n - 1), np.nan)))
+    n = state.window.n
+    missing = np.isnan(x)
+    packed, order = pack_bars(x)
+    bars = np.concatenate([state.window.tail, packed], axis=1)
+    mean, std = _window(bars, n, deviation=True)
+    assert std is not None
+    middle = unpack_bars(mean[:, n - 1:], order, missing)
+    width = state.k * unpack_bars(std[:, n - 1:], order, missing)
+    return Bollinger(_output(middle, single), _output(middle + width, single),
+                     _output(middle - width, single),
+                     BollingerState(state.k, SMAState(n, _last_bars(bars, n - 1))))
+
+
+# The function, input fields, default parameters and outputs of each kind of indicator
+_KINDS = {
+    'sma': (sma, ('close',), (20,), ('value',)),
+    'ema': (ema, ('close',), (20,), ('value',)),
+    'rsi': (rsi, ('close',), (14,), ('value',)),
+    'atr': (atr, ('high', 'low', 'close'), (14,), ('value',)),
+    'macd': (macd, ('close',), (12, 26, 9), ('macd', 'signal', 'hist')),
+    'bollinger': (bollinger, ('close',), (20, 2), ('middle', 'upper', 'lower')),
+}
+
+
+class Spec(NamedTuple):
+    """An indicator with its parameters, named like `sma_200` or `macd_12_26_9`."""
+    name: str
+    kind: str
+    params: tuple[float, ...]
+    inputs: tuple[str, ...]
+    columns: tuple[str, ...]
+
+
+def parse_spec(name: str) -> Spec:
+    """
+    Parse an indicator name of its kind and parameters, like `sma_200`,
+    `bollinger_20_2` or `rsi` with default parameters. Indicators of several
+    outputs have a column per output, like `macd_12_26_9_signal`.
+    """
+    kind, *values = name.lower().split('_')
+    if kind not in _KINDS:
+        raise ValueError(f'unknown indicator {name!r}, expected one of {", ".join(_KINDS)}')
+    _, inputs, defaults, outputs = _KINDS[kind]
+    if len(values) > len(defaults):
+        raise ValueError(f'indicator {name!r} takes at most {len(defaults)} parameters')
+    try:
+        params = tuple(float(value) for value in values) + defaults[len(values):]
+    except ValueError as e:
+        raise ValueError(f'invalid parameters of indicator {name!r}') from e
+    params = tuple(int(p) if float(p).is_integer() else p for p in params)
+    name = '_'.join([kind, *map(str, params)])
+    columns = (name,) if len(outputs) == 1 else tuple(f'{name}_{output}' for output in outputs)
+    return Spec(name, kind, params, inputs, columns)
+
+
+def compute(spec: Spec, fields: Mapping[str, np.ndarray], state: Any = None) -> tuple[dict[str, np.ndarray], Any]:
+    """
+    Compute an indicator from the (symbols, time) arrays of its input fields,
+    continuing from `state` if given. Returns its columns and its state.
+    """
+    function, inputs, _, outputs = _KINDS[spec.kind]
+    result = function(*(fields[field] for field in inputs), *spec.params, state=state)
+    return dict(zip(spec.columns, result[:len(outputs)])), result.state
+
+
+def _leaves(state: Any) -> list[Any]:
+    if isinstance(state, tuple):
+        return [leaf for item in state for leaf in _leaves(item)]
+    return [state]
+
+
+def _rebuild(template: Any, leaves: Iterator[Any]) -> Any:
+    if isinstance(template, tuple):
+        return type(template)(*(_rebuild(item, leaves) for item in template))
+    return next(leaves)
+
+
+def dump_states(state: Any) -> list[str]:
+    """Serialize the state of each symbol of an indicator state as JSON."""
+    leaves = _leaves(state)
+    symbols = next(len(leaf) for leaf in leaves if isinstance(leaf, np.ndarray))
+    return [json.dumps([leaf[i].tolist() if isinstance(leaf, np.ndarray) else leaf for leaf in leaves])
+            for i in range(symbols)]
+
+
+def load_states(spec: Spec, dumps: list[str]) -> Any:
+    """Rebuild an indicator state of several symbols from their states serialized by `dump_states`."""
+    empty = np.empty((len(dumps), 0))
+    _, template = compute(spec, {field: empty for field in spec.inputs})
+    symbols = [json.loads(dump) for dump in dumps]
+    leaves = [np.array([values[i] for values in symbols], dtype=leaf.dtype).reshape(leaf.shape)
+              if isinstance(leaf, np.ndarray) else symbols[0][i]
+              for i, leaf in enumerate(_leaves(template))]
+    return _rebuild(template, iter(leaves))
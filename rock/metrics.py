@@ -0,0 +1,347 @@
+"""
+rock/metrics.py
+This module provides counters and histograms for runtime metrics.
+Metrics are exported in the Prometheus text format, as a file or over HTTP,
+and as a JSON summary.
+"""
+
+import json
+import math
+import threading
+import time
+from bisect import bisect_left
+from collections.abc import Callable, Iterator
+from contextlib import contextmanager
+from functools import wraps
+from http.server import BaseHTTPRequestHandler, ThreadingHTTPServer
+from pathlib import Path
+from typing import Any, ParamSpec, TypeVar
+from urllib.parse import urlparse
+import requests
+
+T = TypeVar("T")
+P = ParamSpec("P")
+
+DEFAULT_BUCKETS = (0.005, 0.01, 0.025, 0.05, 0.1, 0.25, 0.5, 1.0, 2.5, 5.0, 10.0, 30.0, 60.0)
+
+
+class Metric:
+    """Base class of labelled metrics."""
+    kind = ''
+
+    def __init__(self, name: str, documentation: str, labelnames: tuple[str, ...] = ()):
+        self.name = name
+        self.documentation = documentation
+        self.labelnames = labelnames
+        self._lock = threading.Lock()
+        self._values: dict[tuple[str, ...], Any] = {}
+
+    def _key(self, labels: dict[str, Any]) -> tuple[str, ...]:
+        if set(labels) != set(self.labelnames):
+            raise ValueError(f"{self.name} expects labels {self.labelnames}, got {tuple(labels)}")
+        return tuple(str(labels[n]) for n in self.labelnames)
+
+    def _labels(self, key: tuple[str, ...], extra: str = '') -> str:
+        pairs = [f'{n}="{_escape(v)}"' for n, v in zip(self.labelnames, key)]
+        if extra:
+            pairs.append(extra)
+        return '{' + ','.join(pairs) + '}' if pairs else ''
+
+    def reset(self) -> None:
+        """Remove all recorded values."""
+        with self._lock:
+            self._values.clear()
+
+
+class Counter(Metric):
+    """A monotonically increasing value."""
+    kind = 'counter'
+
+    def inc(self, amount: float = 1, **labels) -> None:
+        """Increase the counter by `amount`."""
+        key = self._key(labels)
+        with self._lock:
+            self._values[key] = self._values.get(key, 0) + amount
+
+    def value(self, **labels) -> float:
+        """Return the current value."""
+        with self._lock:
+            return self._values.get(self._key(labels), 0)
+
+    def render(self) -> list[str]:
+        """Render samples in the Prometheus text format."""
+        with self._lock:
+            return [f'{self.name}{self._labels(k)} {_number(v)}' for k, v in sorted(self._values.items())]
+
+    def summary(self) -> list[dict[str, Any]]:
+        """Return samples as JSON-serializable dicts."""
+        with self._lock:
+            return [{'labels': dict(zip(self.labelnames, k)), 'value': v}
+                    for k, v in sorted(self._values.items())]
+
+
+class Histogram(Metric):
+    """Observations counted into cumulative buckets."""
+    kind = 'histogram'
+
+    def __init__(self, name: str, documentation: str, labelnames: tuple[str, ...] = (),
+                 buckets: tuple[float, ...] = DEFAULT_BUCKETS):
+        super().__init__(name, documentation, labelnames)
+        self.buckets = tuple(sorted(buckets))
+
+    def observe(self, value: float, **labels) -> None:
+        """Record an observation."""
+        key = self._key(labels)
+        with self._lock:
+            state = self._values.get(key)
+            if state is None:
+                state = self._values[key] = {
+                    'counts': [0] * (len(self.buckets) + 1), 'sum': 0.0, 'count': 0, 'max': 0.0}
+            state['counts'][bisect_left(self.buckets, value)] += 1
+            state['sum'] += value
+            state['count'] += 1
+            state['max'] = max(state['max'], value)
+
+    @contextmanager
+    def time(self, **labels) -> Iterator[None]:
+        """Observe the wall time of the enclosed block."""
+        begin = time.perf_counter()
+        try:
+            yield
+        finally:
+            self.observe(time.perf_counter() - begin, **labels)
+
+    def count(self, **labels) -> int:
+        """Return the number of observations."""
+        with self._lock:
+            state = self._values.get(self._key(labels))
+            return state['count'] if state else 0
+
+    def render(self) -> list[str]:
+        """Render samples in the Prometheus text format."""
+        lines = []
+        with self._lock:
+            for key, state in sorted(self._values.items()):
+                cumulative = 0
+                for bound, c in zip((*self.buckets, math.inf), state['counts']):
+                    cumulative += c
+                    le = '+Inf' if bound == math.inf else _number(bound)
+                    labels = self._labels(key, 'le="' + le + '"')
+                    lines.append(f'{self.name}_bucket{labels} {cumulative}')
+                lines.append(f'{self.name}_sum{self._labels(key)} {_number(state["sum"])}')
+                lines.append(f'{self.name}_count{self._labels(key)} {state["count"]}')
+        return lines
+
+    def summary(self) -> list[dict[str, Any]]:
+        """Return samples as JSON-serializable dicts."""
+        with self._lock:
+            return [{
+                'labels': dict(zip(self.labelnames, k)),
+                'count': s['count'],
+                'sum': s['sum'],
+                'mean': s['sum'] / s['count'] if s['count'] else 0.0,
+                'max': s['max'],
+                'p50': self._quantile(s, 0.5),
+                'p90': self._quantile(s, 0.9),
+                'p99': self._quantile(s, 0.99),
+            } for k, s in sorted(self._values.items())]
+
+    def _quantile(self, state: dict[str, Any], q: float) -> float:
+        """Estimate a quantile as the upper bound of the bucket containing it."""
+        rank = q * state['count']
+        cumulative = 0
+        for bound, c in zip((*self.buckets, state['max']), state['counts']):
+            cumulative += c
+            if cumulative >= rank:
+                return min(bound, state['max'])
+        return state['max']
+
+
+class Registry:
+    """A collection of metrics exported together."""
+
+    def __init__(self):
+        self._metrics: dict[str, Metric] = {}
+        self._lock = threading.Lock()
+
+    def _register(self, metric: Metric) -> Any:
+        with self._lock:
+            if metric.name in self._metrics:
+                raise ValueError(f"Metric {metric.name} is already registered")
+            self._metrics[metric.name] = metric
+        return metric
+
+    def counter(self, name: str, documentation: str, labelnames: tuple[str, ...] = ()) -> Counter:
+        """Create and register a counter."""
+        return self._register(Counter(name, documentation, labelnames))
+
+    def histogram(self, name: str, documentation: str, labelnames: tuple[str, ...] = (),
+                  buckets: tuple[float, ...] = DEFAULT_BUCKETS) -> Histogram:
+        """Create and register a histogram."""
+        return self._register(Histogram(name, documentation, labelnames, buckets))
+
+    def reset(self) -> None:
+        """Reset all metrics."""
+        for metric in list(self._metrics.values()):
+            metric.reset()
+
+    def render_prometheus(self) -> str:
+        """Render all metrics in the Prometheus text exposition format."""
+        lines = []
+        for metric in list(self._metrics.values()):
+            lines.append(f'# HELP {metric.name} {metric.documentation}')
+            lines.append(f'# TYPE {metric.name} {metric.kind}')
+            lines.extend(metric.render())  # type: ignore
+        return '\n'.join(lines) + '\n'
+
+    def summary(self) -> dict[str, Any]:
+        """Return all metrics as a JSON-serializable dict."""
+        return {name: {'type': m.kind, 'help': m.documentation, 'samples': m.summary()}  # type: ignore
+                for name, m in list(self._metrics.items())}
+
+    def write_prometheus(self, path: str | Path) -> None:
+        """Atomically write the Prometheus text format to `path`, e.g. for a textfile collector."""
+        _atomic_write(Path(path), self.render_prometheus())
+
+    def write_json(self, path: str | Path) -> None:
+        """Atomically write the JSON summary to `path`."""
+        _atomic_write(Path(path), json.dumps(self.summary(), indent=2, ensure_ascii=False))
+
+    def serve(self, port: int, host: str = '127.0.0.1') -> ThreadingHTTPServer:
+        """Serve `/metrics` in the Prometheus format from a daemon thread."""
+        registry = self
+
+        class Handler(BaseHTTPRequestHandler):
+            """Metrics endpoint handler."""
+            def do_GET(self):  # pylint: disable=invalid-name
+                """Serve the metrics."""
+                if self.path.split('?')[0] not in ('/', '/metrics'):
+                    self.send_error(404)
+                    return
+                body = registry.render_prometheus().encode('utf-8')
+                self.send_response(200)
+                self.send_header('Content-Type', 'text/plain; version=0.0.4; charset=utf-8')
+                self.send_header('Content-Length', str(len(body)))
+                self.end_headers()
+                self.wfile.write(body)
+
+            def log_message(self, format, *args):  # pylint: disable=redefined-builtin
+                pass
+
+        server = ThreadingHTTPServer((host, port), Handler)
+        server.daemon_threads = True
+        threading.Thread(target=server.serve_forever, daemon=True).start()
+        return server
+
+
+def _escape(value: str) -> str:
+    return value.replace('\\', r'\\').replace('\n', r'\n').replace('"', r'\"')
+
+
+def _number(value: float) -> str:
+    if isinstance(value, float) and value.is_integer() and abs(value) < 1e15:
+        return str(int(value))
+    return repr(value)
+
+
+def _atomic_write(path: Path, text: str) -> None:
+    path.parent.mkdir(parents=True, exist_ok=True)
+    tmp = path.with_name(path.name + '.tmp')
+    tmp.write_text(text, encoding='utf-8')
+    tmp.replace(path)
+
+
+REGISTRY = Registry()
+
+HTTP_REQUESTS = REGISTRY.counter(
+    'rock_http_requests_total', 'HTTP requests by host and status code.', ('host', 'status'))
+HTTP_REQUEST_SECONDS = REGISTRY.histogram(
+    'rock_http_request_seconds', 'HTTP request latency.', ('host',))
+HTTP_RESPONSE_BYTES = REGISTRY.counter(
+    'rock_http_response_bytes_total', 'Bytes downloaded.', ('host',))
+HTTP_ERRORS = REGISTRY.counter(
+    'rock_http_errors_total', 'HTTP requests failed without a response.', ('host', 'error'))
+HTTP_RETRIES = REGISTRY.counter(
+    'rock_http_retries_total', 'Retried HTTP requests and fetches.', ('host',))
+HTTP_CIRCUIT_REJECTIONS = REGISTRY.counter(
+    'rock_http_circuit_rejections_total', 'HTTP requests refused by an open circuit.', ('host',))
+DB_ROWS_WRITTEN = REGISTRY.counter(
+    'rock_db_rows_written_total', 'Rows written to the database.', ('table',))
+DB_HISTORY_UPSERTS = REGISTRY.counter(
+    'rock_db_history_upserts_total', 'History rows upserted by outcome.', ('outcome',))
+DB_ROWS_READ = REGISTRY.counter(
+    'rock_db_rows_read_total', 'Rows read from the database.', ('table',))
+DB_SECONDS = REGISTRY.histogram(
+    'rock_db_operation_seconds', 'Database operation latency.', ('operation',))
+STAGE_SECONDS = REGISTRY.histogram(
+    'rock_stage_seconds', 'Data service stage duration.', ('stage',),
+    buckets=(1.0, 5.0, 15.0, 60.0, 300.0, 900.0, 1800.0, 3600.0, 7200.0))
+SERVER_REQUESTS = REGISTRY.counter(
+    'rock_server_requests_total', 'Query server requests by operation.', ('op',))
+SERVER_REQUEST_SECONDS = REGISTRY.histogram(
+    'rock_server_request_seconds', 'Query server request latency.', ('op',))
+SERVER_CACHE = REGISTRY.counter(
+    'rock_server_cache_total', 'Query server cache lookups by result.', ('result',))
+
+
+def host_of(url: str) -> str:
+    """Return the host label of a URL."""
+    return urlparse(url).hostname or 'unknown'
+
+
+def timed_request(url: str, send: Callable[[], requests.Response]) -> requests.Response:
+    """Send an HTTP request with `send` and record its latency, status and size."""
+    host = host_of(url)
+    begin = time.perf_counter()
+    try:
+        response = send()
+    except requests.RequestException as e:
+        HTTP_REQUEST_SECONDS.observe(time.perf_counter() - begin, host=host)
+        HTTP_ERRORS.inc(host=host, error=type(e).__name__)
+        raise
+    HTTP_REQUEST_SECONDS.observe(time.perf_counter() - begin, host=host)
+    HTTP_REQUESTS.inc(host=host, status=response.status_code)
+    HTTP_RESPONSE_BYTES.inc(len(response.content), host=host)
+    retries = getattr(getattr(response.raw, 'retries', None), 'history', ())
+    if retries:
+        HTTP_RETRIES.inc(len(retries), host=host)
+    return response
+
+
+def timed(operation: str) -> Callable[[Callable[P, T]], Callable[P, T]]:
+    """Decorator recording the latency of a database operation."""
+    def decorator(func: Callable[P, T]) -> Callable[P, T]:
+        @wraps(func)
+        def wrapper(*args: P.args, **kwargs: P.kwargs) -> T:
+            with DB_SECONDS.time(operation=operation):
+                return func(*args, **kwargs)
+        return wrapper
+    return decorator
+
+
+def export(json_path: str | Path | None = None, textfile: str | Path | None = None,
+           **extra: Any) -> dict[str, Any]:
+    """
+    Write the JSON summary and the Prometheus textfile if paths are given, returning the summary.
+    Keyword arguments are added to the JSON summary as is.
+    """
+    summary = REGISTRY.summary()
+    summary['rates'] = rates()
+    summary.update(extra)
+    if json_path:
+        _atomic_write(Path(json_path), json.dumps(summary, indent=2, ensure_ascii=False))
+    if textfile:
+        REGISTRY.write_prometheus(textfile)
+    return summary
+
+
+# The timed operations writing history, the divisor of the history write rate
+HISTORY_WRITES = frozenset({'bulk_insert_history', 'write_history'})
+
+
+def rates() -> dict[str, float]:
+    """Return derived throughput figures for the JSON summary."""
+    rows = sum(s['value'] for s in DB_ROWS_WRITTEN.summary() if s['labels']['table'] == 'history')
+    seconds = sum(s['sum'] for s in DB_SECONDS.summary()
+                  if s['labels']['operation'] in HISTORY_WRITES)
+    return {'history_rows_per_second': rows / seconds if seconds else 0.0}
@@ -0,0 +1,251 @@
+"""
+rock/panel.py
+This module publishes daily history as a panel of symbols × dates × fields in
+shared memory, so many processes read it as NumPy arrays without copies.
+
+A published panel is a shared memory segment holding a float array of shape
+(fields, symbols, dates), NaN where a symbol has no bar, and a small JSON
+manifest describing it in `ROOT_DIR/panels`. Publishing again fills a new
+segment, replaces the manifest atomically and then unlinks the old segment,
+so readers always attach to a complete panel. Processes still attached to the
+old segment keep reading it until they close it.
+"""
+import json
+import os
+import time
+from multiprocessing import resource_tracker
+from multiprocessing.shared_memory import SharedMemory
+from pathlib import Path
+from typing import Any
+import numpy as np
+import pandas as pd
+from rock import config
+from rock.data import db
+from rock.logger import logger
+
+
+PANEL_FIELDS = ('open', 'high', 'low', 'close', 'adj_close', 'volume', 'amount')
+PANEL_DIR = config.ROOT_DIR / 'panels'
+
+
+def _open_segment(name: str | None = None, size: int = 0) -> SharedMemory:
+    """
+    Create a segment of `size` bytes, or attach to the segment `name`, without
+    the resource tracker, which would unlink it when this process exits.
+    """
+    try:
+        return SharedMemory(name, create=name is None, size=size, track=False)  # type: ignore[call-arg]
+    except TypeError:
+        # before Python 3.13 segments are always tracked
+        segment = SharedMemory(name, create=name is None, size=size)
+        resource_tracker.unregister(segment._name, 'shared_memory')  # type: ignore[attr-defined]  # pylint: disable=protected-access
+        return segment
+
+
+def _unlink_segment(name: str) -> None:
+    """Unlink the segment `name` if it still exists."""
+    try:
+        segment = SharedMemory(name)
+    except FileNotFoundError:
+        return
+    segment.close()
+    segment.unlink()
+
+
+def manifest_path(name: str) -> Path:
+    """Get the path of the manifest of the panel `name`."""
+    return PANEL_DIR / f'{name}.json'
+
+
+def read_manifest(name: str) -> dict[str, Any] | None:
+    """Read the manifest of the panel `name`, None if it is not published."""
+    try:
+        with open(manifest_path(name), 'r', encoding='utf-8') as f:
+            return json.load(f)
+    except FileNotFoundError:
+        return None
+
+
+def _write_manifest(name: str, manifest: dict[str, Any]) -> None:
+    """Replace the manifest of the panel `name` atomically."""
+    path = manifest_path(name)
+    path.parent.mkdir(parents=True, exist_ok=True)
+    temporary = path.with_suffix(f'.{os.getpid()}.tmp')
+    with open(temporary, 'w', encoding='utf-8') as f:
+        json.dump(manifest, f)
+    os.replace(temporary, path)
+
+
+class Panel:
+    """
+    A panel of symbols × dates × fields. `data` has the shape (fields, symbols,
+    dates); `panel['close']` is the (symbols, dates) array of a field. Arrays of
+    an attached panel are read-only views of shared memory, which must be
+    released before `close`.
+    """
+
+    def __init__(self, manifest: dict[str, Any], segment: SharedMemory | None = None,
+                 data: np.ndarray | None = None):
+        self.name: str = manifest['name']
+        self.segment_name: str | None = manifest.get('segment')
+        self.fields: tuple[str, ...] = tuple(manifest['fields'])
+        self.symbols: list[str] = list(manifest['symbols'])
+        self.dates = np.array(manifest['dates'], dtype='datetime64[s]')
+        self.generation: int = manifest['generation']
+        self.created: float = manifest['created']
+        self._segment = segment
+        if data is None:
+            assert segment is not None
+            data = np.ndarray(tuple(manifest['shape']), dtype=manifest['dtype'], buffer=segment.buf)
+            data.flags.writeable = False
+        self.data: np.ndarray | None = data
+        self._symbol_index = {symbol: i for i, symbol in enumerate(self.symbols)}
+
+    def __enter__(self) -> 'Panel':
+        return self
+
+    def __exit__(self, *exc_info) -> None:
+        self.close()
+
+    def __getitem__(self, field: str) -> np.ndarray:
+        assert self.data is not None, 'panel is closed'
+        return self.data[self.fields.index(field)]
+
+    def index(self, symbol: str) -> int:
+        """Get the row of `symbol` in the arrays of the panel."""
+        return self._symbol_index[symbol]
+
+    def frame(self, field: str) -> pd.DataFrame:
+        """Get a field as a DataFrame of dates × symbols, sharing the memory of the panel."""
+        return pd.DataFrame(self[field].T, index=pd.DatetimeIndex(self.dates, name='datetime'),
+                            columns=self.symbols, copy=False)
+
+    @property
+    def stale(self) -> bool:
+        """Whether the panel has been published again since it was attached."""
+        manifest = read_manifest(self.name)
+        return manifest is None or manifest.get('segment') != self.segment_name
+
+    def close(self) -> None:
+        """Detach from the shared memory of the panel."""
+        self.data = None
+        if self._segment is not None:
+            self._segment.close()
+            self._segment = None
+
+
+def _fill(data: np.ndarray, fields: tuple[str, ...], symbols: list[str], dates: np.ndarray,
+          rows_iter) -> int:
+    """Fill `data` with chunks of rows of `db.iter_history`, returning the number of rows."""
+    symbol_index = {symbol: i for i, symbol in enumerate(symbols)}
+    count = 0
+    for rows in rows_iter:
+        columns = dict(zip(rows[0].keys(), zip(*rows)))
+        i = np.fromiter(map(symbol_index.__getitem__, columns['symbol']), dtype=np.intp, count=len(rows))
+        j = np.searchsorted(dates, np.array(columns['datetime'], dtype='datetime64[s]'))
+        for f, field in enumerate(fields):
+            data[f, i, j] = np.array(columns[field], dtype=np.float64)
+        count += len(rows)
+    return count
+
+
+def publish_panel(name: str = 'history', symbols: list[str] | None = None,
+                  start: str | None = None, end: str | None = None,
+                  fields: tuple[str, ...] = PANEL_FIELDS, dtype: str = 'float64',
+                  chunk_rows: int = 100_000) -> dict[str, Any]:
+    """
+    Publish the daily history of `symbols` in shared memory as the panel `name`.
+    Args:
+        name (str): The name of the panel.
+        symbols (list[str] | None): The symbols of the panel, all securities with history if None.
+        start (str | None): The start date in YYYY-MM-DD format.
+        end (str | None): The end date in YYYY-MM-DD format.
+        fields (tuple[str, ...]): The history columns of the panel.
+        dtype (str): The float type of the arrays.
+        chunk_rows (int): Rows read from the database at a time.
+    Returns:
+        dict[str, Any]: The manifest of the published panel.
+    """
+    generation = db.get_generation()
+    symbols, datetimes = db.get_history_index(symbols, start, end)
+    dates = np.array(datetimes, dtype='datetime64[s]')
+    shape = (len(fields), len(symbols), len(dates))
+    item_size = np.dtype(dtype).itemsize
+
+    segment = _open_segment(size=max(1, int(np.prod(shape)) * item_size))
+    try:
+        data = np.ndarray(shape, dtype=dtype, buffer=segment.buf)
+        data.fill(np.nan)
+        rows = _fill(data, fields, symbols, dates,
+                     db.iter_history(symbols, start, end, chunk_rows, frequency='1d'))
+        del data
+    except BaseException:
+        # the traceback may still reference the array, so only unlink
+        _unlink_segment(segment.name)
+        raise
+    segment.close()
+
+    manifest = {
+        'name': name,
+        'segment': segment.name,
+        'shape': shape,
+        'dtype': np.dtype(dtype).str,
+        'fields': list(fields),
+        'symbols': symbols,
+        'dates': [str(date) for date in dates],
+        'generation': generation,
+        'created': time.time(),
+    }
+    previous = read_manifest(name)
+    _write_manifest(name, manifest)
+    if previous is not None and previous['segment'] != segment.name:
+        _unlink_segment(previous['segment'])
+    logger.info("Published panel %s of %d symbols × %d dates (%d rows, %.1f MB).",
+                name, len(symbols), len(dates), rows, segment.size / (1 << 20))
+    return manifest
+
+
+def attach_panel(name: str = 'history', tries: int = 3) -> Panel:
+    """
+    Attach to the published panel `name` without copying it.
+    Raises FileNotFoundError if the panel is not published.
+    """
+    for _ in range(tries):
+        manifest = read_manifest(name)
+        if manifest is None:
+            break
+        try:
+            segment = _open_segment(manifest['segment'])
+        except FileNotFoundError:
+            # published again between reading the manifest and attaching
+            continue
+        return Panel(manifest, segment)
+    raise FileNotFoundError(f'panel {name} is not published')
+
+
+def unpublish_panel(name: str = 'history') -> None:
+    """Remove the panel `name` and free its shared memory."""
+    manifest = read_manifest(name)
+    if manifest is None:
+        return
+    manifest_path(name).unlink(missing_ok=True)
+    _unlink_segment(manifest['segment'])
+
+
+def build_panel(symbols: list[str] | None = None, start: str | None = None, end: str | None = None,
+                fields: tuple[str, ...] = PANEL_FIELDS, dtype: str = 'float64',
+                chunk_rows: int = 100_000) -> Panel:
+    """Build a panel in private memory, with the arguments of `publish_panel`."""
+    generation = db.get_generation()
+    symbols, datetimes = db.get_history_index(symbols, start, end)
+    dates = np.array(datetimes, dtype='datetime64[s]')
+    data = np.full((len(fields), len(symbols), len(dates)), np.nan, dtype=dtype)
+    _fill(data, fields, symbols, dates, db.iter_history(symbols, start, end, chunk_rows, frequency='1d'))
+    return Panel({
+        'name': '',
+        'fields': fields,
+        'symbols': symbols,
+        'dates': dates,
+        'generation': generation,
+        'created': time.time(),
+    }, data=data)
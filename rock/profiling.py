@@ -0,0 +1,165 @@
+"""
+rock/profiling.py
+This module provides stage spans with wall and CPU time, per-symbol timings
+and an opt-in sampling profiler for data service runs.
+"""
+
+import sys
+import threading
+import time
+from collections import Counter, defaultdict
+from collections.abc import Iterator
+from contextlib import contextmanager
+from pathlib import Path
+from typing import Any
+from rock import metrics
+
+
+class Tracer:
+    """
+    Aggregates span timings by stage and by symbol.
+    Spans may overlap when they run in several threads, so the wall time of a
+    stage is the sum over its spans, not the elapsed time of the run.
+    """
+
+    def __init__(self):
+        self._lock = threading.Lock()
+        self._stages: dict[str, dict[str, float]] = {}
+        self._symbols: dict[str, dict[str, float]] = defaultdict(lambda: defaultdict(float))
+
+    def record(self, stage: str, wall: float, cpu: float, symbol: str | None = None) -> None:
+        """Record one span."""
+        with self._lock:
+            s = self._stages.get(stage)
+            if s is None:
+                s = self._stages[stage] = {'count': 0, 'wall': 0.0, 'cpu': 0.0, 'max': 0.0}
+            s['count'] += 1
+            s['wall'] += wall
+            s['cpu'] += cpu
+            s['max'] = max(s['max'], wall)
+            if symbol is not None:
+                self._symbols[symbol][stage] += wall
+
+    def reset(self) -> None:
+        """Remove all recorded spans."""
+        with self._lock:
+            self._stages.clear()
+            self._symbols.clear()
+
+    def report(self, slowest: int = 10) -> dict[str, Any]:
+        """Return the stage totals and the `slowest` symbols by total wall time."""
+        with self._lock:
+            stages = {name: dict(s, mean=s['wall'] / s['count'] if s['count'] else 0.0)
+                      for name, s in self._stages.items()}
+            symbols = sorted(((sym, sum(t.values()), dict(t)) for sym, t in self._symbols.items()),
+                             key=lambda item: item[1], reverse=True)[:slowest]
+        return {
+            'stages': stages,
+            'slowest_symbols': [{'symbol': sym, 'wall': total, 'stages': t}
+                                for sym, total, t in symbols],
+        }
+
+    def format_report(self, slowest: int = 10) -> str:
+        """Return the report as a text table."""
+        report = self.report(slowest)
+        lines = [f"{'stage':<20}{'count':>8}{'wall(s)':>12}{'cpu(s)':>12}{'mean(s)':>10}{'max(s)':>10}"]
+        for name, s in report['stages'].items():
+            lines.append(f"{name:<20}{s['count']:>8}{s['wall']:>12.3f}{s['cpu']:>12.3f}"
+                         f"{s['mean']:>10.3f}{s['max']:>10.3f}")
+        if report['slowest_symbols']:
+            lines.append(f'slowest {len(report["slowest_symbols"])} symbols:')
+            for item in report['slowest_symbols']:
+                detail = ', '.join(f'{k}={v:.3f}s' for k, v in item['stages'].items())
+                lines.append(f"  {item['symbol']:<10}{item['wall']:>10.3f}s  {detail}")
+        return '\n'.join(lines)
+
+
+TRACER = Tracer()
+
+
+@contextmanager
+def stage(name: str) -> Iterator[None]:
+    """
+    Time a top-level stage of a run. CPU time is the process CPU time,
+    so work done by worker threads during the stage is included.
+    """
+    wall = time.perf_counter()
+    cpu = time.process_time()
+    try:
+        yield
+    finally:
+        elapsed = time.perf_counter() - wall
+        TRACER.record(name, elapsed, time.process_time() - cpu)
+        metrics.STAGE_SECONDS.observe(elapsed, stage=name)
+
+
+@contextmanager
+def span(name: str, symbol: str | None = None) -> Iterator[None]:
+    """Time a unit of work within a stage, using the CPU time of the calling thread."""
+    wall = time.perf_counter()
+    cpu = time.thread_time()
+    try:
+        yield
+    finally:
+        TRACER.record(name, time.perf_counter() - wall, time.thread_time() - cpu, symbol)
+
+
+class SamplingProfiler:
+    """
+    A sampling profiler which periodically captures the stacks of all threads.
+    The report is written in the collapsed stack format, one
+    `frame;frame;... count` line per distinct stack, as read by flamegraph.pl
+    and speedscope.
+    """
+
+    def __init__(self, interval: float = 0.005):
+        self.interval = interval
+        self.samples = 0
+        self._stacks: Counter[str] = Counter()
+        self._stop = threading.Event()
+        self._thread: threading.Thread | None = None
+
+    def start(self) -> None:
+        """Start sampling in a daemon thread."""
+        self._stop.clear()
+        self._thread = threading.Thread(target=self._run, name='rock-profiler', daemon=True)
+        self._thread.start()
+
+    def stop(self) -> None:
+        """Stop sampling."""
+        self._stop.set()
+        if self._thread is not None:
+            self._thread.join()
+            self._thread = None
+
+    def _run(self) -> None:
+        own = threading.get_ident()
+        names = {}
+        while not self._stop.wait(self.interval):
+            names.update({t.ident: t.name for t in threading.enumerate()})
+            for ident, frame in sys._current_frames().items():  # pylint: disable=protected-access
+                if ident == own:
+                    continue
+                stack = []
+                while frame is not None:
+                    code = frame.f_code
+                    stack.append(f'{code.co_name} ({Path(code.co_filename).name}:{frame.f_lineno})')
+                    frame = frame.f_back
+                stack.append(names.get(ident, str(ident)))
+                self._stacks[';'.join(reversed(stack))] += 1
+            self.samples += 1
+
+    def top(self, n: int = 20) -> list[tuple[str, int]]:
+        """Return the `n` frames most often on top of a stack."""
+        leaves: Counter[str] = Counter()
+        for stack, count in self._stacks.items():
+            leaves[stack.rsplit(';', 1)[-1]] += count
+        return leaves.most_common(n)
+
+    def write(self, path: str | Path) -> None:
+        """Write the collapsed stacks to `path`."""
+        path = Path(path)
+        path.parent.mkdir(parents=True, exist_ok=True)
+        with path.open('w', encoding='utf-8') as f:
+            for stack, count in self._stacks.most_common():
+                f.write(f'{stack} {count}\n')
@@ -0,0 +1,72 @@
+"""
+rock/protocol.py
+This module provides the wire format of the query server.
+
+A message is a frame of an 8-byte header holding the lengths of a JSON header
+and of a binary body, followed by both. History is sent as raw little-endian
+NumPy column buffers, described in the JSON header, so clients decode it
+without parsing.
+"""
+import json
+import struct
+from typing import Any
+import numpy as np
+
+FRAME = struct.Struct('>II')
+# Frames above this size are refused, to fail fast on garbage input
+MAX_FRAME_BYTES = 1 << 31
+
+
+def parse_address(address: str) -> str | tuple[str, int]:
+    """Parse a Unix socket path or a host:port address."""
+    host, sep, port = address.rpartition(':')
+    if sep and port.isdigit() and '/' not in address:
+        return host or '127.0.0.1', int(port)
+    return address
+
+
+def encode_message(header: dict[str, Any], body: bytes | list[bytes] = b'') -> bytes:
+    """Encode a message of a JSON header and a binary body."""
+    if isinstance(body, list):
+        body = b''.join(body)
+    encoded = json.dumps(header, separators=(',', ':')).encode('utf-8')
+    return FRAME.pack(len(encoded), len(body)) + encoded + body
+
+
+def decode_header(frame: bytes) -> tuple[int, int]:
+    """Decode the lengths of the JSON header and the body of a message."""
+    header_size, body_size = FRAME.unpack(frame)
+    if header_size + body_size > MAX_FRAME_BYTES:
+        raise ValueError(f'message of {header_size + body_size} bytes is too large')
+    return header_size, body_size
+
+
+def encode_columns(columns: dict[str, np.ndarray]) -> tuple[dict[str, Any], bytes]:
+    """
+    Encode equally long numeric columns. Returns a description of the
+    columns for the JSON header and their concatenated buffers.
+    """
+    description = []
+    buffers = []
+    rows = 0
+    for name, values in columns.items():
+        array = np.ascontiguousarray(values)
+        if array.dtype == object:
+            array = array.astype(np.float64)
+        array = array.astype(array.dtype.newbyteorder('<'), copy=False)
+        rows = len(array)
+        description.append([name, array.dtype.str])
+        buffers.append(array.tobytes())
+    return {'rows': rows, 'columns': description}, b''.join(buffers)
+
+
+def decode_columns(description: dict[str, Any], body: bytes | memoryview,
+                   offset: int = 0) -> tuple[dict[str, np.ndarray], int]:
+    """Decode columns encoded by `encode_columns` from `body` at `offset`, returning the next offset."""
+    columns = {}
+    rows = description['rows']
+    for name, dtype in description['columns']:
+        dtype = np.dtype(dtype)
+        columns[name] = np.frombuffer(body, dtype=dtype, count=rows, offset=offset)
+        offset += rows * dtype.itemsize
+    return columns, offset
@@ -0,0 +1,322 @@
+"""
+rock/realtime.py
+This module polls the intraday quotes of the whole market every few seconds
+and keeps the recent ticks of each symbol in fixed-size ring buffers.
+
+Each poll takes the market snapshot of `rock.data.web_scraper.get_snapshot`
+in a worker thread, on the same EastMoney session as every other fetch, while
+the event loop keeps the polling cadence. Completed minutes are consolidated
+into minute bars and written to the history. Bars are made of the polled
+quotes, so their high and low are the extremes of the prices seen, and their
+volume is the growth of the cumulative volume of the day.
+"""
+import argparse
+import asyncio
+import time
+from typing import NamedTuple
+import numpy as np
+import pandas as pd
+from rock import config, metrics
+from rock.common.types import Interval
+from rock.data import db, web_scraper
+from rock.logger import logger
+
+# Quote times are in seconds since the epoch, bars in China time
+CHINA_OFFSET = 8 * 3600
+
+# Seconds between two flushes of minute bars
+FLUSH_INTERVAL = 60.0
+
+
+class Tick(NamedTuple):
+    """
+    A polled quote: its time in seconds since the epoch, its price, and the
+    cumulative volume and amount of the day.
+    """
+    time: int
+    price: float
+    volume: float
+    amount: float
+
+
+class TickBuffer:
+    """
+    Ring buffers of the last `capacity` ticks of each symbol, one row per
+    symbol, so appending a tick is O(1) and overwrites the oldest one.
+    Not thread-safe: use it from the thread of the poller.
+    """
+
+    def __init__(self, capacity: int = config.REALTIME_CAPACITY):
+        self.capacity = capacity
+        self.symbols: list[str] = []
+        self._rows: dict[str, int] = {}
+        self._time = np.zeros((0, capacity), dtype=np.int64)
+        self._price = np.zeros((0, capacity))
+        self._volume = np.zeros((0, capacity))
+        self._amount = np.zeros((0, capacity))
+        # ticks appended to each row, the next one goes to count % capacity
+        self._count = np.zeros(0, dtype=np.int64)
+
+    def __len__(self) -> int:
+        return len(self.symbols)
+
+    def _row_indices(self, symbols: list[str]) -> np.ndarray:
+        """The rows of `symbols`, adding rows for new ones."""
+        for symbol in symbols:
+            if symbol not in self._rows:
+                self._rows[symbol] = len(self.symbols)
+                self.symbols.append(symbol)
+        if len(self.symbols) > len(self._count):
+            rows = max(len(self.symbols), 2 * len(self._count))
+            grow = rows - len(self._count)
+            self._time = np.concatenate((self._time, np.zeros((grow, self.capacity), dtype=np.int64)))
+            self._price, self._volume, self._amount = (
+                np.concatenate((array, np.zeros((grow, self.capacity))))
+                for array in (self._price, self._volume, self._amount))
+            self._count = np.concatenate((self._count, np.zeros(grow, dtype=np.int64)))
+        return np.array([self._rows[symbol] for symbol in symbols], dtype=np.int64)
+
+    def _last_time(self, rows: np.ndarray) -> np.ndarray:
+        """The time of the last tick of each row, 0 for rows without ticks."""
+        count = self._count[rows]
+        return np.where(count > 0, self._time[rows, (count - 1) % self.capacity], 0)
+
+    def append(self, symbol: str, tick: Tick) -> None:
+        """Append the tick of a symbol."""
+        self.extend([symbol], [tick.time], [tick.price], [tick.volume], [tick.amount])
+
+    def extend(self, symbols: list[str], times: np.ndarray, prices: np.ndarray, volumes: np.ndarray,
+               amounts: np.ndarray) -> int:
+        """
+        Append a tick to each of `symbols`, which must be distinct, as of a market
+        snapshot. Ticks without a price or not newer than the last tick of their
+        symbol are skipped.
+        Returns:
+            int: The ticks appended.
+        """
+        rows = self._row_indices(list(symbols))
+        times = np.asarray(times, dtype=np.int64)
+        prices = np.asarray(prices, dtype=np.float64)
+        fresh = ~np.isnan(prices) & (times > self._last_time(rows))
+        rows = rows[fresh]
+        position = self._count[rows] % self.capacity
+        self._time[rows, position] = times[fresh]
+        self._price[rows, position] = prices[fresh]
+        self._volume[rows, position] = np.asarray(volumes, dtype=np.float64)[fresh]
+        self._amount[rows, position] = np.asarray(amounts, dtype=np.float64)[fresh]
+        self._count[rows] += 1
+        return len(rows)
+
+    def latest(self, symbol: str) -> Tick | None:
+        """The last tick of a symbol, None if it has none."""
+        row = self._rows.get(symbol)
+        if row is None or not self._count[row]:
+            return None
+        i = (self._count[row] - 1) % self.capacity
+        return Tick(int(self._time[row, i]), float(self._price[row, i]),
+                    float(self._volume[row, i]), float(self._amount[row, i]))
+
+    def window(self, symbol: str, seconds: float | None = None, count: int | None = None) -> pd.DataFrame:
+        """
+        The buffered ticks of a symbol in time order.
+        Args:
+            symbol (str): The symbol.
+            seconds (float | None): Keep the ticks of the last `seconds` before its last tick.
+            count (int | None): Keep the last `count` ticks.
+        Returns:
+            DataFrame: The `time`, `price`, `volume` and `amount` of each tick.
+        """
+        row = self._rows.get(symbol)
+        size = 0 if row is None else int(min(self._count[row], self.capacity))
+        if count is not None:
+            size = min(size, count)
+        index = (self._count[row] - size + np.arange(size)) % self.capacity if size else []
+        df = pd.DataFrame({name: array[row, index] if size else array[:0, 0]
+                           for name, array in (('time', self._time), ('price', self._price),
+                                               ('volume', self._volume), ('amount', self._amount))})
+        if seconds is not None and size:
+            df = df[df['time'] > df['time'].iloc[-1] - seconds].reset_index(drop=True)
+        return df
+
+    def minute_bars(self, start: int, end: int) -> pd.DataFrame:
+        """
+        Consolidate the buffered ticks into minute bars.
+        Args:
+            start (int): The first minute, in minutes since the epoch in China time.
+            end (int): The minute after the last one.
+        Returns:
+            DataFrame: The `symbol`, `datetime` (the end of the minute in China time, as
+                EastMoney labels minute K-lines), `open`, `high`, `low`, `close`, `volume`
+                and `amount` of each minute of each symbol with ticks.
+        """
+        rows = len(self.symbols)
+        valid = np.minimum(self._count[:rows], self.capacity)
+        offsets = np.arange(self.capacity)
+        # gather the ticks from `start` on, and the tick before them for the volume traded since
+        recent = ((self._time[:rows] >= start * 60 - CHINA_OFFSET) & (offsets < valid[:, None])).sum(axis=1)
+        mask = (offsets < valid[:, None]) & (offsets >= (valid - np.minimum(recent + 1, valid))[:, None])
+        row = np.broadcast_to(np.arange(rows)[:, None], mask.shape)[mask]
+        column = ((self._count[:rows, None] - valid[:, None] + offsets) % self.capacity)[mask]
+        times, prices = self._time[row, column], self._price[row, column]
+        volumes, amounts = self._volume[row, column], self._amount[row, column]
+
+        # volume traded since the previous tick of the symbol; cumulative volumes restart each day
+        first = np.ones(len(row), dtype=bool)
+        first[1:] = row[1:] != row[:-1]
+        traded = []
+        for cumulative in (volumes, amounts):
+            previous = np.roll(cumulative, 1)
+            growth = np.where(cumulative >= previous, cumulative - previous, cumulative)
+            traded.append(np.where(first, 0.0, growth))
+
+        minute = (times + CHINA_OFFSET) // 60
+        keep = (minute >= start) & (minute < end)
+        row, minute, prices = row[keep], minute[keep], prices[keep]
+        volume, amount = traded[0][keep], traded[1][keep]
+        if not len(row):
+            return pd.DataFrame(columns=['symbol', 'datetime', 'open', 'high', 'low', 'close', 'volume', 'amount'])
+        # ticks are ordered by symbol then time, so each bar is a run of ticks
+        starts = np.flatnonzero((np.diff(row, prepend=-1) != 0) | (np.diff(minute, prepend=-1) != 0))
+        ends = np.append(starts[1:], len(row)) - 1
+        labels = ((minute[starts] + 1) * 60).astype('datetime64[s]')
+        return pd.DataFrame({
+            'symbol': np.array(self.symbols, dtype=object)[row[starts]],
+            'datetime': np.char.replace(np.datetime_as_string(labels), 'T', ' '),
+            'open': prices[starts],
+            'high': np.maximum.reduceat(prices, starts),
+            'low': np.minimum.reduceat(prices, starts),
+            'close': prices[ends],
+            'volume': np.add.reduceat(volume, starts),
+            'amount': np.add.reduceat(amount, starts),
+        })
+
+
+def _minute(timestamp: float) -> int:
+    """The minute of a time in minutes since the epoch in China time."""
+    return int(timestamp + CHINA_OFFSET) // 60
+
+
+class Poller:
+    """
+    Polls the market snapshot into a `TickBuffer` and flushes the minute bars
+    of completed minutes to the history.
+    """
+
+    def __init__(self, interval: float = config.REALTIME_INTERVAL, capacity: int = config.REALTIME_CAPACITY,
+                 flush_interval: float = FLUSH_INTERVAL):
+        self.interval = interval
+        self.flush_interval = flush_interval
+        self.buffer = TickBuffer(capacity)
+        # the first minute not flushed yet, the minute of the first poll is partial
+        self._flushed: int | None = None
+        self._securities: dict[str, tuple[int, float]] | None = None
+
+    def poll(self) -> int:
+        """
+        Take a market snapshot into the buffer.
+        Returns:
+            int: The new ticks.
+        """
+        quotes = web_scraper.get_snapshot()
+        if self._flushed is None:
+            self._flushed = _minute(time.time()) + 1
+        return self.buffer.extend(quotes['symbol'].tolist(), quotes['timestamp'].fillna(0).to_numpy(),
+                                  quotes['close'].to_numpy(), quotes['volume'].to_numpy(),
+                                  quotes['amount'].to_numpy())
+
+    def _security_factors(self) -> dict[str, tuple[int, float]]:
+        """The id and latest backward adjustment factor of each stored security."""
+        if self._securities is None:
+            ids = {security['symbol']: security['id'] for security in db.get_all_securities()}
+            adjustments = db.get_adjustments(list(ids))
+            self._securities = {symbol: (security_id, adjustments[symbol][-1]['factor']
+                                         if adjustments.get(symbol) else 1.0)
+                                for symbol, security_id in ids.items()}
+        return self._securities
+
+    def flush(self, now: float | None = None) -> int:
+        """
+        Write the minute bars of the minutes completed before `now` and not flushed yet.
+        Returns:
+            int: The bars written.
+        """
+        if self._flushed is None:
+            return 0
+        end = _minute(time.time() if now is None else now)
+        if end <= self._flushed:
+            return 0
+        bars = self.buffer.minute_bars(self._flushed, end)
+        self._flushed = end
+        securities = self._security_factors()
+        rows = [(
+            securities[bar.symbol][0],
+            bar.datetime,
+            float(bar.open),
+            float(bar.close),
+            float(bar.high),
+            float(bar.low),
+            round(float(bar.close) * securities[bar.symbol][1], 4),
+            int(bar.volume),
+            int(bar.amount),
+            Interval.ONE_MINUTE,
+        ) for bar in bars.itertuples(index=False) if bar.symbol in securities]
+        if rows:
+            db.write_history(rows)
+        return len(rows)
+
+    async def run(self, duration: float | None = None) -> None:
+        """
+        Poll every `interval` seconds and flush every `flush_interval` seconds,
+        for `duration` seconds or until cancelled. A poll that takes longer than
+        the interval delays the next one instead of piling up.
+        """
+        loop = asyncio.get_running_loop()
+        stop = None if duration is None else loop.time() + duration
+        next_poll = next_flush = loop.time()
+        try:
+            while stop is None or loop.time() < stop:
+                try:
+                    ticks = await asyncio.to_thread(self.poll)
+                    logger.debug("Polled %d new ticks.", ticks)
+                except Exception as e:  # pylint: disable=W0718
+                    logger.warning("Failed to poll the market snapshot: %s", e)
+                if loop.time() >= next_flush:
+                    next_flush += self.flush_interval
+                    bars = await asyncio.to_thread(self.flush)
+                    if bars:
+                        logger.info("Flushed %d minute bars.", bars)
+                next_poll = max(next_poll + self.interval, loop.time())
+                await asyncio.sleep(next_poll - loop.time())
+        finally:
+            bars = self.flush()
+            if bars:
+                logger.info("Flushed %d minute bars.", bars)
+
+
+def parse_args(argv: list[str] | None = None) -> argparse.Namespace:
+    """Parse the command line arguments of the realtime poller."""
+    parser = argparse.ArgumentParser(prog='rock-realtime',
+                                     description='Poll intraday quotes and store minute bars.')
+    parser.add_argument('--interval', type=float, default=config.REALTIME_INTERVAL, metavar='SECONDS',
+                        help='seconds between market snapshots (default: %(default)s)')
+    parser.add_argument('--capacity', type=int, default=config.REALTIME_CAPACITY, metavar='N',
+                        help='ticks kept per symbol (default: %(default)s)')
+    parser.add_argument('--duration', type=float, metavar='SECONDS',
+                        help='stop after SECONDS, run until interrupted if omitted')
+    return parser.parse_args(argv)
+
+
+def run(argv: list[str] | None = None) -> None:
+    """Run the realtime poller."""
+    args = parse_args(argv)
+    if config.METRICS_PORT:
+        metrics.REGISTRY.serve(int(config.METRICS_PORT))
+    poller = Poller(args.interval, args.capacity)
+    try:
+        asyncio.run(poller.run(args.duration))
+    except KeyboardInterrupt:
+        pass
+
+
+if __name__ == "__main__":
+    run()
@@ -0,0 +1,187 @@
+"""
+rock/retry.py
+This module is the retry policy of the HTTP requests to the data sources.
+
+A request is tried a few times with exponential backoff and full jitter, so
+clients recovering from an outage do not retry in lockstep, and gives up at a
+total deadline, which bounds how long a dead symbol holds a fetch thread.
+Each host has a circuit breaker: after consecutive failures it opens and its
+requests wait until a cooldown has passed, or fail at once if their deadline
+comes first, and a single trial request closes it again or reopens it. Only
+connection errors, timeouts, throttling and server errors are retried and
+count as failures.
+"""
+import random
+import threading
+import time
+from collections.abc import Callable
+from enum import StrEnum
+from typing import NamedTuple
+import requests
+from rock import config, metrics
+from rock.logger import logger
+
+# Response statuses worth retrying: throttled or a failing server
+RETRY_STATUSES = frozenset({408, 429, 500, 502, 503, 504})
+
+
+class Policy(NamedTuple):
+    """How a request is retried, with times in seconds."""
+    tries: int = config.HTTP_TRIES
+    deadline: float = config.HTTP_DEADLINE
+    backoff: float = config.HTTP_BACKOFF
+    max_backoff: float = config.HTTP_MAX_BACKOFF
+    connect_timeout: float = config.HTTP_CONNECT_TIMEOUT
+    read_timeout: float = config.HTTP_READ_TIMEOUT
+
+    def delay(self, attempt: int) -> float:
+        """The delay before retrying the `attempt`th try, counted from 0, with full jitter."""
+        return random.uniform(0, min(self.max_backoff, self.backoff * 2 ** attempt))
+
+
+class State(StrEnum):
+    """The state of a circuit breaker."""
+    CLOSED = 'closed'
+    OPEN = 'open'
+    # the cooldown has passed and a trial request is in flight
+    HALF_OPEN = 'half_open'
+
+
+class CircuitOpenError(requests.ConnectionError):
+    """Raised instead of sending a request to a host whose circuit is open."""
+
+
+class CircuitBreaker:
+    """
+    Stops sending requests to a host after `failures` consecutive failures,
+    for `cooldown` seconds.
+    """
+    def __init__(self, failures: int = config.HTTP_BREAKER_FAILURES,
+                 cooldown: float = config.HTTP_BREAKER_COOLDOWN, clock: Callable[[], float] = time.monotonic):
+        self.failures = failures
+        self.cooldown = cooldown
+        self._clock = clock
+        self._lock = threading.Lock()
+        self._state = State.CLOSED
+        self._failed = 0
+        self._opened = 0.0
+
+    @property
+    def state(self) -> State:
+        """The current state."""
+        return self._state
+
+    def allow(self) -> bool:
+        """Whether a request may be sent, which makes it the trial after a cooldown."""
+        with self._lock:
+            if self._state == State.CLOSED:
+                return True
+            if self._state == State.OPEN and self._clock() - self._opened >= self.cooldown:
+                self._state = State.HALF_OPEN
+                return True
+            return False
+
+    def retry_after(self) -> float:
+        """Seconds until the cooldown of an open circuit ends, 0 unless it is open."""
+        with self._lock:
+            if self._state != State.OPEN:
+                return 0.0
+            return max(0.0, self._opened + self.cooldown - self._clock())
+
+    def success(self) -> None:
+        """Record a request which reached the host, closing the circuit."""
+        with self._lock:
+            self._state = State.CLOSED
+            self._failed = 0
+
+    def failure(self) -> None:
+        """Record a failed request, opening the circuit after a failed trial or too many failures."""
+        with self._lock:
+            self._failed += 1
+            if self._state == State.HALF_OPEN or self._failed >= self.failures:
+                self._state = State.OPEN
+                self._opened = self._clock()
+
+    def cancel(self) -> None:
+        """Record a request which ended without telling whether the host works, freeing the trial."""
+        with self._lock:
+            if self._state == State.HALF_OPEN:
+                self._state = State.OPEN
+
+
+_breakers: dict[str, CircuitBreaker] = {}
+_breakers_lock = threading.Lock()
+
+
+def breaker(host: str) -> CircuitBreaker:
+    """Get the circuit breaker of a host."""
+    with _breakers_lock:
+        return _breakers.setdefault(host, CircuitBreaker())
+
+
+def reset() -> None:
+    """Close every circuit, forgetting past failures."""
+    with _breakers_lock:
+        _breakers.clear()
+
+
+def retryable(error: Exception) -> bool:
+    """Whether a request failing with `error` may succeed when tried again."""
+    if isinstance(error, CircuitOpenError):
+        return False
+    if isinstance(error, requests.HTTPError):
+        return error.response is not None and error.response.status_code in RETRY_STATUSES
+    return isinstance(error, (requests.ConnectionError, requests.Timeout))
+
+
+def request(url: str, send: Callable[[tuple[float, float]], requests.Response],
+            policy: Policy | None = None) -> requests.Response:
+    """
+    Send a request with the retry policy.
+    Args:
+        url (str): The URL requested, whose host has the circuit breaker.
+        send (Callable): Sends the request with a (connect, read) timeout.
+        policy (Policy | None): The retry policy, the configured one if None.
+    Returns:
+        requests.Response: The successful response.
+    Raises:
+        CircuitOpenError: If the circuit of the host stays open until the deadline.
+        requests.RequestException: The error of the last try, including an `HTTPError`
+            for an unsuccessful status.
+    """
+    policy = policy or Policy()
+    host = metrics.host_of(url)
+    circuit = breaker(host)
+    deadline = time.monotonic() + policy.deadline
+    attempt = 0
+    while True:
+        while not circuit.allow():
+            # wait for the end of the cooldown, or poll while another request is the trial
+            wait = circuit.retry_after() or policy.backoff
+            if time.monotonic() + wait >= deadline:
+                metrics.HTTP_CIRCUIT_REJECTIONS.inc(host=host)
+                raise CircuitOpenError(f'circuit of {host} is open')
+            time.sleep(wait)
+        remaining = max(deadline - time.monotonic(), 0.001)
+        try:
+            response = send((min(policy.connect_timeout, remaining), min(policy.read_timeout, remaining)))
+            response.raise_for_status()
+        except requests.RequestException as e:
+            if not retryable(e):
+                # the host answered
+                circuit.success()
+                raise
+            circuit.failure()
+            attempt += 1
+            delay = policy.delay(attempt - 1)
+            if attempt >= policy.tries or time.monotonic() + delay >= deadline:
+                raise
+            metrics.HTTP_RETRIES.inc(host=host)
+            logger.warning("Retrying %s in %.2fs after try %d failed: %s", host, delay, attempt, e)
+            time.sleep(delay)
+        except BaseException:
+            circuit.cancel()
+            raise
+        else:
+            circuit.success()
+            return response
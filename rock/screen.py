@@ -0,0 +1,235 @@
+"""
+rock/screen.py
+This module screens securities with filter expressions evaluated over a whole
+panel of symbols × dates in one vectorized pass.
+
+An expression is Python syntax over the panel fields and a few rolling
+functions, such as
+
+    close > ref(highest(high, 20), 1) and volume > 3 * sma(volume, 50)
+
+Windows count the bars of each symbol, skipping days without a bar. Comparing
+a field with a number at the top level, like `close > 5`, is also pushed down
+into SQL to load only the securities which can match.
+"""
+import ast
+from datetime import timedelta
+from typing import Any, Callable, NamedTuple
+import numpy as np
+import pandas as pd
+from rock import indicators
+from rock.common import utils
+from rock.data import db
+from rock.panel import PANEL_FIELDS, Panel, build_panel
+
+
+def _ref(values: np.ndarray, n: int) -> np.ndarray:
+    """The value `n` bars before."""
+    result = np.full_like(values, np.nan)
+    if n < values.shape[1]:
+        result[:, n:] = values[:, :values.shape[1] - n]
+    return result
+
+
+def _rolling(function: Callable, values: np.ndarray, n: int) -> np.ndarray:
+    """Reduce windows of `n` bars with `function`, by doubling the window size."""
+    result = values
+    size = 1
+    while size * 2 <= n:
+        result = function(result, _ref(result, size))
+        size *= 2
+    if size < n:
+        result = function(result, _ref(result, n - size))
+    return result
+
+
+def _std(values: np.ndarray, n: int) -> np.ndarray:
+    bands = indicators.bollinger(values, n, 1.0)
+    return bands.upper - bands.middle
+
+
+# The functions of expressions and how many bars before a value they read
+FUNCTIONS: dict[str, tuple[Callable[..., np.ndarray], Callable[[int], int]]] = {
+    'sma': (lambda x, n: indicators.sma(x, n).value, lambda n: n - 1),
+    'ema': (lambda x, n: indicators.ema(x, n).value, lambda n: 4 * n),
+    'rsi': (lambda x, n=14: indicators.rsi(x, n).value, lambda n=14: 4 * n),
+    'std': (_std, lambda n: n - 1),
+    'highest': (lambda x, n: _rolling(np.maximum, x, n), lambda n: n - 1),
+    'lowest': (lambda x, n: _rolling(np.minimum, x, n), lambda n: n - 1),
+    'ref': (_ref, lambda n: n),
+    'abs': (np.abs, lambda: 0),
+}
+
+_BINARY: dict[type, Callable] = {
+    ast.Add: np.add, ast.Sub: np.subtract, ast.Mult: np.multiply, ast.Div: np.divide,
+    ast.Pow: np.power, ast.BitAnd: np.logical_and, ast.BitOr: np.logical_or,
+}
+_UNARY: dict[type, Callable] = {
+    ast.USub: np.negative, ast.UAdd: np.positive, ast.Not: np.logical_not, ast.Invert: np.logical_not,
+}
+_COMPARE: dict[type, tuple[Callable, str]] = {
+    ast.Lt: (np.less, '<'), ast.LtE: (np.less_equal, '<='), ast.Gt: (np.greater, '>'),
+    ast.GtE: (np.greater_equal, '>='), ast.Eq: (np.equal, '='), ast.NotEq: (np.not_equal, '!='),
+}
+_FLIPPED = {'<': '>', '<=': '>=', '>': '<', '>=': '<=', '=': '=', '!=': '!='}
+
+
+class Expression(NamedTuple):
+    """A parsed screen expression."""
+    text: str
+    tree: ast.expr
+    fields: tuple[str, ...]
+    # bars before a date read to evaluate it
+    lookback: int
+    # (field, operator, value) conditions which can be pushed down into SQL
+    conditions: tuple[tuple[str, str, float], ...]
+
+
+def _check(node: ast.AST, fields: set[str]) -> int:
+    """Check that `node` only uses allowed syntax, collecting its fields. Returns its lookback."""
+    if isinstance(node, ast.Constant):
+        if isinstance(node.value, bool) or not isinstance(node.value, (int, float)):
+            raise ValueError(f'unsupported constant {node.value!r}')
+        return 0
+    if isinstance(node, ast.Name):
+        if node.id not in PANEL_FIELDS:
+            raise ValueError(f'unknown field {node.id!r}, expected one of {", ".join(PANEL_FIELDS)}')
+        fields.add(node.id)
+        return 0
+    if isinstance(node, ast.Call):
+        if not isinstance(node.func, ast.Name) or node.func.id not in FUNCTIONS:
+            raise ValueError(f'unknown function {ast.unparse(node.func)!r}, '
+                             f'expected one of {", ".join(FUNCTIONS)}')
+        if node.keywords:
+            raise ValueError(f'{ast.unparse(node)}: keyword arguments are not supported')
+        values, windows = node.args[:1], node.args[1:]
+        if not values or not all(isinstance(w, ast.Constant) and isinstance(w.value, int)
+                                 and not isinstance(w.value, bool) and w.value > 0 for w in windows):
+            raise ValueError(f'{ast.unparse(node)}: expected a value and positive integer windows')
+        try:
+            lookback = FUNCTIONS[node.func.id][1](*(w.value for w in windows))  # type: ignore[attr-defined]
+        except TypeError as e:
+            raise ValueError(f'{ast.unparse(node)}: wrong number of windows') from e
+        return lookback + _check(values[0], fields)
+    if isinstance(node, ast.BinOp) and type(node.op) in _BINARY:
+        return max(_check(node.left, fields), _check(node.right, fields))
+    if isinstance(node, ast.UnaryOp) and type(node.op) in _UNARY:
+        return _check(node.operand, fields)
+    if isinstance(node, ast.BoolOp):
+        return max(_check(value, fields) for value in node.values)
+    if isinstance(node, ast.Compare) and all(type(op) in _COMPARE for op in node.ops):
+        return max(_check(value, fields) for value in [node.left, *node.comparators])
+    raise ValueError(f'unsupported expression {ast.unparse(node)!r}')
+
+
+def _conditions(node: ast.expr) -> list[tuple[str, str, float]]:
+    """The comparisons of a field with a number which all matches satisfy."""
+    if isinstance(node, ast.BoolOp) and isinstance(node.op, ast.And):
+        return [c for value in node.values for c in _conditions(value)]
+    if isinstance(node, ast.BinOp) and isinstance(node.op, ast.BitAnd):
+        return _conditions(node.left) + _conditions(node.right)
+    if isinstance(node, ast.Compare) and len(node.ops) == 1:
+        left, right = node.left, node.comparators[0]
+        operator = _COMPARE[type(node.ops[0])][1]
+        if isinstance(left, ast.Constant):
+            left, right, operator = right, left, _FLIPPED[operator]
+        if isinstance(left, ast.Name) and isinstance(right, ast.Constant):
+            return [(left.id, operator, float(right.value))]
+    return []
+
+
+def parse(text: str) -> Expression:
+    """Parse a screen expression, raising ValueError if it is not valid."""
+    try:
+        tree = ast.parse(text, mode='eval').body
+    except SyntaxError as e:
+        raise ValueError(f'invalid expression {text!r}: {e.msg}') from e
+    fields: set[str] = set()
+    lookback = _check(tree, fields)
+    return Expression(text, tree, tuple(sorted(fields)), lookback, tuple(_conditions(tree)))
+
+
+def _evaluate(node: ast.expr, values: dict[str, np.ndarray]) -> Any:
+    if isinstance(node, ast.Constant):
+        return node.value
+    if isinstance(node, ast.Name):
+        return values[node.id]
+    if isinstance(node, ast.Call):
+        function = FUNCTIONS[node.func.id][0]  # type: ignore[attr-defined]
+        return function(_evaluate(node.args[0], values), *(w.value for w in node.args[1:]))  # type: ignore[attr-defined]
+    if isinstance(node, ast.BinOp):
+        return _BINARY[type(node.op)](_evaluate(node.left, values), _evaluate(node.right, values))
+    if isinstance(node, ast.UnaryOp):
+        return _UNARY[type(node.op)](_evaluate(node.operand, values))
+    if isinstance(node, ast.BoolOp):
+        combine = np.logical_and if isinstance(node.op, ast.And) else np.logical_or
+        result = _evaluate(node.values[0], values)
+        for value in node.values[1:]:
+            result = combine(result, _evaluate(value, values))
+        return result
+    assert isinstance(node, ast.Compare)
+    left = _evaluate(node.left, values)
+    result = True
+    for op, comparator in zip(node.ops, node.comparators):
+        right = _evaluate(comparator, values)
+        result = np.logical_and(result, _COMPARE[type(op)][0](left, right))
+        left = right
+    return result
+
+
+def evaluate(expression: str | Expression, panel: Panel) -> np.ndarray:
+    """Evaluate an expression over a panel, returning an array of (symbols, dates)."""
+    if isinstance(expression, str):
+        expression = parse(expression)
+    close = panel['close']
+    missing = np.isnan(close)
+    packed, order = indicators.pack_bars(close)
+    values = {field: indicators.reorder_bars(panel[field], order) for field in expression.fields}
+    with np.errstate(divide='ignore', invalid='ignore'):
+        result = np.broadcast_to(_evaluate(expression.tree, values), packed.shape)
+    if result.dtype == bool:
+        # unpack as numbers, so missing bars never match
+        return indicators.unpack_bars(result.astype(np.float64), order, missing) == 1
+    return indicators.unpack_bars(result.astype(np.float64), order, missing)
+
+
+def screen(expression: str, start: str | None = None, end: str | None = None,
+           symbols: list[str] | None = None, panel: Panel | None = None) -> pd.DataFrame:
+    """
+    Screen securities with a filter expression.
+    Args:
+        expression (str): The filter expression.
+        start (str | None): The first date to screen in YYYY-MM-DD format, only the last date if None.
+        end (str | None): The last date to screen in YYYY-MM-DD format.
+        symbols (list[str] | None): The symbols to screen, all securities if None.
+        panel (Panel | None): A panel to screen, such as an attached shared panel,
+            instead of history loaded from the database.
+    Returns:
+        DataFrame: The `symbol` and `datetime` of the matches, ordered by date and symbol.
+    """
+    parsed = parse(expression)
+    if panel is None:
+        if end is None:
+            end = utils.get_current_date()
+        first = start or end
+        # a trading year is about 245 days of 365
+        load_from = (pd.Timestamp(first) - timedelta(days=parsed.lookback * 3 // 2 + 10)).date().isoformat()
+        if parsed.conditions:
+            symbols = db.find_symbols(list(parsed.conditions), symbols, first, end)
+        # missing bars are told by the close
+        panel = build_panel(symbols, load_from, end, fields=tuple(sorted({*parsed.fields, 'close'})))
+    if not panel.symbols or not len(panel.dates):
+        return pd.DataFrame({'symbol': [], 'datetime': pd.DatetimeIndex([])})
+
+    matches = evaluate(parsed, panel)
+    if matches.dtype != bool:
+        raise ValueError(f'expression {expression!r} is not a condition')
+    dates = panel.dates
+    if end is not None:
+        matches = matches[:, dates <= np.datetime64(end)]
+        dates = dates[dates <= np.datetime64(end)]
+    selected = dates >= (dates[-1] if start is None else np.datetime64(start))
+    rows, columns = np.nonzero(matches[:, selected])
+    result = pd.DataFrame({'symbol': np.array(panel.symbols, dtype=object)[rows],
+                           'datetime': pd.DatetimeIndex(dates[selected][columns])})
+    return result.sort_values(['datetime', 'symbol'], ignore_index=True)
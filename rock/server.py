@@ -0,0 +1,257 @@
+"""
+rock/server.py
+A long-running local query server answering `rock.stock` queries for many
+processes from one shared in-memory cache.
+
+It listens on a Unix socket, or on host:port, and speaks the frames of
+`rock.protocol`. Cached results are dropped whenever the database changes.
+Use `rock.client.Client` to query it.
+"""
+import argparse
+import asyncio
+import json
+import os
+import sqlite3
+import time
+from collections import OrderedDict
+from pathlib import Path
+from typing import Any
+import pandas as pd
+from rock import adjustment, config, metrics, protocol, stock
+from rock.data import db
+from rock.logger import logger
+
+
+class HistoryCache:
+    """A least recently used cache of encoded results, bounded by their size in bytes."""
+
+    def __init__(self, max_bytes: int):
+        self.max_bytes = max_bytes
+        self.bytes = 0
+        self._entries: OrderedDict[Any, tuple[Any, bytes]] = OrderedDict()
+
+    def __len__(self) -> int:
+        return len(self._entries)
+
+    def get(self, key: Any) -> tuple[Any, bytes] | None:
+        """Get an entry and mark it as recently used."""
+        entry = self._entries.get(key)
+        metrics.SERVER_CACHE.inc(result='hit' if entry is not None else 'miss')
+        if entry is not None:
+            self._entries.move_to_end(key)
+        return entry
+
+    def put(self, key: Any, header: Any, body: bytes) -> None:
+        """Add an entry, evicting the least recently used ones beyond `max_bytes`."""
+        if len(body) > self.max_bytes:
+            return
+        if key in self._entries:
+            self.bytes -= len(self._entries.pop(key)[1])
+        self._entries[key] = (header, body)
+        self.bytes += len(body)
+        while self.bytes > self.max_bytes:
+            _, (_, evicted) = self._entries.popitem(last=False)
+            self.bytes -= len(evicted)
+
+    def clear(self) -> None:
+        """Remove all entries."""
+        self._entries.clear()
+        self.bytes = 0
+
+
+def encode_history(df: pd.DataFrame) -> tuple[dict[str, Any], bytes]:
+    """Encode a DataFrame of `stock.get_history` as columns."""
+    columns = {'datetime': df.index.to_numpy()}
+    columns.update({name: df[name].to_numpy() for name in df.columns})
+    return protocol.encode_columns(columns)
+
+
+class QueryServer:
+    """
+    Serves `rock.stock` queries. Queries run in worker threads, so cached
+    results are served while others are read from the database, and
+    concurrent misses of the same query share one database read.
+    """
+
+    def __init__(self, cache_bytes: int):
+        self.cache = HistoryCache(cache_bytes)
+        self._inflight: dict[Any, asyncio.Future] = {}
+        # opened by the event loop thread, which is the only one using it
+        self._monitor: sqlite3.Connection | None = None
+        self._shards: list[Path] = []
+        self._version: tuple[tuple[tuple[str | None, int], ...], str | None] | None = None
+        self.started = time.time()
+
+    def _check_version(self) -> tuple[tuple[tuple[str | None, int], ...], str | None]:
+        """
+        Drop the cache when the database changed. `data_version` changes with
+        every commit of another connection to the main database or to one of the
+        history shards, which are watched as well since writes of history without
+        a run, like those of the realtime poller, may only commit to a shard.
+        """
+        shards = db.get_shards()
+        if self._monitor is None or shards != self._shards:
+            # the shards are attached again when new ones appear
+            if self._monitor is not None:
+                self._monitor.close()
+            self._monitor = db.get_connection()
+            for i, path in enumerate(shards):
+                self._monitor.execute('ATTACH DATABASE ? AS ?', (str(path), f'shard_{i}'))
+            self._shards = shards
+        # versions of a new connection are told apart by the shards they are of
+        data_versions = ((None, self._monitor.execute('PRAGMA main.data_version').fetchone()[0]),) + tuple(
+            (path.name, self._monitor.execute(f'PRAGMA shard_{i}.data_version').fetchone()[0])
+            for i, path in enumerate(shards))
+        row = self._monitor.execute('SELECT value FROM meta WHERE key = ?',
+                                    (db.HISTORY_GENERATION,)).fetchone()
+        version = (data_versions, None if row is None else row['value'])
+        if version != self._version:
+            if self._version is not None:
+                logger.info("Database changed, dropping %d cached results.", len(self.cache))
+            self.cache.clear()
+            self._version = version
+        return version
+
+    async def _cached(self, key: Any, compute) -> tuple[Any, bytes]:
+        """Get a result from the cache, or compute it once in a worker thread."""
+        entry = self.cache.get(key)
+        if entry is not None:
+            return entry
+        if key in self._inflight:
+            return await asyncio.shield(self._inflight[key])
+
+        version = self._version
+        future = asyncio.get_running_loop().run_in_executor(None, compute)
+        self._inflight[key] = future
+        try:
+            header, body = await future
+        finally:
+            del self._inflight[key]
+        if self._version == version:
+            self.cache.put(key, header, body)
+        return header, body
+
+    async def get_history(self, request: dict[str, Any]) -> tuple[dict[str, Any], list[bytes]]:
+        """Answer a get_history request, one cache entry per symbol and options."""
+        start = request.get('start') or None
+        end = request.get('end') or None
+        indicators = tuple(request.get('indicators') or ())
+        adjust = adjustment.Adjust(request.get('adjust') or adjustment.Adjust.NONE)
+        frequency = request.get('frequency') or '1d'
+        symbols = list(dict.fromkeys(request['symbols']))
+
+        async def one(symbol: str) -> tuple[Any, bytes]:
+            def compute() -> tuple[Any, bytes]:
+                df = stock.get_history([symbol], start, end, indicators, adjust, frequency).get(symbol)
+                if df is None:
+                    return None, b''
+                return encode_history(df)
+            return await self._cached(('history', symbol, start, end, indicators, adjust, frequency), compute)
+
+        results = await asyncio.gather(*(one(symbol) for symbol in symbols))
+        histories = []
+        body = []
+        for symbol, (description, data) in zip(symbols, results):
+            if description is None:
+                continue
+            histories.append(dict(description, symbol=symbol))
+            body.append(data)
+        return {'histories': histories}, body
+
+    async def get_securities(self, _: dict[str, Any]) -> tuple[dict[str, Any], list[bytes]]:
+        """Answer a get_securities request."""
+        def compute() -> tuple[Any, bytes]:
+            return list(stock.get_securities()), b''
+        securities, _ = await self._cached(('securities',), compute)
+        return {'securities': securities}, []
+
+    async def stats(self, _: dict[str, Any]) -> tuple[dict[str, Any], list[bytes]]:
+        """Answer a stats request."""
+        return {
+            'entries': len(self.cache),
+            'bytes': self.cache.bytes,
+            'max_bytes': self.cache.max_bytes,
+            'uptime': time.time() - self.started,
+            'cache': metrics.SERVER_CACHE.summary(),
+        }, []
+
+    async def dispatch(self, request: dict[str, Any]) -> tuple[dict[str, Any], list[bytes]]:
+        """Answer a request."""
+        handlers = {
+            'get_history': self.get_history,
+            'get_securities': self.get_securities,
+            'stats': self.stats,
+        }
+        op = request.get('op')
+        if op not in handlers:
+            return {'error': f'unknown operation {op!r}'}, []
+        metrics.SERVER_REQUESTS.inc(op=op)
+        with metrics.SERVER_REQUEST_SECONDS.time(op=op):
+            self._check_version()
+            try:
+                return await handlers[op](request)
+            except Exception as e:  # pylint: disable=W0718
+                logger.exception("Failed to answer %s", op)
+                return {'error': f'{type(e).__name__}: {e}'}, []
+
+    async def handle(self, reader: asyncio.StreamReader, writer: asyncio.StreamWriter) -> None:
+        """Answer the requests of one connection until it is closed."""
+        try:
+            while True:
+                try:
+                    frame = await reader.readexactly(protocol.FRAME.size)
+                except asyncio.IncompleteReadError:
+                    break
+                header_size, body_size = protocol.decode_header(frame)
+                request = await reader.readexactly(header_size + body_size)
+                header, body = await self.dispatch(json.loads(request[:header_size]))
+                writer.write(protocol.encode_message(header, body))
+                await writer.drain()
+        except (ConnectionError, ValueError) as e:
+            logger.warning("Dropping client: %s", e)
+        finally:
+            writer.close()
+
+    async def serve(self, address: str | tuple[str, int]) -> None:
+        """Serve on a Unix socket path or a (host, port) address until cancelled."""
+        if isinstance(address, tuple):
+            server = await asyncio.start_server(self.handle, *address)
+        else:
+            if os.path.exists(address):
+                os.remove(address)
+            Path(address).parent.mkdir(parents=True, exist_ok=True)
+            server = await asyncio.start_unix_server(self.handle, address)
+        logger.info("Query server listening on %s.", address)
+        try:
+            async with server:
+                await server.serve_forever()
+        finally:
+            if self._monitor is not None:
+                self._monitor.close()
+                self._monitor = None
+
+
+def parse_args(argv: list[str] | None = None) -> argparse.Namespace:
+    """Parse the command line arguments of the query server."""
+    parser = argparse.ArgumentParser(prog='rock-server', description='Serve rock queries from a shared cache.')
+    parser.add_argument('--address', default=config.SERVER_ADDRESS,
+                        help='Unix socket path or host:port (default: %(default)s)')
+    parser.add_argument('--cache-mb', type=int, default=config.SERVER_CACHE_MB, metavar='MB',
+                        help='maximum size of the cache (default: %(default)s)')
+    return parser.parse_args(argv)
+
+
+def run(argv: list[str] | None = None) -> None:
+    """Run the query server."""
+    args = parse_args(argv)
+    if config.METRICS_PORT:
+        metrics.REGISTRY.serve(int(config.METRICS_PORT))
+    server = QueryServer(args.cache_mb << 20)
+    try:
+        asyncio.run(server.serve(protocol.parse_address(args.address)))
+    except KeyboardInterrupt:
+        pass
+
+
+if __name__ == "__main__":
+    run()
@@ -3,16 +3,23 @@ rock/stock.py
 This module provides a function to retrieve stock related data.
 """
 
-from collections.abc import Sequence, Mapping
+from collections.abc import Iterator, Sequence, Mapping
+import numpy as np
 import pandas as pd
+from rock import adjustment
 from rock.data import db
 from rock.common import utils
+from rock.indicators import parse_spec
+from rock.panel import Panel, attach_panel, publish_panel  # pylint: disable=unused-import
 from rock.logger import logger
 
 
 def get_history(symboles: Sequence[str],
                 start: str | None = None,   # YYYY-MM-DD
-                end: str | None = None      # YYYY-MM-DD
+                end: str | None = None,     # YYYY-MM-DD
+                indicators: Sequence[str] = (),
+                adjust: str = adjustment.Adjust.NONE,
+                frequency: str = '1d'
             ) -> Mapping[str, pd.DataFrame]:
     """
     Retrieve historical stock data for the given symbols.
@@ -21,6 +28,10 @@ def get_history(symboles: Sequence[str],
         interval (Interval): The interval for the data.
         start (str | None): The start date in YYYY-MM-DD format.
         end (str | None): The end date in YYYY-MM-DD format.
+        indicators (Sequence[str]): Stored indicators to add as columns, like `sma_200`.
+        adjust (str): How open, close, high and low are adjusted for corporate actions:
+            'none', 'forward' (continuous with the latest prices) or 'backward'.
+        frequency (str): The frequency of the bars, '1d' or '1m'.
     Returns:
         Mapping[str, DataFrame]: A dictionary of DataFrames containing historical data for each symbol.
     """
@@ -29,11 +40,15 @@ def get_history(symboles: Sequence[str],
     if end is None:
         end = utils.get_current_date()
 
-    histories = db.get_history(list(symboles), start, end)
+    histories = db.get_history(list(symboles), start, end, frequency)
+    columns = [column for name in indicators for column in parse_spec(name).columns]
+    values = db.get_indicators(list(histories), columns, start, end) if columns else {}
+    adjust = adjustment.Adjust(adjust)
+    events = db.get_adjustments(list(histories)) if adjust != adjustment.Adjust.NONE else {}
 
     result = {}
     for s, h in histories.items():
-        if h is None:
+        if not h:
             logger.warning("No history found for %s", s)
             continue
         # Convert to DataFrame
@@ -44,10 +59,49 @@ def get_history(symboles: Sequence[str],
         df.sort_values(by='datetime', inplace=True)
         # Set datetime as index
         df.set_index('datetime', inplace=True)
+        # Adjust prices by the factor in effect on each bar
+        if adjust != adjustment.Adjust.NONE:
+            rows = events.get(s, [])
+            factors = adjustment.factors(pd.DatetimeIndex(df.index).to_numpy(),
+                                         pd.DatetimeIndex([row['datetime'] for row in rows]).to_numpy(),
+                                         np.array([row['factor'] for row in rows]), adjust)
+            prices = list(adjustment.ADJUSTED_COLUMNS)
+            df[prices] = df[prices].to_numpy(dtype=np.float64) * factors[:, None]
+        # Add indicator columns, NaN where they are not stored
+        if columns:
+            stored = pd.DataFrame([tuple(row) for row in values.get(s, [])],
+                                  columns=['name', 'datetime', 'value'])
+            wide = stored.pivot(index='datetime', columns='name', values='value')
+            df[columns] = wide.reindex(index=df.index, columns=columns).to_numpy()
         # Add to result
         result[s] = df
     return result
 
+def iter_history(symboles: Sequence[str] | None = None,
+                 start: str | None = None,   # YYYY-MM-DD
+                 end: str | None = None,     # YYYY-MM-DD
+                 chunk_rows: int = 100_000,
+                 frequency: str = '1d'
+            ) -> Iterator[pd.DataFrame]:
+    """
+    Iterate over historical stock data in chunks of bounded size.
+    Args:
+        symboles (Sequence[str] | None): List of stock symbols, all securities if None.
+        start (str | None): The start date in YYYY-MM-DD format.
+        end (str | None): The end date in YYYY-MM-DD format.
+        chunk_rows (int): The maximum number of rows of a chunk.
+        frequency (str): The frequency of the bars, '1d' or '1m'.
+    Returns:
+        Iterator[DataFrame]: DataFrames with a `symbol` column, ordered by security and
+            datetime. The history of a symbol may continue in the next chunk.
+    """
+    symbols = None if symboles is None else list(symboles)
+    for rows in db.iter_history(symbols, start, end, chunk_rows, frequency=frequency):
+        columns = dict(zip(rows[0].keys(), zip(*rows)))
+        del columns['security_id'], columns['frequency']
+        yield pd.DataFrame(columns)
+
+
 def get_securities() -> Sequence[str]:
     """
     Retrieve all securities from the database.
@@ -0,0 +1,156 @@
+"""
+rock/sweep.py
+This module runs large parameter sweeps of `rock.backtest` over all cores.
+
+The history is published once as a shared memory panel, which every worker
+process attaches to read-only when it starts, so tasks only carry their
+parameter combinations. Combinations sharing a signal are kept in one task,
+tasks are submitted most expensive first and their summaries are yielded as
+they complete.
+"""
+import itertools
+import os
+from collections.abc import Callable, Iterator, Mapping, Sequence
+from concurrent.futures import ProcessPoolExecutor, as_completed
+from typing import Any
+import pandas as pd
+from rock import backtest as bt
+from rock import screen
+from rock.logger import logger
+from rock.panel import PANEL_FIELDS, Panel, attach_panel, publish_panel, read_manifest, unpublish_panel
+
+# Tasks per worker, to balance the load while amortizing the round trips
+TASKS_PER_WORKER = 4
+
+# Bounds of combinations × symbols simulated by a task: each step through time
+# has a fixed overhead worth about a thousand cells, and arrays of the upper
+# bound take about 100 MB
+MIN_TASK_CELLS = 20_000
+MAX_TASK_CELLS = 1_000_000
+
+# The state of a worker process, set by its initializer
+_worker: dict[str, Any] = {}
+
+# Numbers the temporary panels of the sweeps of this process
+_sweeps = itertools.count()
+
+
+def _init_worker(panel_name: str, signal: Callable[..., Any] | str, costs: bt.Costs) -> None:
+    _worker['panel'] = attach_panel(panel_name)
+    _worker['signal'] = signal
+    _worker['costs'] = costs
+
+
+def _run_task(combinations: list[dict[str, Any]]) -> pd.DataFrame:
+    panel: Panel = _worker['panel']
+    return bt.backtest(_worker['signal'], panel, combinations, _worker['costs'], detail=False).summary()
+
+
+def _fields(signal: Callable[..., Any] | str, combinations: list[dict[str, Any]]) -> tuple[str, ...]:
+    """The panel fields a sweep of `combinations` reads, all of them for a function signal."""
+    if not isinstance(signal, str):
+        return PANEL_FIELDS
+    # the parameters may name the fields, so each distinct expression is parsed
+    expressions = {signal.format(**combination) for combination in combinations}
+    used = {'open', 'high', 'low', 'close', 'adj_close',
+            *(field for expression in expressions for field in screen.parse(expression).fields)}
+    return tuple(field for field in PANEL_FIELDS if field in used)
+
+
+def estimate_cost(combinations: Sequence[dict[str, Any]]) -> float:
+    """
+    The relative cost of backtesting combinations sharing a signal: evaluating
+    the signal costs about as much as simulating one combination.
+    """
+    return 1.0 + len(combinations)
+
+
+def plan_tasks(combinations: Sequence[dict[str, Any]], workers: int,
+               cost: Callable[[Sequence[dict[str, Any]]], float] = estimate_cost,
+               min_size: int = 1, max_size: int | None = None) -> list[list[dict[str, Any]]]:
+    """
+    Split combinations into tasks, most expensive first.
+    Args:
+        combinations (Sequence[dict]): The parameter combinations.
+        workers (int): The worker processes, which get about `TASKS_PER_WORKER` tasks each.
+        cost (Callable): Estimates the relative cost of a group of combinations sharing a signal.
+        min_size (int): The combinations a task is filled to before it is cut.
+        max_size (int | None): The combinations a task holds at most, unless they share a signal.
+    Returns:
+        list[list[dict]]: The combinations of each task. Combinations differing only by
+            stop loss stay together to share their signal.
+    """
+    groups: dict[tuple, list[dict[str, Any]]] = {}
+    for combination in combinations:
+        key = tuple((k, v) for k, v in combination.items() if k != 'stop_loss')
+        groups.setdefault(key, []).append(combination)
+    weighted = sorted(((cost(group), group) for group in groups.values()), key=lambda item: -item[0])
+    target = sum(weight for weight, _ in weighted) / max(1, workers * TASKS_PER_WORKER)
+
+    tasks: list[tuple[float, list[dict[str, Any]]]] = []
+    task: list[dict[str, Any]] = []
+    task_cost = 0.0
+    for weight, group in weighted:
+        full = task_cost + weight > target and len(task) >= min_size
+        if task and (full or max_size is not None and len(task) + len(group) > max_size):
+            tasks.append((task_cost, task))
+            task, task_cost = [], 0.0
+        task += group
+        task_cost += weight
+    if task:
+        tasks.append((task_cost, task))
+    tasks.sort(key=lambda item: -item[0])
+    return [task for _, task in tasks]
+
+
+def sweep(signal: Callable[..., Any] | str, params: Mapping[str, Sequence[Any]] | Sequence[dict[str, Any]],
+          panel_name: str | None = None, symbols: list[str] | None = None, start: str | None = None,
+          end: str | None = None, costs: bt.Costs = bt.Costs(), workers: int | None = None,
+          cost: Callable[[Sequence[dict[str, Any]]], float] = estimate_cost) -> Iterator[pd.DataFrame]:
+    """
+    Backtest every combination of parameters in a pool of processes.
+    Args:
+        signal (Callable | str): The signal, as for `rock.backtest.backtest`. A function must be
+            defined at the top level of a module to be sent to the workers.
+        params (Mapping[str, Sequence] | Sequence[dict]): Values of each parameter, or the combinations.
+        panel_name (str | None): A published panel to read, such as the one kept by
+            `rock-data-service --panel`. A temporary panel of `symbols` from `start` to `end`
+            is published if None.
+        symbols (list[str] | None): The symbols of the temporary panel, all securities if None.
+        start (str | None): The start date of the temporary panel in YYYY-MM-DD format.
+        end (str | None): The end date of the temporary panel in YYYY-MM-DD format.
+        costs (Costs): Trading costs.
+        workers (int | None): Worker processes, one per core if None.
+        cost (Callable): Estimates the relative cost of a group of combinations sharing a signal.
+    Yields:
+        DataFrame: The summaries of the combinations of each task, as they complete.
+    """
+    combinations = bt.parameter_grid(params)
+    workers = workers or os.cpu_count() or 1
+    temporary = panel_name is None
+    if temporary:
+        panel_name = f'sweep-{os.getpid()}-{next(_sweeps)}'
+        manifest = publish_panel(panel_name, symbols, start, end, fields=_fields(signal, combinations))
+    else:
+        manifest = read_manifest(panel_name)
+        if manifest is None:
+            raise FileNotFoundError(f'panel {panel_name} is not published')
+    try:
+        width = max(1, len(manifest['symbols']))
+        tasks = plan_tasks(combinations, workers, cost, min_size=-(-MIN_TASK_CELLS // width),
+                           max_size=max(1, MAX_TASK_CELLS // width))
+        logger.info("Sweeping %d combinations in %d tasks over %d processes.",
+                    len(combinations), len(tasks), min(workers, len(tasks)))
+        with ProcessPoolExecutor(min(workers, len(tasks)), initializer=_init_worker,
+                                 initargs=(panel_name, signal, costs)) as executor:
+            futures = [executor.submit(_run_task, task) for task in tasks]
+            try:
+                for future in as_completed(futures):
+                    yield future.result()
+            finally:
+                for future in futures:
+                    future.cancel()
+    finally:
+        if temporary:
+            unpublish_panel(panel_name)
+
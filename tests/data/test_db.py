@@ -5,8 +5,10 @@ test_db.py
 
 import unittest
 import os
+import shutil
+from unittest.mock import MagicMock, patch
 from collections.abc import Sequence, Mapping
-from sqlite3 import IntegrityError, Row
+from sqlite3 import IntegrityError, OperationalError, Row
 from datetime import datetime as dt
 from rock.data import db
 
@@ -26,6 +28,7 @@ class TestLocal(unittest.TestCase):
 
         if os.path.exists(db.DB_PATH):
             os.remove(db.DB_PATH)
+        shutil.rmtree(db.shard_dir(), ignore_errors=True)
         return super().tearDown()
 
     def test_insert_exchange(self):
@@ -204,6 +207,59 @@ class TestLocal(unittest.TestCase):
             db.bulk_insert_history(invalid_datetime)
         cursor.close()
 
+    def test_upsert_history(self):
+        """Test that upserting history only rewrites the rows which changed."""
+        db.insert_exchange('Shanghai Stock Exchange', 'SSE', 'stock')
+        db.insert_securities([('000001', 'Ping An Bank', 'stock', '19910403', None, 1)])
+        histories = [
+            (1, '2025-03-03', 10.0, 11.0, 12.0, 9.0, 10.5, 1000, 1000, '1d'),
+            (1, '2025-03-04', 11.0, 12.0, 13.0, 10.0, 11.5, 2000, 1000, '1d'),
+        ]
+        self.assertEqual(db.bulk_insert_history(histories), db.WriteCounts(2, 0, 0))
+        db.bump_generation()
+        revised = (1, '2025-03-04', 11.0, 12.0, 13.0, 10.0, 11.5, 2500, 1200, '1d')
+        new = (1, '2025-03-05', 12.0, 12.5, 13.0, 11.0, 12.0, 3000, 1000, '1d')
+        self.assertEqual(db.write_history([histories[0], revised, new]), db.WriteCounts(1, 1, 1))
+        rows = db.get_history('000001')['000001']
+        self.assertEqual([row['volume'] for row in rows], [1000, 2500, 3000])
+        # unchanged rows keep their generation, so incremental exports skip them
+        cursor = self.connection.cursor()
+        cursor.execute(f'SELECT generation FROM {db.Tables.HISTORY} ORDER BY datetime')
+        self.assertEqual([row['generation'] for row in cursor.fetchall()], [0, 1, 1])
+        cursor.close()
+
+        self.assertEqual(db.migrate_history_layout(db.HistoryLayout.COMPACT), 3)
+        self.assertEqual(db.bulk_insert_history([revised, (*new[:3], 12.51, *new[4:])]),
+                         db.WriteCounts(0, 1, 1))
+        self.assertEqual(db.get_history('000001')['000001'][2]['close'], 12.51)
+
+    def test_bootstrap(self):
+        """Test that bootstrap mode defers foreign key checks to its end."""
+        db.insert_exchange('Shanghai Stock Exchange', 'SSE', 'stock')
+        db.insert_securities([('000001', 'Ping An Bank', 'stock', '19910403', None, 1)])
+        db.begin_bootstrap()
+        try:
+            self.assertTrue(db.resume_bootstrap())
+            db.bulk_insert_history([(1, '2025-03-03', 10.0, 11.0, 12.0, 9.0, 10.5, 1000, 1000, '1d'),
+                                    (9, '2025-03-03', 10.0, 11.0, 12.0, 9.0, 10.5, 1000, 1000, '1d')])
+            with self.assertRaises(IntegrityError):
+                db.end_bootstrap()
+            self.assertTrue(db.resume_bootstrap())
+            connection = db.get_connection()
+            connection.execute(f'DELETE FROM {db.Tables.HISTORY} WHERE security_id = 9')
+            connection.commit()
+            connection.close()
+            db.end_bootstrap()
+        finally:
+            db._bootstrap = False  # pylint: disable=protected-access
+        self.assertFalse(db.resume_bootstrap())
+        self.assertTrue(db.has_history())
+        cursor = self.connection.cursor()
+        self.assertEqual(cursor.execute('PRAGMA journal_mode').fetchone()[0], 'delete')
+        cursor.close()
+        with self.assertRaises(IntegrityError):
+            db.bulk_insert_history([(9, '2025-03-04', 10.0, 11.0, 12.0, 9.0, 10.5, 1000, 1000, '1d')])
+
     def test_get_security(self):
         """Test getting a security from the database."""
         # Insert an exchange first
@@ -306,6 +362,151 @@ class TestLocal(unittest.TestCase):
         result = db.get_history(test_security, end=test_end)
         self.assertEqual(len(result[test_security]), 1, "Number of histories should match.")
 
+        # minute bars are only read by frequency
+        db.bulk_insert_history([(1, '2025-03-02 09:31:00', 11.0, 11.1, 11.2, 10.9, 11.1, 10, 100, '1m')])
+        self.assertEqual([row['frequency'] for row in db.get_history('000001')['000001']], ['1d', '1d'])
+        result = db.get_history('000001', frequency='1m')['000001']
+        self.assertEqual([(row['datetime'], row['close']) for row in result],
+                         [(dt(2025, 3, 2, 9, 31), 11.1)])
+
+    def test_iter_history(self):
+        """Test iterating over history in chunks."""
+        db.insert_exchange('Shanghai Stock Exchange', 'SSE', 'stock')
+        db.insert_securities([
+            ('000001', 'Ping An Bank', 'stock', '19910403', None, 1),
+            ('000002', 'Another Company', 'stock', '19910129', None, 1),
+        ])
+        db.bulk_insert_history([
+            (2, '2025-03-04', 9.0, 11.0, 14.0, 8.0, 11.5, 3000, 1000, '1d'),
+            (1, '2025-03-04', 11.0, 12.0, 13.0, 10.0, 11.5, 2000, 1000, '1d'),
+            (1, '2025-03-03', 10.0, 11.0, 12.0, 9.0, 10.5, 1000, 1000, '1d'),
+            (2, '2025-03-03', 9.0, 11.0, 14.0, 8.0, 11.5, 3000, 1000, '1d'),
+        ])
+
+        chunks = list(db.iter_history(chunk_rows=3))
+        self.assertEqual([len(chunk) for chunk in chunks], [3, 1])
+        rows = [(row['symbol'], row['datetime']) for chunk in chunks for row in chunk]
+        self.assertEqual(rows, [('000001', dt(2025, 3, 3)), ('000001', dt(2025, 3, 4)),
+                                ('000002', dt(2025, 3, 3)), ('000002', dt(2025, 3, 4))])
+
+        chunks = list(db.iter_history(['000002', 'missing'], start='2025-03-04'))
+        self.assertEqual([tuple(row)[:3] for row in chunks[0]], [('000002', 2, dt(2025, 3, 4))])
+        self.assertEqual(list(db.iter_history(['missing'])), [])
+
+    def test_sharded_history(self):
+        """Test writing history to shards and reading it back through the main database."""
+        db.insert_exchange('Shanghai Stock Exchange', 'SSE', 'stock')
+        db.insert_exchange('Shenzhen Stock Exchange', 'SZSE', 'stock')
+        db.insert_securities([
+            ('600000', 'SPD Bank', 'stock', '19991110', None, 1),
+            ('000001', 'Ping An Bank', 'stock', '19910403', None, 2),
+        ])
+        # rows written before sharding was enabled stay in the main database
+        db.bulk_insert_history([(1, '1999-12-30', 9.0, 9.5, 9.8, 8.9, 9.5, 500, 500, '1d')])
+
+        with patch.object(db, 'HISTORY_SHARDING', db.Sharding.YEAR):
+            db.bulk_insert_history([
+                (1, '2009-12-31', 10.0, 11.0, 12.0, 9.0, 10.5, 1000, 1000, '1d'),
+                (1, '2010-01-04', 11.0, 12.0, 13.0, 10.0, 11.5, 2000, 1000, '1d'),
+                (2, '2010-01-04', 9.0, 11.0, 14.0, 8.0, 11.5, 3000, 1000, '1d'),
+            ])
+            self.assertEqual([p.name for p in db.get_shards()],
+                             ['history_2000_2009.db', 'history_2010_2019.db'])
+
+            result = db.get_history(['600000', '000001'])
+            self.assertEqual([row['datetime'] for row in result['600000']],
+                             [dt(1999, 12, 30), dt(2009, 12, 31), dt(2010, 1, 4)])
+            self.assertEqual(len(result['000001']), 1)
+            self.assertEqual(len(db.get_history('600000', start='2010-01-01')['600000']), 1)
+
+            since = db.bump_generation()
+            self.assertEqual(db.move_history_to_shards(), 1)
+            self.assertEqual(len(db.get_shards()), 3)
+            self.assertEqual(len(db.get_history('600000')['600000']), 3)
+            # moved rows keep their generation, so an incremental export skips them
+            self.assertEqual(list(db.iter_history(since=since - 1)), [])
+            self.assertEqual(sum(len(chunk) for chunk in db.iter_history()), 4)
+
+        shutil.rmtree(db.shard_dir())
+        with patch.object(db, 'HISTORY_SHARDING', db.Sharding.EXCHANGE):
+            db.bulk_insert_history([
+                (1, '2010-01-04', 11.0, 12.0, 13.0, 10.0, 11.5, 2000, 1000, '1d'),
+                (2, '2010-01-04', 9.0, 11.0, 14.0, 8.0, 11.5, 3000, 1000, '1d'),
+            ])
+            self.assertEqual([p.name for p in db.get_shards()], ['history_sse.db', 'history_szse.db'])
+            self.assertEqual(len(db.get_history('000001')['000001']), 1)
+
+    def test_attach_shards_failure(self):
+        """Test closing the connection of a read when the shards can not be attached."""
+        reads = [lambda: db.get_history('000001'), lambda: list(db.iter_history()), db.get_history_index,
+                 lambda: db.find_symbols([]), lambda: db.get_adjustment_bases([1], '2025-03-03'),
+                 db.has_history]
+        for read in reads:
+            connection = MagicMock(wraps=db.get_connection())
+            with patch('rock.data.db.get_connection', return_value=connection), \
+                    patch('rock.data.db._attach_shards', side_effect=OperationalError('too many shards')):
+                with self.assertRaises(OperationalError):
+                    read()
+            connection.close.assert_called_once()
+
+    def test_compact_history(self):
+        """Test converting history to the compact layout and back."""
+        db.insert_exchange('Shanghai Stock Exchange', 'SSE', 'stock')
+        db.insert_securities([('000001', 'Ping An Bank', 'stock', '19910403', None, 1)])
+        db.bulk_insert_history([
+            (1, '2025-03-03', 10.01, 11.07, 12.3, 9.99, 10.5, 1000, 1000, '1d'),
+            (1, '2025-03-04', 11.0, 12.0, 13.0, 10.0, 11.5, 2000, 1000, '1d'),
+        ])
+        expected = [tuple(row) for row in db.get_history('000001')['000001']]
+
+        self.assertEqual(db.migrate_history_layout(db.HistoryLayout.COMPACT), 2)
+        cursor = self.connection.cursor()
+        self.assertEqual(db.get_history_layout(cursor), db.HistoryLayout.COMPACT)
+        cursor.execute(f"SELECT typeof(close), close, frequency FROM {db.Tables.HISTORY} LIMIT 1")
+        self.assertEqual(tuple(cursor.fetchone()), ('integer', 11.07, '1d'))
+        cursor.close()
+        self.assertEqual([tuple(row) for row in db.get_history('000001')['000001']], expected)
+
+        # writes encode prices for the compact layout
+        db.bulk_insert_history([(1, '2025-03-05', 12.0, 12.34, 13.0, 11.0, 12.34, 10, 10, '1d')])
+        result = db.get_history('000001', start='2025-03-05')['000001']
+        self.assertEqual(result[0]['close'], 12.34)
+        self.assertEqual(db.migrate_history_layout(db.HistoryLayout.COMPACT), 0)
+
+        # conditions compare prices in yuan, where 1.15 * 100 is not 115
+        db.bulk_insert_history([(1, '2025-03-06', 1.15, 1.15, 1.15, 1.15, 1.15, 10, 10, '1d')])
+        for operator in ('<=', '=', '>='):
+            self.assertEqual(db.find_symbols([('close', operator, 1.15)], start='2025-03-06'), ['000001'])
+        self.assertEqual(db.find_symbols([('close', '<', 1.15)], start='2025-03-06'), [])
+
+        self.assertEqual(db.migrate_history_layout(db.HistoryLayout.REAL), 4)
+        self.assertEqual([tuple(row) for row in db.get_history('000001')['000001']][:2], expected)
+
+    def test_migrate_history_writes(self):
+        """Test that rows inserted or updated during a layout migration are not lost."""
+        db.insert_exchange('Shanghai Stock Exchange', 'SSE', 'stock')
+        db.insert_securities([('000001', 'Ping An Bank', 'stock', '19910403', None, 1),
+                              ('000002', 'Another Company', 'stock', '19910129', None, 1)])
+        db.bulk_insert_history([
+            (1, '2025-03-03', 10.0, 10.0, 12.0, 9.0, 10.0, 1000, 1000, '1d'),
+            (2, '2025-03-03', 20.0, 20.0, 22.0, 19.0, 20.0, 1000, 1000, '1d'),
+        ])
+        convert = db._convert_history_columns  # pylint: disable=protected-access
+        calls = []
+
+        def write_meanwhile(*args, **kwargs):
+            calls.append(args)
+            # the batch of the first security is copied, the second one is not yet
+            if len(calls) == 4:
+                db.bulk_insert_history([(1, '2025-03-03', 10.0, 12.0, 12.0, 9.0, 12.0, 1000, 1000, '1d'),
+                                        (1, '2025-03-04', 12.0, 12.5, 13.0, 11.0, 12.5, 1000, 1000, '1d')])
+            return convert(*args, **kwargs)
+
+        with patch('rock.data.db._convert_history_columns', side_effect=write_meanwhile):
+            db.migrate_history_layout(db.HistoryLayout.COMPACT, batch_size=1)
+        self.assertEqual([row['close'] for row in db.get_history('000001')['000001']], [12.0, 12.5])
+        self.assertEqual([row['close'] for row in db.get_history('000002')['000002']], [20.0])
+
     def test_get_exchange(self):
         """Test getting an exchange from the database."""
         # Insert an exchange
@@ -0,0 +1,80 @@
+# type: ignore
+"""
+test_export.py
+"""
+
+import csv
+import importlib.util
+import os
+import tempfile
+import unittest
+from pathlib import Path
+from rock.data import db, export
+
+
+class TestExport(unittest.TestCase):
+    """Test cases for the history export."""
+    def setUp(self):
+        db.create_db()
+        db.insert_exchange('Shanghai Stock Exchange', 'SSE', 'stock')
+        db.insert_securities([
+            ('000001', 'Ping An Bank', 'stock', '19910403', None, 1),
+            ('000002', 'Another Company', 'stock', '19910129', None, 1),
+        ])
+        db.bulk_insert_history([
+            (1, '2025-03-03', 10.0, 11.0, 12.0, 9.0, 10.5, 1000, 1000, '1d'),
+            (1, '2025-03-04', 11.0, 12.0, 13.0, 10.0, 11.5, 2000, 1000, '1d'),
+            (2, '2025-03-03', 9.0, 11.0, 14.0, 8.0, 11.5, 3000, 1000, '1d'),
+        ])
+        self.directory = tempfile.TemporaryDirectory()  # pylint: disable=consider-using-with
+        self.path = Path(self.directory.name)
+        return super().setUp()
+
+    def tearDown(self):
+        self.directory.cleanup()
+        if os.path.exists(db.DB_PATH):
+            os.remove(db.DB_PATH)
+        return super().tearDown()
+
+    def _read_csv(self, path):
+        with open(path, newline='', encoding='utf-8') as f:
+            return list(csv.DictReader(f))
+
+    def test_export_csv(self):
+        """Test exporting history to CSV, all at once and incrementally."""
+        summary = export.export_history(self.path / 'history.csv', chunk_rows=2)
+        self.assertEqual(summary['rows'], 3)
+        self.assertEqual(summary['generation'], 0)
+        rows = self._read_csv(self.path / 'history.csv')
+        self.assertEqual([(row['symbol'], row['datetime']) for row in rows], [
+            ('000001', '2025-03-03T00:00:00'), ('000001', '2025-03-04T00:00:00'),
+            ('000002', '2025-03-03T00:00:00')])
+        self.assertEqual(float(rows[1]['close']), 12.0)
+
+        # only rows written in later generations are exported incrementally
+        self.assertEqual(db.bump_generation(), 1)
+        db.bulk_insert_history([(2, '2025-03-04', 9.0, 11.0, 14.0, 8.0, 11.5, 3000, 1000, '1d')])
+        summary = export.export_history(self.path / 'since.csv', since=summary['generation'])
+        self.assertEqual(summary['generation'], 1)
+        rows = self._read_csv(self.path / 'since.csv')
+        self.assertEqual([(row['symbol'], row['datetime']) for row in rows],
+                         [('000002', '2025-03-04T00:00:00')])
+
+    def test_export_workers(self):
+        """Test exporting symbol ranges in parallel to part files."""
+        summary = export.export_history(self.path / 'parts', 'csv', workers=2)
+        self.assertEqual(summary['rows'], 3)
+        self.assertEqual([Path(f).name for f in summary['files']], ['part-000.csv', 'part-001.csv'])
+        self.assertEqual([len(self._read_csv(f)) for f in summary['files']], [2, 1])
+
+    @unittest.skipUnless(importlib.util.find_spec('pyarrow'), 'pyarrow is not installed')
+    def test_export_arrow(self):
+        """Test exporting history to Arrow IPC and Parquet."""
+        from pyarrow import ipc, parquet  # pylint: disable=import-outside-toplevel
+        export.export_history(self.path / 'history.arrow', symbols=['000002'])
+        table = ipc.open_file(self.path / 'history.arrow').read_all()
+        self.assertEqual(table.column_names, list(export.EXPORT_COLUMNS))
+        self.assertEqual(table.to_pylist()[0]['close'], 11.0)
+
+        export.export_history(self.path / 'history.parquet', start='2025-03-04')
+        self.assertEqual(parquet.read_table(self.path / 'history.parquet').num_rows, 1)
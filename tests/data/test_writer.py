@@ -0,0 +1,87 @@
+# type: ignore
+"""
+test_writer.py
+"""
+
+import itertools
+import unittest
+import os
+import time
+from unittest.mock import patch
+from rock.data import db, writer
+
+
+class TestHistoryWriter(unittest.TestCase):
+    """Test cases for the history writer."""
+    def setUp(self):
+        db.create_db()
+        db.insert_exchange('Shanghai Stock Exchange', 'SSE', 'stock')
+        db.insert_securities([
+            ('000001', 'Ping An Bank', 'stock', '19910403', None, 1),
+            ('000002', 'Another Company', 'stock', '19910129', None, 1),
+        ])
+        return super().setUp()
+
+    def tearDown(self):
+        if os.path.exists(db.DB_PATH):
+            os.remove(db.DB_PATH)
+        return super().tearDown()
+
+    def test_batching(self):
+        """Test grouping batches of several securities into transactions."""
+        run_id = db.start_run(None, '2025-03-04', [1, 2])
+        with writer.HistoryWriter(run_id, max_rows=3, max_delay=60) as history_writer:
+            history_writer.put([
+                (1, '2025-03-03', 10.0, 11.0, 12.0, 9.0, 10.5, 1000, 1000, '1d'),
+                (1, '2025-03-04', 11.0, 12.0, 13.0, 10.0, 11.5, 2000, 1000, '1d'),
+            ], (1, db.ItemStatus.DONE, 2, None))
+            history_writer.put([
+                (2, '2025-03-03', 9.0, 11.0, 14.0, 8.0, 11.5, 3000, 1000, '1d'),
+            ], (2, db.ItemStatus.DONE, 1, None))
+            history_writer.flush()
+            self.assertEqual(history_writer.transactions, 1)
+            self.assertEqual(db.get_run_todo(run_id), [])
+
+            # pending rows are written on close
+            history_writer.put([
+                (2, '2025-03-04', 9.0, 11.0, 14.0, 8.0, 11.5, 3000, 1000, '1d'),
+            ])
+        self.assertEqual(history_writer.transactions, 2)
+        self.assertEqual(history_writer.rows, 4)
+        self.assertEqual(len(db.get_history('000002')['000002']), 2)
+
+    def test_max_delay(self):
+        """Test committing a transaction after its delay without a flush."""
+        history_writer = writer.HistoryWriter(max_delay=0.01)
+        history_writer.start()
+        history_writer.put([(1, '2025-03-03', 10.0, 11.0, 12.0, 9.0, 10.5, 1000, 1000, '1d')])
+        for _ in range(100):
+            if history_writer.transactions:
+                break
+            time.sleep(0.01)
+        self.assertEqual(history_writer.transactions, 1)
+        history_writer.close()
+
+    def test_max_delay_steady(self):
+        """Test committing after the delay while batches keep arriving."""
+        run_id = db.start_run(None, '2025-03-04', [1, 2])
+        history_writer = writer.HistoryWriter(run_id, max_delay=1.0)
+        # the second batch is queued before the delay of the first one passes
+        history_writer.put([], (1, db.ItemStatus.DONE, 0, None))
+        history_writer.put([], (2, db.ItemStatus.DONE, 0, None))
+        clock = itertools.count()
+        with patch('rock.data.writer.time.monotonic', side_effect=lambda: float(next(clock))):
+            history_writer.start()
+            history_writer.flush()
+        self.assertEqual(history_writer.transactions, 2)
+        history_writer.close()
+
+    def test_error(self):
+        """Test raising an error of the writer thread in the producer."""
+        with patch.object(db, 'write_history', side_effect=db.sqlite3.OperationalError('locked')):
+            history_writer = writer.HistoryWriter()
+            history_writer.start()
+            history_writer.put([(1, '2025-03-03', 10.0, 11.0, 12.0, 9.0, 10.5, 1000, 1000, '1d')])
+            with self.assertRaises(RuntimeError):
+                history_writer.close()
+
@@ -0,0 +1,79 @@
+"""
+Test cases for rock.em.utils module.
+"""
+
+import json
+import unittest
+from unittest.mock import patch
+from rock.em import utils as em_utils
+
+
+class TestEmUtils(unittest.TestCase):
+    """Test cases for rock.em.utils module"""
+
+    def test_parse_quote_history(self) -> None:
+        """Test parse_quote_history function."""
+        payload = json.dumps({
+            'data': {
+                'code': '600000',
+                'name': '浦发银行',
+                'klines': [
+                    '2025-03-03,10.00,10.50,10.80,9.90,1000,1050000.0,9.00,5.00,0.50,0.10',
+                    '2025-03-04,10.50,10.20,10.60,10.10,2000,2040000.0,4.76,-2.86,-0.30,0.20',
+                ]
+            }
+        }).encode('utf-8')
+        df = em_utils.parse_quote_history(payload, '1.600000')
+        self.assertEqual(len(df), 2)
+        self.assertEqual(df['代码'].iloc[0], '600000')
+        self.assertEqual(df['名称'].iloc[0], '浦发银行')
+        self.assertEqual(df['日期'].iloc[1], '2025-03-04')
+        self.assertAlmostEqual(df['收盘'].iloc[0], 10.5)
+        self.assertEqual(df['成交量'].iloc[1], 2000)
+
+        empty = em_utils.parse_quote_history(json.dumps({'data': None}), '1.600000')
+        self.assertTrue(empty.empty)
+        self.assertIn('日期', empty.columns)
+
+    def test_parse_quote_arrays(self) -> None:
+        """Test parse_quote_arrays function."""
+        payload = json.dumps({
+            'data': {
+                'code': '600000',
+                'name': '浦发银行',
+                'klines': [
+                    '2025-03-03,10.00,10.50,10.80,9.90,1000,1050000.0,9.00,5.00,0.50,0.10',
+                    '2025-03-04,10.50,10.20,10.60,10.10,2000,2040000.0,4.76,-2.86,-0.30,0.20',
+                ]
+            }
+        }).encode('utf-8')
+        arrays = em_utils.parse_quote_arrays(payload, '1.600000')
+        self.assertEqual(arrays.code, '600000')
+        self.assertEqual(arrays.name, '浦发银行')
+        self.assertEqual(arrays.datetime.tolist(), ['2025-03-03', '2025-03-04'])
+        self.assertEqual(arrays.close.tolist(), [10.5, 10.2])
+        self.assertEqual(arrays.volume.tolist(), [1000, 2000])
+        self.assertEqual(arrays.change.tolist(), [0.5, -0.3])
+
+        expected = em_utils.parse_quote_history(payload, '1.600000')
+        self.assertEqual(arrays.high.tolist(), expected['最高'].tolist())
+
+        empty = em_utils.parse_quote_arrays(json.dumps({'data': None}), '1.600000')
+        self.assertEqual(len(empty.datetime), 0)
+        self.assertEqual(len(empty.close), 0)
+
+    def test_get_market_snapshot(self) -> None:
+        """Test fetching every page of the market list."""
+        quotes = [{'f12': f'60000{i}', 'f14': f'Stock {i}', 'f17': 10.0, 'f2': 10.5, 'f15': 11.0,
+                   'f16': 9.5, 'f18': 10.0, 'f5': 100, 'f6': 1050.0, 'f124': 1741158000} for i in range(5)]
+        quotes[4].update({'f17': '-', 'f2': '-', 'f15': '-', 'f16': '-'})
+
+        def fetch(page: int, page_size: int) -> tuple[int, list[dict]]:
+            return len(quotes), quotes[(page - 1) * page_size:page * page_size]
+
+        with patch('rock.em.utils.fetch_market_snapshot_page', side_effect=fetch) as mock_fetch:
+            df = em_utils.get_market_snapshot(page_size=2)
+        self.assertEqual(mock_fetch.call_count, 3)
+        self.assertEqual(df['代码'].tolist(), [f'60000{i}' for i in range(5)])
+        self.assertEqual(df['收盘'].iloc[0], 10.5)
+        self.assertTrue(df['收盘'].isna().iloc[4])
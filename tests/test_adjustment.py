@@ -0,0 +1,39 @@
+"""
+Test adjustment.py
+"""
+
+import unittest
+import numpy as np
+from rock import adjustment
+from rock.adjustment import Adjust
+
+
+class TestAdjustment(unittest.TestCase):
+    """Test cases for adjustment.py module"""
+
+    def test_backward_factors(self) -> None:
+        """Test factors of a dividend and a split, continued from a previous bar."""
+        close = np.array([10.0, 10.5, 10.2, 5.3, 5.4])
+        # a dividend of 0.5 goes ex on the third bar and a 2 for 1 split on the fourth
+        change = np.array([0.1, 0.5, 0.2, 0.2, 0.1])
+        factors = adjustment.backward_factors(close, change)
+        np.testing.assert_allclose(factors, [1.0, 1.0, 1.05, 2.1, 2.1])
+        np.testing.assert_allclose(adjustment.backward_factors(close[2:], change[2:], 10.5), factors[2:])
+        np.testing.assert_allclose(adjustment.backward_factors(close[3:], change[3:], 10.2, 1.05), factors[3:])
+        # a rounded change is not an event
+        np.testing.assert_array_equal(adjustment.backward_factors([10.0, 10.33], [0.0, 0.33]), [1.0, 1.0])
+
+    def test_factors(self) -> None:
+        """Test the factors of bars between corporate actions."""
+        days = np.datetime64('2025-03-03') + np.arange(5)
+        events = np.array(['2025-03-05', '2025-03-06'], dtype='datetime64[D]')
+        np.testing.assert_allclose(adjustment.factors(days, events, [1.05, 2.1], Adjust.BACKWARD),
+                                   [1.0, 1.0, 1.05, 2.1, 2.1])
+        np.testing.assert_allclose(adjustment.factors(days, events, [1.05, 2.1], Adjust.FORWARD),
+                                   [1 / 2.1, 1 / 2.1, 0.5, 1.0, 1.0])
+        np.testing.assert_array_equal(adjustment.factors(days, events[:0], [], Adjust.FORWARD), np.ones(5))
+        np.testing.assert_array_equal(adjustment.factors(days, events, [1.05, 2.1], Adjust.NONE), np.ones(5))
+
+
+if __name__ == '__main__':
+    unittest.main()
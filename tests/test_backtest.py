@@ -0,0 +1,116 @@
+"""
+Test backtest.py
+"""
+
+import unittest
+import numpy as np
+from rock import backtest
+from rock.panel import PANEL_FIELDS, Panel
+
+NO_COSTS = backtest.Costs(0.0, 0.0, 0.0)
+
+
+def _panel(open_: list[list[float]], close: list[list[float]], low: list[list[float]] | None = None,
+           symbols: list[str] | None = None, adj_close: list[list[float]] | None = None) -> Panel:
+    fields = {field: np.array(close, dtype=np.float64) for field in PANEL_FIELDS}
+    if adj_close is not None:
+        fields['adj_close'] = np.array(adj_close, dtype=np.float64)
+    fields['open'] = np.array(open_, dtype=np.float64)
+    fields['high'] = np.fmax(fields['open'], fields['close'])
+    fields['low'] = np.fmin(fields['open'], fields['close']) if low is None else np.array(low, dtype=np.float64)
+    return Panel({
+        'name': '',
+        'fields': PANEL_FIELDS,
+        'symbols': symbols or [f'60000{i}' for i in range(len(close))],
+        'dates': (np.datetime64('2025-03-03') + np.arange(len(close[0]))).astype(str).tolist(),
+        'generation': 0,
+        'created': 0,
+    }, data=np.stack([fields[field] for field in PANEL_FIELDS]))
+
+
+def _hold(panel: Panel, **_: object) -> np.ndarray:
+    return np.ones(panel['close'].shape)
+
+
+class TestBacktest(unittest.TestCase):
+    """Test cases for backtest.py module"""
+
+    def test_returns(self) -> None:
+        """Test buying at the next open and holding from close to close."""
+        panel = _panel([[10, 10, 11, 12]], [[10, 11, 12, 12]])
+        result = backtest.backtest(_hold, panel, costs=NO_COSTS)
+        np.testing.assert_array_equal(result.positions, [[[0, 1, 1, 1]]])
+        np.testing.assert_allclose(result.returns, [[[0, 0.1, 12 / 11 - 1, 0]]])
+        np.testing.assert_allclose(result.summary()['total_return'], [0.2])
+
+        costs = backtest.Costs(0.001, 0.002, 0.0)
+        result = backtest.backtest(lambda p: np.array([[1, 0, 0, 0]]), panel, costs=costs)
+        # bought at 10 and sold at 11 on the next open
+        np.testing.assert_allclose(result.returns, [[[0, 0.1 - 0.001, -0.003, 0]]])
+        np.testing.assert_array_equal(result.trades, [2])
+
+    def test_price_limits(self) -> None:
+        """Test that buys are refused at limit-up and sales at limit-down."""
+        # opens at limit-up on the second day
+        panel = _panel([[10, 11, 11.5]], [[10, 11, 11.5]])
+        result = backtest.backtest(_hold, panel, costs=NO_COSTS)
+        np.testing.assert_array_equal(result.positions[0, 0], [0, 0, 1])
+        np.testing.assert_array_equal(result.blocked, [1])
+        # bought on the second day, opens at limit-down on the third
+        panel = _panel([[10, 10, 9, 8.5]], [[10, 10, 9, 8.5]])
+        result = backtest.backtest(lambda p: np.array([[1.0, 0, 0, 0]]), panel, costs=NO_COSTS)
+        np.testing.assert_array_equal(result.positions[0, 0], [0, 1, 1, 0])
+        np.testing.assert_array_equal(result.blocked, [1])
+
+        dates = np.array(['2020-01-02', '2021-01-04'], dtype='datetime64[s]')
+        np.testing.assert_array_equal(backtest.price_limits(['600000', '688001', '300001', '830001'], dates),
+                                      [[0.1, 0.1], [0.2, 0.2], [0.1, 0.2], [0.3, 0.3]])
+
+    def test_stop_loss_t_plus_1(self) -> None:
+        """Test that a stop loss cannot sell shares bought on the same day."""
+        # bought at the open of the second day, which falls 8% intraday
+        panel = _panel([[10, 10, 9.2, 9.5]], [[10, 9.2, 9.3, 9.5]], low=[[10, 9.1, 9.0, 9.4]])
+        result = backtest.backtest(_hold, panel, params={'stop_loss': [0.05, None]}, costs=NO_COSTS)
+        # the signal buys again on the next open
+        np.testing.assert_array_equal(result.positions[0, 0], [0, 1, 0, 1])
+        np.testing.assert_array_equal(result.positions[1, 0], [0, 1, 1, 1])
+        # sold at the open of the third day, below the stop level of 9.5
+        np.testing.assert_allclose(result.returns[0, 0, :3], [0, -0.08, 0])
+        np.testing.assert_array_equal(list(result.summary()['stop_loss'].fillna(0)), [0.05, 0])
+
+    def test_corporate_actions(self) -> None:
+        """Test that a split while holding books no loss and triggers no stop loss."""
+        # 2-for-1 split on the third day, then the price rises 10%
+        panel = _panel([[10, 10, 5, 5.5]], [[10, 10, 5, 5.5]], adj_close=[[10, 10, 10, 11]])
+        result = backtest.backtest(_hold, panel, params={'stop_loss': [None, 0.05]}, costs=NO_COSTS)
+        np.testing.assert_array_equal(result.positions[:, 0], [[0, 1, 1, 1]] * 2)
+        np.testing.assert_allclose(result.returns[:, 0], [[0, 0, 0, 0.1]] * 2)
+        np.testing.assert_array_equal(result.blocked, [0, 0])
+
+        # sold at the open of the ex-date, not refused at a limit-down of the raw close
+        result = backtest.backtest(lambda p: np.array([[1.0, 0, 0, 0]]), panel, costs=NO_COSTS)
+        np.testing.assert_array_equal(result.positions[0, 0], [0, 1, 0, 0])
+        np.testing.assert_allclose(result.returns[0, 0], [0, 0, 0, 0])
+        np.testing.assert_array_equal(result.blocked, [0])
+
+    def test_params(self) -> None:
+        """Test running every combination of parameters in one pass."""
+        rng = np.random.default_rng(0)
+        close = 10 + np.cumsum(rng.normal(0, 0.1, (3, 60)), axis=1)
+        panel = _panel(close.tolist(), close.tolist())
+        result = backtest.backtest('close > sma(close, {n})', panel,
+                                   params={'n': [5, 10, 20], 'stop_loss': [None, 0.03]})
+        self.assertEqual(result.positions.shape, (6, 3, 60))
+        self.assertEqual(result.portfolio.shape, (6, 60))
+        self.assertEqual(list(result.summary()['n']), [5, 5, 10, 10, 20, 20])
+        single = backtest.backtest('close > sma(close, 10)', panel)
+        np.testing.assert_allclose(single.returns[0], result.returns[2])
+        summary = backtest.backtest('close > sma(close, {n})', panel, params={'n': [5, 10, 20]}, detail=False)
+        self.assertIsNone(summary.positions)
+        np.testing.assert_allclose(summary.portfolio, result.portfolio[::2])
+        with self.assertRaises(ValueError):
+            backtest.backtest(lambda p: np.ones(3), panel)
+
+
+if __name__ == '__main__':
+    unittest.main()
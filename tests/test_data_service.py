@@ -1,11 +1,17 @@
 """Test cases for the data_service module."""
 
+import threading
 import unittest
+from types import SimpleNamespace
 from unittest.mock import patch
 import os
+import numpy as np
 import pandas as pd
-from rock import data_service
+from rock import data_service, stock
+from rock.common import utils
 from rock.data import db
+from rock.exchange import exchange_sh
+from rock.exchange.common import ExchangeMeta, ExchangeModule, StockMeta
 
 
 class TestDataService(unittest.TestCase):
@@ -60,21 +66,249 @@ class TestDataService(unittest.TestCase):
                 self.assertGreater(len(result), 0, f"No securities found for exchange {module.METADATA.name}.")
                 cursor.close()
 
-    @patch('rock.data.db.bulk_insert_history')
+    def test_exchange_registry(self):
+        """Test that exchange modules are scanned once and implement the interface."""
+        modules = data_service.get_exchange_modules()
+        self.assertIs(data_service.get_exchange_modules(), modules)
+        self.assertIn(exchange_sh, modules)
+        self.assertTrue(all(isinstance(module, ExchangeModule) for module in modules))
+
+    def test_update_securities_concurrently(self):
+        """Test fetching the listings of all exchanges at once, despite failures."""
+        barrier = threading.Barrier(2, timeout=5)
+
+        def exchange(acronym: str, symbol: str) -> SimpleNamespace:
+            def get_a_shares() -> list[StockMeta]:
+                # both listings are fetched at the same time
+                barrier.wait()
+                if symbol is None:
+                    raise ConnectionError('listing unavailable')
+                return [StockMeta(symbol, f'{acronym} stock', '20200102', None)]
+            return SimpleNamespace(METADATA=ExchangeMeta(f'{acronym} exchange', acronym, 'stock'),
+                                   get_a_shares=get_a_shares, __name__=acronym)
+
+        modules = (exchange('SSE', '600000'), exchange('SZSE', None))
+        with patch('rock.exchange.get_modules', return_value=modules):
+            data_service.init_db()
+            data_service.update_securities()
+        self.assertEqual([security['symbol'] for security in db.get_all_securities()], ['600000'])
+
+    @patch('rock.data.db.write_history')
     @patch('rock.data.db.get_all_securities')
     @patch('rock.data.web_scraper.get_history')
-    def test_update_histories(self, mock_get_history, mock_get_all_securities, mock_bulk_insert_history):
+    def test_update_histories(self, mock_get_history, mock_get_all_securities, mock_write_history):
         """Test the update_histories function."""
         mock_get_history.return_value = {
-            '000001': pd.DataFrame({'datetime': '2025-03-01', 'open': 1, 'close': 2, 'adj_close': 2, 'high': 3,
+            '000001': pd.DataFrame({'datetime': '2025-03-01', 'open': 1, 'close': 2, 'change': 1, 'high': 3,
                                     'low': 0, 'volume': 10, 'amount': 100}, index=[0]),
             '000002':
-                pd.DataFrame({'datetime': '2025-03-01', 'open': 1, 'close': 2, 'adj_close': 2, 'high': 3,
+                pd.DataFrame({'datetime': '2025-03-01', 'open': 1, 'close': 2, 'change': 1, 'high': 3,
                               'low': 0, 'volume': 10, 'amount': 100}, index=[0])
         }
         mock_get_all_securities.return_value = [
             {'symbol': '000001', 'exchange_id': 1, 'id': 1},
             {'symbol': '000002', 'exchange_id': 1, 'id': 2}
         ]
+        mock_write_history.side_effect = lambda history, run_id, items, adjustments=(): (
+            db.mark_run_items(run_id, items) or db.WriteCounts(len(history)))
+        data_service.update_histories()
+        # both securities are written in one transaction with their run results
+        self.assertEqual(mock_write_history.call_count, 1)
+        history, _, results = mock_write_history.call_args.args
+        self.assertEqual(len(history), 2)
+        self.assertEqual([result[0] for result in results], [1, 2])
+
+    @patch('rock.data.web_scraper.get_history')
+    def test_update_histories_resume(self, mock_get_history):
+        """Test resuming an interrupted update_histories run."""
+        db.insert_exchange('Shanghai Stock Exchange', 'SSE', 'stock')
+        db.insert_securities([
+            ('000001', 'Ping An Bank', 'stock', '19910403', None, 1),
+            ('000002', 'Another Company', 'stock', '19910129', None, 1),
+        ])
+        bar = {'datetime': '2025-03-03', 'open': 1.0, 'close': 2.0, 'change': 1.0, 'high': 3.0,
+               'low': 0.5, 'volume': 10, 'amount': 100}
+
+        # 000002 fails to fetch and the run is interrupted before retrying it:
+        # the run stays open and the update date is not written
+        mock_get_history.side_effect = [{'000001': pd.DataFrame(bar, index=[0])}, KeyboardInterrupt()]
+        with self.assertRaises(KeyboardInterrupt):
+            data_service.update_histories()
+        self.assertIsNone(db.get_meta(data_service.DBKeys.HISTORY_UPDATED_AT))
+        run = db.get_unfinished_run()
+        self.assertIsNotNone(run)
+
+        # the resumed run only fetches the failed security
+        mock_get_history.side_effect = None
+        mock_get_history.return_value = {'000002': pd.DataFrame(bar, index=[0])}
+        data_service.update_histories(inc=True)
+        self.assertEqual(mock_get_history.call_args.args[0], ['000002'])
+        self.assertIsNone(mock_get_history.call_args.kwargs['start'])
+        self.assertIsNone(db.get_unfinished_run())
+        self.assertEqual(db.get_meta(data_service.DBKeys.HISTORY_UPDATED_AT), run['as_of'])
+        self.assertEqual(sum(len(h) for h in db.get_history(['000001', '000002']).values()), 2)
+
+    @patch('rock.data.web_scraper.get_history')
+    def test_update_histories_retry(self, mock_get_history):
+        """Test retrying failed securities within a run until they succeed or are given up."""
+        db.insert_exchange('Shanghai Stock Exchange', 'SSE', 'stock')
+        db.insert_securities([
+            ('000001', 'Ping An Bank', 'stock', '19910403', None, 1),
+            ('000002', 'Another Company', 'stock', '19910129', None, 1),
+        ])
+        bar = {'datetime': '2025-03-03', 'open': 1.0, 'close': 2.0, 'change': 1.0, 'high': 3.0,
+               'low': 0.5, 'volume': 10, 'amount': 100}
+        mock_get_history.side_effect = [{'000001': pd.DataFrame(bar, index=[0])}, {},
+                                        {'000002': pd.DataFrame(bar, index=[0])}]
+        data_service.update_histories()
+        self.assertEqual([call.args[0] for call in mock_get_history.call_args_list],
+                         [['000001', '000002'], ['000002'], ['000002']])
+        self.assertIsNone(db.get_unfinished_run())
+        self.assertEqual(sum(len(h) for h in db.get_history(['000001', '000002']).values()), 2)
+
+        # a security failing every attempt does not hold back the others
+        mock_get_history.reset_mock(side_effect=True)
+        mock_get_history.return_value = {'000001': pd.DataFrame(bar, index=[0])}
+        data_service.update_histories(inc=True, snapshot=False)
+        self.assertEqual(mock_get_history.call_count, db.MAX_RUN_ATTEMPTS)
+        self.assertIsNone(db.get_unfinished_run())
+        self.assertEqual(db.get_meta(data_service.DBKeys.HISTORY_UPDATED_AT), utils.get_current_date())
+
+    @patch('rock.data.web_scraper.get_history')
+    def test_update_histories_bootstrap(self, mock_get_history):
+        """Test that the first load of an empty database stays in bootstrap mode until it completes."""
+        db.insert_exchange('Shanghai Stock Exchange', 'SSE', 'stock')
+        db.insert_securities([
+            ('000001', 'Ping An Bank', 'stock', '19910403', None, 1),
+            ('000002', 'Another Company', 'stock', '19910129', None, 1),
+        ])
+        bar = {'datetime': '2025-03-03', 'open': 1.0, 'close': 2.0, 'change': 1.0, 'high': 3.0,
+               'low': 0.5, 'volume': 10, 'amount': 100}
+        mock_get_history.side_effect = [{'000001': pd.DataFrame(bar, index=[0])}, KeyboardInterrupt()]
+        with self.assertRaises(KeyboardInterrupt):
+            data_service.update_histories()
+        self.assertIsNotNone(db.get_meta(db.BOOTSTRAP))
+
+        # the resumed run completes the load and leaves bootstrap mode
+        mock_get_history.side_effect = None
+        mock_get_history.return_value = {'000002': pd.DataFrame(bar, index=[0])}
+        with patch('rock.data.db.end_bootstrap', wraps=db.end_bootstrap) as mock_end_bootstrap:
+            data_service.update_histories(inc=True)
+        mock_end_bootstrap.assert_called_once()
+        self.assertIsNone(db.get_meta(db.BOOTSTRAP))
+        self.assertEqual(self.connection.execute('PRAGMA journal_mode').fetchone()[0], 'delete')
+
+        # later full updates of a loaded database are not bootstrapped
         data_service.update_histories()
-        self.assertEqual(mock_bulk_insert_history.call_count, 2)
+        self.assertIsNone(db.get_meta(db.BOOTSTRAP))
+
+    @patch('rock.data.web_scraper.get_history')
+    def test_update_histories_adjustments(self, mock_get_history):
+        """Test deriving adjustment factors from unadjusted bars, in full and incrementally."""
+        db.insert_exchange('Shanghai Stock Exchange', 'SSE', 'stock')
+        db.insert_securities([('000001', 'Ping An Bank', 'stock', '19910403', None, 1)])
+
+        def bars(days: list[tuple[int, float, float]]) -> pd.DataFrame:
+            return pd.DataFrame({'datetime': [f'2025-03-0{day}' for day, _, _ in days],
+                                 'open': [close for _, close, _ in days], 'close': [close for _, close, _ in days],
+                                 'change': [change for _, _, change in days],
+                                 'high': [close for _, close, _ in days], 'low': [close for _, close, _ in days],
+                                 'volume': 10, 'amount': 100})
+
+        # a dividend of 0.5 goes ex on the 5th: the reference close is 10.0 instead of 10.5
+        mock_get_history.return_value = {'000001': bars([(3, 10.0, 0.1), (4, 10.5, 0.5), (5, 10.2, 0.2),
+                                                         (6, 10.4, 0.2)])}
+        data_service.update_histories(inc=True)
+        self.assertIsNone(mock_get_history.call_args.kwargs['start'])
+        self.assertEqual([tuple(row) for row in db.get_adjustments(['000001'])['000001']],
+                         [(utils.str_to_dt('2025-03-05'), 1.05)])
+        df = stock.get_history(['000001'])['000001']
+        np.testing.assert_allclose(df['adj_close'], [10.0, 10.5, 10.71, 10.92])
+        np.testing.assert_allclose(stock.get_history(['000001'], adjust='forward')['000001']['close'],
+                                   [10.0 / 1.05, 10.5 / 1.05, 10.2, 10.4])
+
+        # a 2 for 1 split on the 7th, fetched incrementally
+        mock_get_history.return_value = {'000001': bars([(7, 5.3, 0.1)])}
+        data_service.update_histories(inc=True, snapshot=False)
+        self.assertIsNotNone(mock_get_history.call_args.kwargs['start'])
+        self.assertEqual([row['factor'] for row in db.get_adjustments(['000001'])['000001']], [1.05, 2.1])
+        np.testing.assert_allclose(stock.get_history(['000001'], adjust='forward')['000001']['close'],
+                                   [10.0 / 2.1, 10.5 / 2.1, 5.1, 5.2, 5.3])
+        np.testing.assert_allclose(stock.get_history(['000001'], adjust='backward')['000001']['close'],
+                                   [10.0, 10.5, 10.71, 10.92, 11.13])
+
+    @patch('rock.data_service.SNAPSHOT_MATCH', 0.5)
+    @patch('rock.data.web_scraper.get_snapshot')
+    @patch('rock.data.web_scraper.get_history')
+    def test_update_histories_snapshot(self, mock_get_history, mock_get_snapshot):
+        """Test taking the bars of the latest day from the market snapshot."""
+        db.insert_exchange('Shanghai Stock Exchange', 'SSE', 'stock')
+        db.insert_securities([
+            ('000001', 'Ping An Bank', 'stock', '19910403', None, 1),
+            ('000002', 'Another Company', 'stock', '19910129', None, 1),
+            ('000003', 'Suspended Company', 'stock', '19910129', None, 1),
+            ('000004', 'New Listing', 'stock', '20250306', None, 1),
+        ])
+        bar = {'datetime': '2025-03-05', 'open': 10.0, 'close': 10.0, 'change': 0.0, 'high': 10.0,
+               'low': 10.0, 'volume': 10, 'amount': 100}
+        mock_get_history.return_value = {symbol: pd.DataFrame(bar, index=[0])
+                                         for symbol in ('000001', '000002', '000003')}
+        mock_get_history.return_value['000004'] = pd.DataFrame()
+        data_service.update_histories()
+
+        # 000001 splits 2 for 1 on the 6th, 000003 is suspended and 000004 is not stored yet
+        mock_get_snapshot.return_value = pd.DataFrame({
+            'symbol': ['000001', '000002', '000003', '000004', '600000'], 'name': '',
+            'datetime': ['2025-03-06', '2025-03-06', '2025-03-05', '2025-03-06', '2025-03-06'],
+            'open': [5.0, 10.0, np.nan, 20.0, 8.0], 'high': [5.2, 10.6, np.nan, 22.0, 8.0],
+            'low': [4.9, 10.0, np.nan, 19.0, 8.0], 'close': [5.1, 10.5, np.nan, 21.0, 8.0],
+            'change': [0.1, 0.5, np.nan, 1.0, 0.0], 'volume': [20, 10, 0, 30, 10],
+            'amount': [200, 100, 0, 300, 100]})
+        mock_get_history.return_value = {'000004': pd.DataFrame(dict(bar, datetime='2025-03-06'), index=[0])}
+        data_service.update_histories(inc=True)
+        self.assertEqual(mock_get_history.call_args.args[0], ['000004'])
+        self.assertIsNone(db.get_unfinished_run())
+        data = stock.get_history(['000001', '000002', '000003', '000004'])
+        self.assertEqual(data['000001']['close'].tolist(), [10.0, 5.1])
+        self.assertEqual(data['000001']['adj_close'].tolist(), [10.0, 10.2])
+        self.assertEqual(data['000002']['close'].tolist(), [10.0, 10.5])
+        self.assertEqual(len(data['000003']), 1)
+        self.assertEqual(len(data['000004']), 1)
+        self.assertEqual([row['factor'] for row in db.get_adjustments(['000001'])['000001']], [2.0])
+
+        # a snapshot not following the stored bars is ignored
+        mock_get_snapshot.return_value = mock_get_snapshot.return_value.assign(datetime='2025-03-10')
+        mock_get_history.return_value = {}
+        data_service.update_histories(inc=True)
+        self.assertEqual(mock_get_history.call_args.args[0], ['000001', '000002', '000003', '000004'])
+
+    def test_update_indicators(self):
+        """Test advancing stored indicators over new bars only."""
+        db.insert_exchange('Shanghai Stock Exchange', 'SSE', 'stock')
+        db.insert_securities([
+            ('000001', 'Ping An Bank', 'stock', '19910403', None, 1),
+            ('000002', 'Another Company', 'stock', '19910129', None, 1),
+        ])
+        db.bulk_insert_history([
+            (1, f'2025-03-0{day}', close, close, close + 1, close - 1, close, 10, 100, '1d')
+            for day, close in ((3, 10.0), (4, 12.0), (5, 14.0))
+        ] + [(2, '2025-03-05', 20.0, 20.0, 21.0, 19.0, 20.0, 10, 100, '1d')])
+
+        data_service.update_indicators(['sma_2', 'rsi_2'])
+        df = stock.get_history(['000001'], indicators=['sma_2'])['000001']
+        self.assertTrue(np.isnan(df['sma_2'].iloc[0]))
+        self.assertEqual(df['sma_2'].tolist()[1:], [11.0, 13.0])
+        self.assertEqual(db.get_indicator_states('sma_2')[2]['datetime'].day, 5)
+
+        db.bulk_insert_history([(1, '2025-03-06', 8.0, 8.0, 9.0, 7.0, 8.0, 10, 100, '1d'),
+                                (2, '2025-03-06', 22.0, 22.0, 23.0, 21.0, 22.0, 10, 100, '1d')])
+        with patch('rock.data.db.iter_history', wraps=db.iter_history) as mock_iter_history:
+            data_service.update_indicators(['sma_2', 'rsi_2'])
+        # only bars after the stored states are read
+        self.assertEqual(mock_iter_history.call_args.args[1], '2025-03-05T00:00:00')
+        data = stock.get_history(['000001', '000002'], indicators=['sma_2', 'rsi_2'])
+        self.assertEqual(data['000001']['sma_2'].iloc[-1], 11.0)
+        self.assertEqual(data['000002']['sma_2'].tolist()[-1], 21.0)
+        rebuilt = data_service.indicators.compute(
+            data_service.indicators.parse_spec('rsi_2'), {'close': np.array([[10.0, 12.0, 14.0, 8.0]])})[0]
+        self.assertAlmostEqual(data['000001']['rsi_2'].iloc[-1], rebuilt['rsi_2'][0, -1])
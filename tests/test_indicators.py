@@ -0,0 +1,107 @@
+"""
+Test indicators.py
+"""
+
+import unittest
+import numpy as np
+import pandas as pd
+from rock import indicators
+
+
+def _reference(values: np.ndarray, compute) -> np.ndarray:
+    """Apply a pandas computation to the bars of each symbol and put it back in place."""
+    result = np.full(values.shape, np.nan)
+    for i, row in enumerate(values):
+        series = pd.Series(row).dropna()
+        result[i, series.index] = compute(series).to_numpy()
+    return result
+
+
+def _wilder(series: pd.Series, n: int) -> pd.Series:
+    return series.ewm(alpha=1 / n, adjust=False, min_periods=n).mean()
+
+
+class TestIndicators(unittest.TestCase):
+    """Test cases for indicators.py module"""
+
+    def setUp(self) -> None:
+        rng = np.random.default_rng(0)
+        self.close = 10 + np.cumsum(rng.normal(0, 0.2, (5, 120)), axis=1)
+        self.high = self.close + rng.uniform(0, 0.5, self.close.shape)
+        self.low = self.close - rng.uniform(0, 0.5, self.close.shape)
+        # a symbol listed late, one suspended for a while and one without bars
+        for array in (self.close, self.high, self.low):
+            array[1, :40] = np.nan
+            array[2, 50:65] = np.nan
+            array[3, :] = np.nan
+
+    def test_sma_and_bollinger(self) -> None:
+        """Test moving windows against pandas."""
+        np.testing.assert_allclose(indicators.sma(self.close, 20).value,
+                                   _reference(self.close, lambda s: s.rolling(20).mean()))
+        bands = indicators.bollinger(self.close, 20, 2.0)
+        std = _reference(self.close, lambda s: s.rolling(20).std(ddof=0))
+        np.testing.assert_allclose(bands.upper, bands.middle + 2 * std)
+        np.testing.assert_allclose(bands.lower, bands.middle - 2 * std)
+
+    def test_ema_and_macd(self) -> None:
+        """Test exponential averages against pandas."""
+        def ewm(s: pd.Series, n: int) -> pd.Series:
+            return s.ewm(span=n, adjust=False, min_periods=n).mean()
+        np.testing.assert_allclose(indicators.ema(self.close, 10).value,
+                                   _reference(self.close, lambda s: ewm(s, 10)))
+        result = indicators.macd(self.close)
+        line = _reference(self.close, lambda s: ewm(s, 12) - ewm(s, 26))
+        np.testing.assert_allclose(result.macd, line)
+        np.testing.assert_allclose(result.signal, _reference(line, lambda s: ewm(s, 9)))
+
+    def test_rsi_and_atr(self) -> None:
+        """Test Wilder's indicators against pandas."""
+        def rsi(s: pd.Series) -> pd.Series:
+            change = s.diff()
+            gain, loss = _wilder(change.clip(lower=0), 14), _wilder(-change.clip(upper=0), 14)
+            return 100 * gain / (gain + loss)
+        np.testing.assert_allclose(indicators.rsi(self.close).value, _reference(self.close, rsi))
+
+        expected = np.full(self.close.shape, np.nan)
+        for i in range(len(self.close)):
+            df = pd.DataFrame({'h': self.high[i], 'l': self.low[i], 'c': self.close[i]}).dropna()
+            previous = df['c'].shift()
+            tr = pd.concat([df['h'] - df['l'], (df['h'] - previous).abs(),
+                            (df['l'] - previous).abs()], axis=1).max(axis=1)
+            expected[i, df.index] = _wilder(tr, 14).to_numpy()
+        np.testing.assert_allclose(indicators.atr(self.high, self.low, self.close).value, expected)
+
+    def test_incremental(self) -> None:
+        """Test that continuing from a state gives the values of a full computation."""
+        cases = {
+            'sma': lambda x, s=None: indicators.sma(x[0], 20, state=s),
+            'ema': lambda x, s=None: indicators.ema(x[0], 20, state=s),
+            'rsi': lambda x, s=None: indicators.rsi(x[0], state=s),
+            'atr': lambda x, s=None: indicators.atr(x[1], x[2], x[0], state=s),
+            'macd': lambda x, s=None: indicators.macd(x[0], state=s),
+            'bollinger': lambda x, s=None: indicators.bollinger(x[0], state=s),
+        }
+        arrays = (self.close, self.high, self.low)
+        for name, compute in cases.items():
+            with self.subTest(name):
+                full = compute(arrays)
+                state = None
+                parts = []
+                for start, end in ((0, 45), (45, 46), (46, 58), (58, 120)):
+                    result = compute([a[:, start:end] for a in arrays], state)
+                    state = result.state
+                    parts.append(result[0])
+                np.testing.assert_allclose(np.concatenate(parts, axis=1), full[0])
+
+    def test_single_series(self) -> None:
+        """Test a single series and short histories."""
+        result = indicators.sma(np.array([1.0, 2.0, 3.0]), 2)
+        np.testing.assert_allclose(result.value, [np.nan, 1.5, 2.5])
+        result = indicators.sma(np.array([4.0]), 2, state=result.state)
+        np.testing.assert_allclose(result.value, [3.5])
+        self.assertEqual(indicators.rsi(np.full(20, 5.0)).value[-1], 50.0)
+
+
+if __name__ == '__main__':
+    unittest.main()
@@ -0,0 +1,86 @@
+"""Test cases for the metrics module."""
+
+import json
+import os
+import tempfile
+import unittest
+from rock import metrics
+from rock.data import db
+
+
+class TestMetrics(unittest.TestCase):
+    """Test cases for metrics module"""
+
+    def setUp(self):
+        self.registry = metrics.Registry()
+        return super().setUp()
+
+    def test_counter(self):
+        """Test counter values and rendering."""
+        counter = self.registry.counter('test_total', 'Test counter.', ('host',))
+        counter.inc(host='a')
+        counter.inc(2, host='a')
+        counter.inc(host='b')
+        self.assertEqual(counter.value(host='a'), 3)
+        self.assertEqual(counter.value(host='c'), 0)
+        with self.assertRaises(ValueError):
+            counter.inc(other='a')
+
+        text = self.registry.render_prometheus()
+        self.assertIn('# TYPE test_total counter', text)
+        self.assertIn('test_total{host="a"} 3', text)
+        self.assertIn('test_total{host="b"} 1', text)
+
+    def test_histogram(self):
+        """Test histogram buckets, summary and rendering."""
+        histogram = self.registry.histogram('test_seconds', 'Test histogram.', ('op',),
+                                            buckets=(0.1, 1.0))
+        for value in (0.05, 0.5, 0.5, 5.0):
+            histogram.observe(value, op='read')
+        with histogram.time(op='write'):
+            pass
+
+        self.assertEqual(histogram.count(op='read'), 4)
+        text = self.registry.render_prometheus()
+        self.assertIn('test_seconds_bucket{op="read",le="0.1"} 1', text)
+        self.assertIn('test_seconds_bucket{op="read",le="1"} 3', text)
+        self.assertIn('test_seconds_bucket{op="read",le="+Inf"} 4', text)
+        self.assertIn('test_seconds_count{op="read"} 4', text)
+
+        summary = self.registry.summary()['test_seconds']
+        read = next(s for s in summary['samples'] if s['labels'] == {'op': 'read'})
+        self.assertEqual(read['count'], 4)
+        self.assertAlmostEqual(read['sum'], 6.05)
+        self.assertEqual(read['max'], 5.0)
+        self.assertEqual(read['p50'], 1.0)
+
+    def test_rates(self):
+        """Test the history write rate of rows written through the history writer's path."""
+        metrics.REGISTRY.reset()
+        self.addCleanup(metrics.REGISTRY.reset)
+        db.create_db()
+        self.addCleanup(os.remove, db.DB_PATH)
+        db.insert_exchange('Shanghai Stock Exchange', 'SSE', 'stock')
+        db.insert_securities([('000001', 'Ping An Bank', 'stock', '19910403', None, 1)])
+        db.write_history([(1, '2025-03-03', 10.0, 11.0, 12.0, 9.0, 10.5, 1000, 1000, '1d')])
+        seconds = metrics.DB_SECONDS.summary()
+        seconds = next(s['sum'] for s in seconds if s['labels']['operation'] == 'write_history')
+        self.assertAlmostEqual(metrics.rates()['history_rows_per_second'], 1 / seconds)
+
+    def test_duplicate_metric(self):
+        """Test registering a metric twice."""
+        self.registry.counter('dup_total', 'Duplicate.')
+        with self.assertRaises(ValueError):
+            self.registry.counter('dup_total', 'Duplicate.')
+
+    def test_export(self):
+        """Test exporting the summary and the textfile."""
+        metrics.DB_ROWS_WRITTEN.inc(10, table='history')
+        with tempfile.TemporaryDirectory() as tmp:
+            json_path = os.path.join(tmp, 'metrics.json')
+            textfile = os.path.join(tmp, 'rock.prom')
+            summary = metrics.export(json_path, textfile)
+            with open(json_path, encoding='utf-8') as f:
+                self.assertEqual(json.load(f)['rates'], summary['rates'])
+            with open(textfile, encoding='utf-8') as f:
+                self.assertIn('rock_db_rows_written_total{table="history"}', f.read())
@@ -0,0 +1,91 @@
+"""
+Test panel.py
+"""
+
+import os
+import subprocess
+import sys
+import unittest
+import numpy as np
+from rock import panel
+from rock.data import db
+
+NAME = 'test-panel'
+
+
+class TestPanel(unittest.TestCase):
+    """Test cases for panel.py module"""
+
+    def setUp(self) -> None:
+        db.create_db()
+        db.insert_exchange('Shanghai Stock Exchange', 'SSE', 'stock')
+        db.insert_securities([
+            ('000001', 'Ping An Bank', 'stock', '19910403', None, 1),
+            ('000002', 'Another Company', 'stock', '19910129', None, 1),
+            ('000003', 'No History', 'stock', '19910129', None, 1),
+        ])
+        db.bulk_insert_history([
+            (1, '2025-03-03', 10.0, 11.0, 12.0, 9.0, 10.5, 1000, 1000, '1d'),
+            (1, '2025-03-04', 11.0, 12.0, 13.0, 10.0, 11.5, 2000, 1000, '1d'),
+            (2, '2025-03-04', 20.0, 21.0, 22.0, 19.0, 20.5, 3000, 1000, '1d'),
+            (2, '2025-03-04 09:31', 20.0, 21.0, 22.0, 19.0, 20.5, 10, 10, '1m'),
+        ])
+
+    def tearDown(self) -> None:
+        panel.unpublish_panel(NAME)
+        if os.path.exists(db.DB_PATH):
+            os.remove(db.DB_PATH)
+
+    def test_publish_and_attach(self) -> None:
+        """Test publishing a panel and attaching to it."""
+        manifest = panel.publish_panel(NAME)
+        self.assertEqual(manifest['symbols'], ['000001', '000002'])
+        self.assertEqual(manifest['shape'], (len(panel.PANEL_FIELDS), 2, 2))
+
+        with panel.attach_panel(NAME) as attached:
+            close = attached['close']
+            self.assertFalse(close.flags.writeable)
+            np.testing.assert_array_equal(close, [[11.0, 12.0], [np.nan, 21.0]])
+            self.assertEqual(attached['volume'][attached.index('000002'), 1], 3000)
+            self.assertEqual(str(attached.dates[1]), '2025-03-04T00:00:00')
+            self.assertEqual(attached.frame('open').loc['2025-03-03', '000001'], 10.0)
+            self.assertFalse(attached.stale)
+            del close
+
+    def test_attach_from_another_process(self) -> None:
+        """Test attaching from another process, which leaves the panel published."""
+        panel.publish_panel(NAME)
+        code = (f"from rock import panel\n"
+                f"with panel.attach_panel({NAME!r}) as p:\n"
+                f"    print(float(p['close'][0, 1]))\n")
+        for _ in range(2):
+            output = subprocess.run([sys.executable, '-c', code], capture_output=True,
+                                    text=True, check=True).stdout
+            self.assertEqual(output.strip(), '12.0')
+
+    def test_publish_again(self) -> None:
+        """Test that publishing again keeps attached readers working."""
+        panel.publish_panel(NAME)
+        with panel.attach_panel(NAME) as old:
+            db.bulk_insert_history([(1, '2025-03-05', 12.0, 13.0, 14.0, 11.0, 12.5, 3000, 1000, '1d')])
+            panel.publish_panel(NAME)
+            self.assertTrue(old.stale)
+            self.assertEqual(old['close'].shape, (2, 2))
+            with panel.attach_panel(NAME) as new:
+                self.assertEqual(new['close'].shape, (2, 3))
+                self.assertNotEqual(new.segment_name, old.segment_name)
+
+    def test_build_panel(self) -> None:
+        """Test building a panel of some symbols in private memory."""
+        built = panel.build_panel(['000002'], start='2025-03-04', fields=('close',))
+        self.assertEqual(built.symbols, ['000002'])
+        np.testing.assert_array_equal(built.data, [[[21.0]]])
+
+    def test_attach_missing(self) -> None:
+        """Test attaching to a panel which is not published."""
+        with self.assertRaises(FileNotFoundError):
+            panel.attach_panel(NAME)
+
+
+if __name__ == '__main__':
+    unittest.main()
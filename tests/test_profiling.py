@@ -0,0 +1,49 @@
+"""Test cases for the profiling module."""
+
+import os
+import tempfile
+import time
+import unittest
+from rock import profiling
+
+
+class TestProfiling(unittest.TestCase):
+    """Test cases for profiling module"""
+
+    def setUp(self):
+        profiling.TRACER.reset()
+        return super().setUp()
+
+    def test_spans(self):
+        """Test stage and span aggregation."""
+        with profiling.stage('update'):
+            for symbol, seconds in (('000001', 0.02), ('000002', 0.0), ('000001', 0.01)):
+                with profiling.span('fetch', symbol):
+                    time.sleep(seconds)
+
+        report = profiling.TRACER.report(slowest=1)
+        self.assertEqual(report['stages']['update']['count'], 1)
+        self.assertEqual(report['stages']['fetch']['count'], 3)
+        self.assertGreaterEqual(report['stages']['update']['wall'], report['stages']['fetch']['wall'])
+        self.assertEqual(len(report['slowest_symbols']), 1)
+        self.assertEqual(report['slowest_symbols'][0]['symbol'], '000001')
+        self.assertGreaterEqual(report['slowest_symbols'][0]['wall'], 0.03)
+        self.assertIn('fetch', profiling.TRACER.format_report())
+
+    def test_sampling_profiler(self):
+        """Test the sampling profiler report."""
+        profiler = profiling.SamplingProfiler(interval=0.001)
+        profiler.start()
+        deadline = time.perf_counter() + 0.1
+        while time.perf_counter() < deadline:
+            pass
+        profiler.stop()
+
+        self.assertGreater(profiler.samples, 0)
+        with tempfile.TemporaryDirectory() as tmp:
+            path = os.path.join(tmp, 'profile.txt')
+            profiler.write(path)
+            with open(path, encoding='utf-8') as f:
+                lines = f.read().splitlines()
+        self.assertTrue(any('test_sampling_profiler' in line for line in lines))
+        self.assertTrue(all(line.rsplit(' ', 1)[1].isdigit() for line in lines))
@@ -0,0 +1,108 @@
+"""
+Test realtime.py
+"""
+
+import asyncio
+import os
+import unittest
+from unittest.mock import patch
+import numpy as np
+import pandas as pd
+from rock import realtime, stock
+from rock.data import db
+
+# 2025-03-03 09:30:00 in China
+OPEN = 1740965400
+
+
+def _snapshot(ticks: list[tuple[str, int, float, float]]) -> pd.DataFrame:
+    return pd.DataFrame({
+        'symbol': [symbol for symbol, _, _, _ in ticks],
+        'timestamp': [timestamp for _, timestamp, _, _ in ticks],
+        'close': [price for _, _, price, _ in ticks],
+        'volume': [volume for _, _, _, volume in ticks],
+        'amount': [volume * 10 for _, _, _, volume in ticks],
+    })
+
+
+class TestTickBuffer(unittest.TestCase):
+    """Test cases for the ring buffers of ticks"""
+
+    def test_ring(self) -> None:
+        """Test that appending overwrites the oldest ticks and windows stay in time order."""
+        buffer = realtime.TickBuffer(capacity=3)
+        self.assertIsNone(buffer.latest('600000'))
+        for i in range(5):
+            buffer.append('600000', realtime.Tick(OPEN + i, 10.0 + i, 100.0 * i, 1000.0 * i))
+        # stale and missing prices are skipped
+        self.assertEqual(buffer.extend(['600000', '600001'], [OPEN + 4, OPEN], [15.0, np.nan], [0, 0], [0, 0]), 0)
+        self.assertEqual(buffer.latest('600000'), realtime.Tick(OPEN + 4, 14.0, 400.0, 4000.0))
+        self.assertEqual(buffer.window('600000')['price'].tolist(), [12.0, 13.0, 14.0])
+        self.assertEqual(buffer.window('600000', count=2)['time'].tolist(), [OPEN + 3, OPEN + 4])
+        self.assertEqual(buffer.window('600000', seconds=1.5)['price'].tolist(), [13.0, 14.0])
+        self.assertTrue(buffer.window('600001').empty)
+        self.assertTrue(buffer.window('000000').empty)
+        self.assertEqual(len(buffer), 2)
+
+    def test_minute_bars(self) -> None:
+        """Test consolidating ticks into minute bars labelled by their end."""
+        buffer = realtime.TickBuffer(capacity=10)
+        for timestamp, prices, volumes in ((OPEN + 3, [10.0, 20.0], [100, 50]),
+                                           (OPEN + 30, [10.5, 20.0], [150, 50]),
+                                           (OPEN + 50, [9.8, np.nan], [400, 50]),
+                                           (OPEN + 70, [10.1, 21.0], [500, 80])):
+            buffer.extend(['600000', '600001'], [timestamp] * 2, prices, volumes, np.array(volumes) * 10)
+        minute = realtime._minute(OPEN)  # pylint: disable=protected-access
+        bars = buffer.minute_bars(minute, minute + 2)
+        self.assertEqual(bars['symbol'].tolist(), ['600000', '600000', '600001', '600001'])
+        self.assertEqual(bars['datetime'].tolist(), ['2025-03-03 09:31:00', '2025-03-03 09:32:00'] * 2)
+        self.assertEqual(bars.iloc[0][['open', 'high', 'low', 'close', 'volume']].tolist(),
+                         [10.0, 10.5, 9.8, 9.8, 300.0])
+        self.assertEqual(bars.iloc[1][['open', 'close', 'volume', 'amount']].tolist(), [10.1, 10.1, 100.0, 1000.0])
+        self.assertEqual(bars.iloc[3][['close', 'volume']].tolist(), [21.0, 30.0])
+        self.assertTrue(buffer.minute_bars(minute + 2, minute + 3).empty)
+
+
+class TestPoller(unittest.TestCase):
+    """Test cases for polling the market and flushing minute bars"""
+
+    def setUp(self) -> None:
+        db.create_db()
+        db.insert_exchange('Shanghai Stock Exchange', 'SSE', 'stock')
+        db.insert_securities([('600000', 'Pudong Development Bank', 'stock', '19991110', None, 1)])
+
+    def tearDown(self) -> None:
+        if os.path.exists(db.DB_PATH):
+            os.remove(db.DB_PATH)
+
+    @patch('rock.realtime.time.time')
+    @patch('rock.data.web_scraper.get_snapshot')
+    def test_flush(self, mock_get_snapshot, mock_time) -> None:
+        """Test that only completed minutes after the first poll are flushed."""
+        poller = realtime.Poller(interval=0, flush_interval=0)
+        for now, price, volume in ((OPEN - 10, 10.0, 100), (OPEN + 5, 10.2, 200), (OPEN + 40, 10.4, 260),
+                                   (OPEN + 65, 10.3, 300)):
+            mock_time.return_value = now
+            mock_get_snapshot.return_value = _snapshot([('600000', now, price, volume), ('900000', now, 1.0, 1)])
+            poller.poll()
+        self.assertEqual(poller.flush(OPEN + 65), 1)
+        self.assertEqual(poller.flush(OPEN + 70), 0)
+        self.assertEqual(db.get_history(['600000'])['600000'], [])
+        bars = db.get_history(['600000'], frequency='1m')['600000']
+        self.assertEqual(len(bars), 1)
+        self.assertEqual(str(bars[0]['datetime']), '2025-03-03 09:31:00')
+        self.assertEqual((bars[0]['open'], bars[0]['close'], bars[0]['volume']), (10.2, 10.4, 160))
+
+    @patch('rock.data.web_scraper.get_snapshot')
+    def test_run(self, mock_get_snapshot) -> None:
+        """Test that failed polls do not stop the poller."""
+        mock_get_snapshot.side_effect = [ConnectionError('down'), _snapshot([('600000', OPEN, 10.0, 100)])] * 10
+        poller = realtime.Poller(interval=0.01, flush_interval=0.05)
+        asyncio.run(poller.run(duration=0.1))
+        self.assertGreater(mock_get_snapshot.call_count, 2)
+        self.assertEqual(poller.buffer.latest('600000').price, 10.0)
+        self.assertEqual(len(stock.get_history(['600000'])), 0)
+
+
+if __name__ == '__main__':
+    unittest.main()
@@ -0,0 +1,144 @@
+"""
+Test retry.py
+"""
+
+import unittest
+from unittest.mock import patch
+import requests
+from rock import metrics, retry
+
+URL = 'http://retry.test/api'
+
+
+def _response(status: int) -> requests.Response:
+    response = requests.Response()
+    response.status_code = status
+    response.url = URL
+    return response
+
+
+class TestRetry(unittest.TestCase):
+    """Test cases for retry.py module"""
+
+    def setUp(self) -> None:
+        retry.reset()
+        metrics.REGISTRY.reset()
+        patcher = patch('time.sleep')
+        self.sleep = patcher.start()
+        self.addCleanup(patcher.stop)
+        return super().setUp()
+
+    def test_backoff(self) -> None:
+        """Test that delays grow exponentially up to a cap, with full jitter."""
+        policy = retry.Policy(backoff=0.5, max_backoff=3.0)
+        for attempt, bound in enumerate((0.5, 1.0, 2.0, 3.0, 3.0)):
+            delays = [policy.delay(attempt) for _ in range(200)]
+            self.assertTrue(all(0 <= delay <= bound for delay in delays))
+            self.assertGreater(max(delays), bound / 2)
+
+    def test_request(self) -> None:
+        """Test retrying server errors and timeouts but not client errors."""
+        policy = retry.Policy(tries=3, connect_timeout=2.0, read_timeout=5.0)
+        responses = iter([requests.Timeout('slow'), _response(503), _response(200)])
+        timeouts = []
+
+        def send(timeout: tuple[float, float]) -> requests.Response:
+            timeouts.append(timeout)
+            result = next(responses)
+            if isinstance(result, Exception):
+                raise result
+            return result
+
+        self.assertEqual(retry.request(URL, send, policy).status_code, 200)
+        self.assertEqual(timeouts, [(2.0, 5.0)] * 3)
+        self.assertEqual(self.sleep.call_count, 2)
+        self.assertEqual(metrics.HTTP_RETRIES.value(host='retry.test'), 2)
+
+        sent = []
+        with self.assertRaises(requests.HTTPError):
+            retry.request(URL, lambda timeout: sent.append(timeout) or _response(404), policy)
+        self.assertEqual(len(sent), 1)
+
+        sent.clear()
+        with self.assertRaises(requests.HTTPError):
+            retry.request(URL, lambda timeout: sent.append(timeout) or _response(500), policy)
+        self.assertEqual(len(sent), 3)
+
+    def test_deadline(self) -> None:
+        """Test giving up when the next try would start after the deadline."""
+        policy = retry.Policy(tries=10, deadline=1.0, backoff=2.0, max_backoff=2.0)
+        sent = []
+        with patch('random.uniform', return_value=2.0):
+            with self.assertRaises(requests.HTTPError):
+                retry.request(URL, lambda timeout: sent.append(timeout) or _response(502), policy)
+        self.assertEqual(len(sent), 1)
+        self.assertLessEqual(sent[0][1], 1.0)
+        self.sleep.assert_not_called()
+
+    def test_circuit_breaker(self) -> None:
+        """Test opening a circuit after consecutive failures and closing it after a trial."""
+        now = [0.0]
+        breaker = retry.CircuitBreaker(failures=3, cooldown=10.0, clock=lambda: now[0])
+        breaker.failure()
+        breaker.failure()
+        breaker.success()
+        breaker.failure()
+        breaker.failure()
+        self.assertEqual(breaker.state, retry.State.CLOSED)
+        breaker.failure()
+        self.assertEqual(breaker.state, retry.State.OPEN)
+        self.assertFalse(breaker.allow())
+
+        now[0] = 10.0
+        self.assertTrue(breaker.allow())
+        # a single trial is sent
+        self.assertFalse(breaker.allow())
+        breaker.failure()
+        self.assertEqual(breaker.state, retry.State.OPEN)
+        now[0] = 20.0
+        self.assertTrue(breaker.allow())
+        breaker.success()
+        self.assertEqual(breaker.state, retry.State.CLOSED)
+        self.assertTrue(breaker.allow())
+
+    def test_open_circuit(self) -> None:
+        """Test waiting for the trial of an open circuit unless the deadline comes first."""
+        self.now = 0.0
+
+        def sleep(seconds: float) -> None:
+            self.now += seconds
+
+        self.sleep.side_effect = sleep
+        breaker = retry.CircuitBreaker(failures=2, cooldown=30.0, clock=lambda: self.now)
+        with (patch.dict(retry._breakers, {'retry.test': breaker}),  # pylint: disable=protected-access
+              patch('rock.retry.time.monotonic', side_effect=lambda: self.now)):
+            sent = []
+            with self.assertRaises(retry.CircuitOpenError):
+                retry.request(URL, lambda timeout: sent.append(timeout) or _response(503),
+                              retry.Policy(tries=5, deadline=10.0))
+            self.assertEqual(len(sent), 2)
+            self.assertEqual(metrics.HTTP_CIRCUIT_REJECTIONS.value(host='retry.test'), 1)
+
+            # the cooldown ends before the deadline: the request waits and is the trial
+            self.assertEqual(retry.request(URL, lambda timeout: _response(200),
+                                           retry.Policy(deadline=60.0)).status_code, 200)
+            self.assertGreaterEqual(self.now, 30.0)
+            self.assertEqual(breaker.state, retry.State.CLOSED)
+
+            # a trial ending with an unexpected error frees the trial for the next request
+            breaker.failure()
+            breaker.failure()
+            self.now += 30.0
+
+            def fail(timeout: tuple[float, float]) -> requests.Response:
+                raise ValueError('unexpected')
+
+            with self.assertRaises(ValueError):
+                retry.request(URL, fail)
+            self.assertEqual(breaker.state, retry.State.OPEN)
+            self.assertEqual(retry.request(URL, lambda timeout: _response(200)).status_code, 200)
+            self.assertEqual(breaker.state, retry.State.CLOSED)
+
+
+if __name__ == '__main__':
+    unittest.main()
@@ -0,0 +1,101 @@
+"""
+Test screen.py
+"""
+
+import os
+import unittest
+from unittest.mock import patch
+import numpy as np
+from rock import screen
+from rock.data import db
+from rock.panel import PANEL_FIELDS, Panel
+
+
+def _panel(close: list[list[float]], volume: list[list[float]]) -> Panel:
+    close_array = np.array(close, dtype=np.float64)
+    fields = {field: close_array for field in PANEL_FIELDS}
+    fields['high'] = close_array + 0.5
+    fields['volume'] = np.array(volume, dtype=np.float64)
+    return Panel({
+        'name': '',
+        'fields': PANEL_FIELDS,
+        'symbols': [f'00000{i + 1}' for i in range(len(close))],
+        'dates': [f'2025-03-{day:02d}' for day in range(3, 3 + close_array.shape[1])],
+        'generation': 0,
+        'created': 0,
+    }, data=np.stack([fields[field] for field in PANEL_FIELDS]))
+
+
+class TestScreen(unittest.TestCase):
+    """Test cases for screen.py module"""
+
+    def test_parse(self) -> None:
+        """Test parsing expressions, their lookback and their pushed down conditions."""
+        expression = screen.parse('close > ref(highest(high, 20), 1) and volume > 3 * sma(volume, 50) '
+                                  'and 5 < close')
+        self.assertEqual(expression.fields, ('close', 'high', 'volume'))
+        self.assertEqual(expression.lookback, 49)
+        self.assertEqual(expression.conditions, (('close', '>', 5.0),))
+        self.assertEqual(screen.parse('close > 5 or volume > 1').conditions, ())
+        for text in ('__import__("os")', 'close.real', 'sma(close)', 'sma(close, 0)', 'foo > 1',
+                     'close > "a"', 'sma(close, n=3)', 'close if volume else open', 'close >'):
+            with self.subTest(text), self.assertRaises(ValueError):
+                screen.parse(text)
+
+    def test_evaluate(self) -> None:
+        """Test windows skipping missing bars."""
+        panel = _panel([[1, 2, 3, 4, 5], [1, np.nan, 3, 5, 7]], [[1] * 5, [1] * 5])
+        np.testing.assert_array_equal(screen.evaluate('highest(close, 2) - ref(close, 1)', panel),
+                                      [[np.nan, 1, 1, 1, 1], [np.nan, np.nan, 2, 2, 2]])
+        np.testing.assert_array_equal(screen.evaluate('close >= 3', panel),
+                                      [[False, False, True, True, True], [False, False, True, True, True]])
+
+    def test_screen_panel(self) -> None:
+        """Test screening a panel for breakouts on high volume."""
+        panel = _panel([[10, 11, 10, 12, 11], [10, 10, 10, 10, 13]],
+                       [[100, 100, 100, 500, 100], [100, 100, 100, 100, 500]])
+        expression = 'close > ref(highest(high, 2), 1) and volume > 2 * sma(volume, 3)'
+        result = screen.screen(expression, start='2025-03-01', panel=panel)
+        self.assertEqual(list(result['symbol']), ['000001', '000002'])
+        self.assertEqual([str(d.date()) for d in result['datetime']], ['2025-03-06', '2025-03-07'])
+        # only the last date by default
+        self.assertEqual(list(screen.screen(expression, panel=panel)['symbol']), ['000002'])
+        with self.assertRaises(ValueError):
+            screen.screen('close + 1', panel=panel)
+
+
+class TestScreenDatabase(unittest.TestCase):
+    """Test cases for screening the database"""
+
+    def setUp(self) -> None:
+        db.create_db()
+        db.insert_exchange('Shanghai Stock Exchange', 'SSE', 'stock')
+        db.insert_securities([
+            ('000001', 'Ping An Bank', 'stock', '19910403', None, 1),
+            ('000002', 'Another Company', 'stock', '19910129', None, 1),
+        ])
+        db.bulk_insert_history([
+            (security_id, f'2025-03-0{day}', close, close, close, close, close, 10, 100, '1d')
+            for security_id, base in ((1, 10.0), (2, 20.0))
+            for day, close in ((3, base), (4, base + 1), (5, base + 2))
+        ])
+
+    def tearDown(self) -> None:
+        if os.path.exists(db.DB_PATH):
+            os.remove(db.DB_PATH)
+
+    def test_screen(self) -> None:
+        """Test screening the database with a condition pushed down into SQL."""
+        self.assertEqual(db.find_symbols([('close', '>', 21.5)], start='2025-03-01', end='2025-03-31'),
+                         ['000002'])
+        with patch('rock.screen.build_panel', wraps=screen.build_panel) as mock_build_panel:
+            result = screen.screen('close > ref(close, 1) and close > 21.5', end='2025-03-05')
+        self.assertEqual(mock_build_panel.call_args.args[0], ['000002'])
+        self.assertEqual(list(result['symbol']), ['000002'])
+        result = screen.screen('close > ref(close, 1)', start='2025-03-01', end='2025-03-04')
+        self.assertEqual(len(result), 2)
+        self.assertEqual(len(screen.screen('close > 100', end='2025-03-05')), 0)
+
+
+if __name__ == '__main__':
+    unittest.main()
@@ -0,0 +1,115 @@
+"""
+Test the query server and its client.
+"""
+
+import asyncio
+import os
+import shutil
+from concurrent import futures
+import tempfile
+import threading
+import unittest
+from pathlib import Path
+from unittest.mock import patch
+from rock import server, stock
+from rock.client import Client
+from rock.data import db
+
+
+class TestServer(unittest.TestCase):
+    """Test cases for server.py and client.py modules"""
+
+    def setUp(self) -> None:
+        db.create_db()
+        db.insert_exchange('Shanghai Stock Exchange', 'SSE', 'stock')
+        db.insert_securities([
+            ('000001', 'Ping An Bank', 'stock', '19910403', None, 1),
+            ('000002', 'Another Company', 'stock', '19910129', None, 1),
+        ])
+        db.bulk_insert_history([
+            (1, '2025-03-03', 10.0, 11.0, 12.0, 9.0, 10.5, 1000, 1000, '1d'),
+            (1, '2025-03-04', 11.0, 12.0, 13.0, 10.0, 11.5, 2000, 1000, '1d'),
+        ])
+        self.directory = tempfile.TemporaryDirectory()  # pylint: disable=consider-using-with
+        self.address = str(Path(self.directory.name) / 'rock.sock')
+        self.server = server.QueryServer(1 << 20)
+        self.loop = asyncio.new_event_loop()
+        self.thread = threading.Thread(target=self.loop.run_forever, daemon=True)
+        self.thread.start()
+        self.serving = asyncio.run_coroutine_threadsafe(self.server.serve(self.address), self.loop)
+        for _ in range(100):
+            if os.path.exists(self.address):
+                break
+            threading.Event().wait(0.01)
+
+    def tearDown(self) -> None:
+        self.serving.cancel()
+        futures.wait([self.serving])
+        self.loop.call_soon_threadsafe(self.loop.stop)
+        self.thread.join()
+        self.loop.close()
+        self.directory.cleanup()
+        shutil.rmtree(db.shard_dir(), ignore_errors=True)
+        if os.path.exists(db.DB_PATH):
+            os.remove(db.DB_PATH)
+
+    def test_get_history(self) -> None:
+        """Test get_history served from the cache and refreshed after a write."""
+        with Client(self.address) as client:
+            data = client.get_history(['000001', '000002'], start='2025-03-01', end='2025-03-31')
+            self.assertEqual(list(data), ['000001'])
+            df = data['000001']
+            self.assertEqual(len(df), 2)
+            self.assertEqual(df['close'].tolist(), [11.0, 12.0])
+            self.assertEqual(df['volume'].tolist(), [1000, 2000])
+            self.assertEqual(str(df.index[1].date()), '2025-03-04')
+
+            client.get_history(['000001'], start='2025-03-01', end='2025-03-31')
+            self.assertEqual(client.stats()['entries'], 2)
+
+            db.bulk_insert_history([(1, '2025-03-05', 12.0, 13.0, 14.0, 11.0, 12.5, 3000, 1000, '1d')])
+            data = client.get_history(['000001'], start='2025-03-01', end='2025-03-31')
+            self.assertEqual(len(data['000001']), 3)
+            self.assertEqual(client.stats()['entries'], 1)
+
+    def test_get_history_options(self) -> None:
+        """Test passing adjust and frequency through, cached apart from the defaults."""
+        db.write_history([], adjustments=[(1, '2025-03-04', 2.0)])
+        with Client(self.address) as client:
+            raw = client.get_history(['000001'])['000001']
+            adjusted = client.get_history(['000001'], adjust='forward')['000001']
+            self.assertEqual(raw['close'].tolist(), [11.0, 12.0])
+            expected = stock.get_history(['000001'], adjust='forward')['000001']
+            self.assertEqual(adjusted['close'].tolist(), expected['close'].tolist())
+            self.assertNotEqual(adjusted['close'].tolist(), raw['close'].tolist())
+            self.assertEqual(client.get_history(['000001'], frequency='1m'), {})
+            self.assertEqual(client.stats()['entries'], 3)
+
+    def test_sharded_writes(self) -> None:
+        """Test refreshing the cache after writes committed only to a history shard."""
+        with patch.object(db, 'HISTORY_SHARDING', db.Sharding.YEAR), Client(self.address) as client:
+            db.bulk_insert_history([(2, '2025-03-03', 9.0, 10.0, 11.0, 8.0, 10.0, 100, 1000, '1d')])
+            self.assertEqual(len(client.get_history(['000002'])['000002']), 1)
+            self.assertEqual(len(client.get_history(['000002'])['000002']), 1)
+            self.assertEqual(client.stats()['entries'], 1)
+
+            db.bulk_insert_history([(2, '2025-03-04', 10.0, 11.0, 12.0, 9.0, 11.0, 100, 1000, '1d')])
+            self.assertEqual(len(client.get_history(['000002'])['000002']), 2)
+
+    def test_get_securities(self) -> None:
+        """Test get_securities and errors."""
+        with Client(self.address) as client:
+            self.assertEqual(sorted(client.get_securities()), ['000001', '000002'])
+            with self.assertRaises(RuntimeError):
+                client._request({'op': 'unknown'})  # pylint: disable=protected-access
+
+    def test_cache_eviction(self) -> None:
+        """Test evicting the least recently used entries beyond the size limit."""
+        cache = server.HistoryCache(10)
+        cache.put('a', None, b'12345')
+        cache.put('b', None, b'12345')
+        self.assertIsNotNone(cache.get('a'))
+        cache.put('c', None, b'12345')
+        self.assertIsNone(cache.get('b'))
+        self.assertIsNotNone(cache.get('a'))
+        self.assertEqual(cache.bytes, 10)
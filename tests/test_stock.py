@@ -24,7 +24,7 @@ class TestStock(TestCase):
     def test_get_history(self, mock_get_history) -> None:
         """Test get_history function."""
         data = stock.get_history(['000001', '000002'], start='2023-10-01', end='2023-10-02')
-        mock_get_history.assert_called_once_with(['000001', '000002'], '2023-10-01', '2023-10-02')
+        mock_get_history.assert_called_once_with(['000001', '000002'], '2023-10-01', '2023-10-02', '1d')
 
         self.assertIn('000001', data)
         self.assertIn('000002', data)
@@ -34,6 +34,28 @@ class TestStock(TestCase):
         self.assertEqual(len(df2), 1)
 
 
+    def test_iter_history(self) -> None:
+        """Test iter_history function."""
+        columns = ['symbol', 'security_id', 'datetime', 'open', 'close', 'high', 'low', 'adj_close', 'volume', 'amount', 'frequency']
+        class Row(tuple):
+            """A stand-in for sqlite3.Row."""
+            def keys(self):
+                """Return the column names."""
+                return columns
+        chunks = [
+            [Row(('000001', 1, utils.str_to_dt('2023-10-01'), 10, 11, 12, 9, 11, 1000, 10000, '1d')),
+             Row(('000001', 1, utils.str_to_dt('2023-10-02'), 11, 12, 13, 10, 12, 1500, 15000, '1d'))],
+            [Row(('000002', 2, utils.str_to_dt('2023-10-01'), 20, 21, 22, 19, 21, 2000, 20000, '1d'))],
+        ]
+        with patch('rock.data.db.iter_history', return_value=iter(chunks)) as mock_iter_history:
+            data = list(stock.iter_history(start='2023-10-01', chunk_rows=2))
+            mock_iter_history.assert_called_once_with(None, '2023-10-01', None, 2, frequency='1d')
+
+        self.assertEqual([len(df) for df in data], [2, 1])
+        self.assertEqual(list(data[0].columns), ['symbol', 'datetime', 'open', 'close', 'high', 'low', 'adj_close', 'volume', 'amount'])
+        self.assertEqual(data[1]['symbol'].iloc[0], '000002')
+        self.assertEqual(data[0]['close'].tolist(), [11, 12])
+
     def test_get_securities(self) -> None:
         """Test get_securities function."""
         with patch('rock.data.db.get_all_securities', return_value=[
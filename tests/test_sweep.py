@@ -0,0 +1,77 @@
+"""
+Test sweep.py
+"""
+
+import os
+import unittest
+from unittest.mock import patch
+import numpy as np
+import pandas as pd
+from rock import backtest, panel, sweep
+from rock.data import db
+
+NAME = 'test-sweep'
+
+
+class TestSweep(unittest.TestCase):
+    """Test cases for sweep.py module"""
+
+    def setUp(self) -> None:
+        db.create_db()
+        db.insert_exchange('Shanghai Stock Exchange', 'SSE', 'stock')
+        db.insert_securities([
+            ('600000', 'Pudong Bank', 'stock', '19991110', None, 1),
+            ('600001', 'Another Company', 'stock', '19991110', None, 1),
+        ])
+        rng = np.random.default_rng(0)
+        close = 10 * np.exp(np.cumsum(rng.normal(0, 0.02, (2, 40)), axis=1))
+        dates = (np.datetime64('2025-01-01') + np.arange(40)).astype(str)
+        db.bulk_insert_history([
+            (security_id, dates[t], close[i, t] * 0.99, close[i, t], close[i, t] * 1.02, close[i, t] * 0.98,
+             close[i, t], 1000, 1000, '1d')
+            for i, security_id in enumerate((1, 2)) for t in range(40)
+        ])
+
+    def tearDown(self) -> None:
+        panel.unpublish_panel(NAME)
+        if os.path.exists(db.DB_PATH):
+            os.remove(db.DB_PATH)
+
+    def test_plan_tasks(self) -> None:
+        """Test grouping combinations sharing a signal and ordering tasks by cost."""
+        combinations = backtest.parameter_grid({'n': [5, 10, 20], 'stop_loss': [None, 0.05]})
+        tasks = sweep.plan_tasks(combinations, 2, cost=lambda group: group[0]['n'])
+        self.assertEqual([[c['n'] for c in task] for task in tasks], [[20, 20], [10, 10], [5, 5]])
+        tasks = sweep.plan_tasks(combinations, 1, min_size=4)
+        self.assertEqual([len(task) for task in tasks], [4, 2])
+        tasks = sweep.plan_tasks(combinations, 1, min_size=6, max_size=3)
+        self.assertEqual([len(task) for task in tasks], [2, 2, 2])
+
+    def test_sweep(self) -> None:
+        """Test that a sweep in worker processes gives the results of a single backtest."""
+        params = {'n': [3, 5, 10], 'stop_loss': [None, 0.02]}
+        results = list(sweep.sweep('close > sma(close, {n})', params, workers=2))
+        self.assertEqual(sorted(len(result) for result in results), [6])
+        # the temporary panel is removed
+        self.assertEqual(list(panel.PANEL_DIR.glob('sweep-*')), [])
+
+        panel.publish_panel(NAME)
+        # several tasks despite the few symbols
+        with patch('rock.sweep.MIN_TASK_CELLS', 1):
+            merged = pd.concat(sweep.sweep('close > sma(close, {n})', params, panel_name=NAME, workers=2))
+        with panel.attach_panel(NAME) as attached:
+            expected = backtest.backtest('close > sma(close, {n})', attached, params).summary()
+        merged = merged.sort_values(['n', 'stop_loss'], na_position='first', ignore_index=True)
+        expected = expected.sort_values(['n', 'stop_loss'], na_position='first', ignore_index=True)
+        pd.testing.assert_frame_equal(merged, expected)
+
+        # a parameter naming a field publishes the fields of every combination
+        results = pd.concat(sweep.sweep('{field} > 1000', {'field': ['close', 'volume', 'amount']}, workers=1))
+        self.assertEqual(sorted(results['field']), ['amount', 'close', 'volume'])
+
+        with self.assertRaises(FileNotFoundError):
+            next(sweep.sweep('close > 1', {'n': [1]}, panel_name='missing'))
+
+
+if __name__ == '__main__':
+    unittest.main()